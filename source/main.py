@@ -5,6 +5,7 @@ import sys
 import typing
 
 import cv2
+import numpy
 from pathlib import Path
 
 from source.mesh_generation import deform_mesh
@@ -13,7 +14,8 @@ from source.topology import floodfill
 from source.topology import euler
 from source.topology import basic_mesh
 from source.util import dir_utils
-from source.map_generation.test import test
+from source.map_generation import predictor as map_predictor
+from source.map_generation.predictor import MapPredictor
 from source.util import OpenEXR_utils
 from source.util import data_type
 from source.util import parse
@@ -27,7 +29,8 @@ def topology(
         sketch_path: str,
         genus_dir: str,
         output_dir: str,
-        use_genus0: bool
+        use_genus0: bool,
+        registry: basic_mesh.BasicMeshRegistry = None
 ) -> typing.Tuple[str, str]:
     image = sketch_utils.load_image(sketch_path, True)
     filled_image, exr_path = floodfill.startFill(image, sketch_path, output_dir, False)
@@ -35,43 +38,40 @@ def topology(
         holes = euler.get_number_holes(filled_image)
     else:
         holes = 0
-    basic_mesh_path = basic_mesh.get_basic_mesh_path(holes, genus_dir)
+    basic_mesh_path = basic_mesh.get_basic_mesh_path(holes, genus_dir, registry)
     return basic_mesh_path, exr_path
 
 
 # Map Generation
 # 2. put cleaned input sketch into trained neural network normal
 # 3. put cleaned input sketch into trained neural network depth
+# Maps are predicted in memory, the exr files in output_dir are only written for inspection
 def map_generation(
         input_sketch: str,
         output_dir: str,
-        normal_map_gen_model: str,
-        depth_map_gen_model: str,
-        log_dir_normal: str,
-        log_dir_depth: str
-) -> typing.Tuple[str, str]:
-    sketch_filepath = os.path.join(output_dir, 'sketch_map_generation')
-    sketch_filepath_test = os.path.join(sketch_filepath, 'test')
-    if not os.path.exists(sketch_filepath_test):
-        dir_utils.create_general_folder(sketch_filepath_test)
-    sketch_utils.clean_userinput(input_sketch, sketch_filepath_test)
-    normal_output_path = os.path.join(output_dir, 'normal')
-    if not os.path.exists(normal_output_path):
-        dir_utils.create_general_folder(normal_output_path)
-    depth_output_path = os.path.join(output_dir, 'depth')
-    if not os.path.exists(depth_output_path):
-        dir_utils.create_general_folder(depth_output_path)
-    test(output_dir, normal_output_path, log_dir_normal, data_type.Type.normal, normal_map_gen_model)
-    test(output_dir, depth_output_path, log_dir_depth, data_type.Type.depth, depth_map_gen_model)
-    return normal_output_path, depth_output_path
+        predictor: MapPredictor
+) -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
+    # sketches are resized to the resolution of the models, which predict their maps natively at that resolution
+    sketch = sketch_utils.normalize_sketch(input_sketch, predictor.dim)
+    normal_map, depth_map = predictor.predict(sketch)
+    prefix = Path(input_sketch).stem.rsplit('_', 1)[0]
+    with OpenEXR_utils.BackgroundWriter() as writer:
+        for map_type, map_image in ((data_type.Type.normal, normal_map), (data_type.Type.depth, depth_map)):
+            map_output_path = os.path.join(output_dir, map_type.name)
+            if not os.path.exists(map_output_path):
+                dir_utils.create_general_folder(map_output_path)
+            OpenEXR_utils.writeImage(map_image, map_type,
+                                     os.path.join(map_output_path, '{}_{}.exr'.format(prefix, map_type.name)),
+                                     writer=writer)
+    return normal_map, depth_map
 
 
 # Mesh deformation
 # 1. put input mesh and normal and depth map into mesh deformation
 def mesh_deformation(
         output_name: str,
-        normal_map_path: str,
-        depth_map_path: str,
+        normal_map: numpy.ndarray,
+        depth_map: numpy.ndarray,
         silhouette_map_path: str,
         basic_mesh_path: str,
         output_dir: str,
@@ -91,25 +91,20 @@ def mesh_deformation(
 ):
     if not os.path.exists(logs_dir):
         dir_utils.create_version_folder(logs_dir)
-    if resize:
-        mesh_gen = deform_mesh.MeshGen(output_name, output_dir, logs_dir,
-                                       weight_depth, weight_normal, weight_smoothness, weight_silhouette, weight_edge,
-                                       epochs, log_frequency, lr, views, use_depth, eval_dir, dim=64)
-    else:
-        mesh_gen = deform_mesh.MeshGen(output_name, output_dir, logs_dir,
-                                       weight_depth, weight_normal, weight_smoothness, weight_silhouette, weight_edge,
-                                       epochs, log_frequency, lr, views, use_depth, eval_dir, dim=256)
-    normal_map = OpenEXR_utils.getImageEXR(normal_map_path, data_type.Type.normal, 2)
-    depth_map = OpenEXR_utils.getImageEXR(depth_map_path, data_type.Type.depth, 2).squeeze()
+    # the mesh is deformed at the resolution of the maps, which is the resolution of the map generation models
+    dim = 64 if resize else normal_map.shape[0]
+    mesh_gen = deform_mesh.MeshGen(output_name, output_dir, logs_dir,
+                                   weight_depth, weight_normal, weight_smoothness, weight_silhouette, weight_edge,
+                                   epochs, log_frequency, lr, views, use_depth, eval_dir, dim=dim)
     silhouette_map = OpenEXR_utils.getImageEXR(silhouette_map_path, data_type.Type.silhouette, 2).squeeze()
-    # resize and downsample image for shapenet
+    # resize and downsample image for shapenet, only needed if the map generation models are not trained at 64x64
     # only view resulting images via exr viewer not png generated from save_render, since conversion to unit8 can
     # introduce wrong image values in depth map for whatever reason, which at that resolution is very obvious
-    if resize:
-        print("Resize only possible for 64x64 for now, change if different are needed")
-        normal_map = cv2.resize(normal_map, dsize=(64, 64), interpolation=cv2.INTER_LANCZOS4)
-        depth_map = cv2.resize(depth_map, dsize=(64, 64), interpolation=cv2.INTER_LANCZOS4)
-        silhouette_map = cv2.resize(silhouette_map, dsize=(64, 64), interpolation=cv2.INTER_NEAREST)
+    if normal_map.shape[0] != dim:
+        normal_map = cv2.resize(normal_map, dsize=(dim, dim), interpolation=cv2.INTER_LANCZOS4)
+        depth_map = cv2.resize(depth_map, dsize=(dim, dim), interpolation=cv2.INTER_LANCZOS4)
+    if silhouette_map.shape[0] != dim:
+        silhouette_map = cv2.resize(silhouette_map, dsize=(dim, dim), interpolation=cv2.INTER_NEAREST)
     mesh_gen.deform_mesh(normal_map, depth_map, silhouette_map, basic_mesh_path)
 
 
@@ -131,7 +126,12 @@ def run(input_sketch: str,
         use_depth: bool,
         use_genus0: bool,
         eval_dir: str,
-        use_resize: bool
+        use_resize: bool,
+        registry: basic_mesh.BasicMeshRegistry = None,
+        predictor: MapPredictor = None,
+        map_gen_backend: str = 'torch',
+        intra_op_threads: int = 0,
+        inter_op_threads: int = 0
         ):
     for x in (input_sketch, depth_map_gen_model, normal_map_gen_model):
         if not os.path.exists(x):
@@ -144,22 +144,16 @@ def run(input_sketch: str,
     logs_dir = dir_utils.create_prefix_folder(prefix, logs_dir)
     eval_dir = dir_utils.create_general_folder(eval_dir)
 
-    determined_basic_mesh, silhouette_map_path = topology(input_sketch, genus_dir, output_dir, use_genus0)
-    logs_map_generation_normal = os.path.join(logs_dir, 'map_generation_normal')
-    if not os.path.exists(logs_map_generation_normal):
-        dir_utils.create_general_folder(logs_map_generation_normal)
-    logs_map_generation_depth = os.path.join(logs_dir, 'map_generation_depth')
-    if not os.path.exists(logs_map_generation_depth):
-        dir_utils.create_general_folder(logs_map_generation_depth)
-    normal_output_path, depth_output_path = map_generation(input_sketch, output_dir, normal_map_gen_model,
-                                                           depth_map_gen_model,
-                                                           logs_map_generation_normal, logs_map_generation_depth)
+    determined_basic_mesh, silhouette_map_path = topology(input_sketch, genus_dir, output_dir, use_genus0,
+                                                          registry)
+    if predictor is None:
+        predictor = MapPredictor(normal_map_gen_model, depth_map_gen_model, backend=map_gen_backend,
+                                 intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads)
+    normal_map, depth_map = map_generation(input_sketch, output_dir, predictor)
 
     logs_meshGen = os.path.join(logs_dir, 'mesh_generation')
     if not os.path.exists(logs_meshGen):
         dir_utils.create_general_folder(logs_meshGen)
-    normal_map = os.path.join(normal_output_path, '{}_normal.exr'.format(prefix))
-    depth_map = os.path.join(depth_output_path, '{}_depth.exr'.format(prefix))
     mesh_deformation(prefix, normal_map, depth_map, silhouette_map_path, determined_basic_mesh, output_dir, logs_meshGen,
                      weight_depth, weight_normal, weight_smoothness, weight_silhouette, weight_edge,
                      epochs_mesh_gen, log_frequency_mesh_gen, lr_mesh_gen, views, use_depth, eval_dir, use_resize)
@@ -184,7 +178,10 @@ def diff_ars(args):
         args.use_depth,
         args.use_genus0,
         args.eval_dir,
-        args.resize
+        args.resize,
+        map_gen_backend=args.map_gen_backend,
+        intra_op_threads=args.intra_op_threads,
+        inter_op_threads=args.inter_op_threads
         )
 
 
@@ -197,9 +194,13 @@ def main(args):
     parser.add_argument("--genus_dir", type=str, default="datasets/topology_meshes",
                         help="Path to the directory where the genus templates are stored")
     parser.add_argument("--depth_map_gen_model", type=str, default="datasets/mapgen_test_models/depth.ckpt",
-                        help="Path to model, which is used to determine depth map.")
+                        help="Path to model, which is used to determine depth map. Checkpoints and slim models (see "
+                             "map_generation/slim_generator.py) are supported by the torch backend, both also of "
+                             "distilled student generators (see map_generation/distillation_report.py).")
     parser.add_argument("--normal_map_gen_model", type=str, default="datasets/mapgen_test_models/normal.ckpt",
-                        help="Path to model, which is used to determine normal map.")
+                        help="Path to model, which is used to determine normal map. Checkpoints and slim models (see "
+                             "map_generation/slim_generator.py) are supported by the torch backend, both also of "
+                             "distilled student generators (see map_generation/distillation_report.py).")
     parser.add_argument("--epochs_mesh_gen", type=int, default=40000, help="# of epoch for mesh generation")
     parser.add_argument("--log_frequency_mesh_gen", type=int, default=100,
                         help="frequency image logs of the mesh generation are written")
@@ -223,7 +224,19 @@ def main(args):
                         help="Additional directory to store only mesh for evaluation")
     # Use for comparison since Neural mesh renderer works with 64x64 images
     parser.add_argument("--resize", type=parse.p_bool, default="False",
-                        help="Whether or not normal and depth map should be resized to 64x64")
+                        help="Whether or not normal and depth map should be resized to 64x64, not needed for map "
+                             "generation models trained at 64x64")
+    # Use onnx or int8 with the exported models (see map_generation/onnx_generator.py and map_generation/quantize.py)
+    # given as map generation models
+    parser.add_argument("--map_gen_backend", type=str, default="torch", choices=map_predictor.backends,
+                        help="Backend of the map generation; \"torch\" runs the checkpoints, \"onnx\" runs exported "
+                             "ONNX models with onnxruntime on the cpu, \"int8\" runs quantized TorchScript models on "
+                             "the cpu")
+    parser.add_argument("--intra_op_threads", type=int, default=0,
+                        help="# of threads used within an operation of the map generation, chosen by the runtime if 0")
+    parser.add_argument("--inter_op_threads", type=int, default=0,
+                        help="# of threads used for parallel operations of the onnx backend, chosen by the runtime if "
+                             "0")
     args = parser.parse_args(args)
     diff_ars(args)
 
@@ -0,0 +1,100 @@
+# Training throughput of MapGen on the cpu
+# Runs the updates of the default training loop (see critic_benchmark.frequency_cycle) on random batches with float32 or
+# bfloat16 autocast and contiguous or channels last tensors and reports the trained samples per second.
+import argparse
+import sys
+import time
+
+import torch
+
+from source.map_generation import critic_benchmark
+from source.map_generation.map_generation import MapGen
+from source.util import cpu_utils
+from source.util import data_type
+from source.util import parse
+
+configurations = (('float32', False), ('float32', True), ('bfloat16', False), ('bfloat16', True))
+
+
+# Endless random batches of sketches and targets in [-1, 1]
+def random_batches(
+        channel: int,
+        dim: int,
+        batch_size: int,
+        channels_last: bool
+):
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+    while True:
+        sketch = torch.where(torch.rand((batch_size, 1, dim, dim)) > 0.9, 1., -1.).expand(-1, channel, -1, -1)
+        yield {'input': sketch.contiguous(memory_format=memory_format),
+               'target': (torch.rand((batch_size, channel, dim, dim)) * 2 - 1).contiguous(memory_format=memory_format)}
+
+
+# Trained samples per second of the cycles after one warm-up cycle
+def measure(
+        model: MapGen,
+        dim: int,
+        batch_size: int,
+        cycles: int,
+        precision: str,
+        channels_last: bool
+) -> float:
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    optimizers = model.configure_optimizers()
+    opt_g, opt_d = optimizers[0]['optimizer'], optimizers[1]['optimizer']
+    batches = random_batches(model.channel, dim, batch_size, channels_last)
+    with torch.autocast('cpu', dtype=torch.bfloat16, enabled=precision == 'bfloat16'):
+        critic_benchmark.frequency_cycle(model, batches, opt_g, opt_d)
+        start = time.perf_counter()
+        for _ in range(cycles):
+            critic_benchmark.frequency_cycle(model, batches, opt_g, opt_d)
+    return cycles * (model.n_critic + 1) * batch_size / (time.perf_counter() - start)
+
+
+def run(
+        input_data_type: data_type.Type,
+        dims: list,
+        batch_size: int,
+        cycles: int,
+        n_critic: int,
+        intra_op_threads: int
+):
+    train_cores, _ = cpu_utils.split_cores(intra_op_threads)
+    cpu_utils.pin_process(train_cores)
+    print("{} intra-op threads".format(torch.get_num_threads()))
+    print("{:>6} {:>10} {:>14} {:>12}".format('dim', 'precision', 'channels last', 'samples/s'))
+    for dim in dims:
+        for precision, channels_last in configurations:
+            torch.manual_seed(0)
+            model = MapGen(input_data_type, n_critic, 500, 10, '', 2e-5, batch_size, dim).train()
+            samples_per_second = measure(model, dim, batch_size, cycles, precision, channels_last)
+            print("{:6d} {:>10} {:>14} {:12.3f}".format(dim, precision, str(channels_last), samples_per_second))
+
+
+def diff_args(args):
+    run(args.input_data_type,
+        args.dims,
+        args.batch_size,
+        args.cycles,
+        args.n_critic,
+        args.intra_op_threads)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog="map_generation_cpu_benchmark")
+    parser.add_argument("--input_data_type", type=parse.p_data_type, default="normal", dest="input_data_type",
+                        help="use \"normal\" or \"depth\" as type of the model")
+    parser.add_argument("--dims", type=int, nargs='+', default=[64, 256],
+                        help="Resolutions of the sketches, the models are built for each resolution")
+    parser.add_argument("--batch_size", type=int, default=4, help="size of batches")
+    parser.add_argument("--cycles", type=int, default=2, help="# of measured critic cycles")
+    parser.add_argument("--n_critic", type=int, default=5, help="# of n_critic")
+    parser.add_argument("--intra_op_threads", type=int, default=0,
+                        help="# of threads used within an operation, all but one core if 0")
+    args = parser.parse_args(args)
+    diff_args(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
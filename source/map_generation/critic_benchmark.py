@@ -0,0 +1,177 @@
+# Throughput comparison of the MapGen training loops without the trainer
+# The default loop updates one optimizer per batch with the optimizer frequencies of MapGen, so the generator runs once
+# per update. The manual loop of MapGenManual runs the generator once per batch for a whole critic cycle. Both loops
+# start from the same weights and run the same # of critic cycles on the train split, their losses are printed side by
+# side.
+import argparse
+import copy
+import itertools
+import os
+import sys
+import time
+
+import torch
+from torch.utils.data import DataLoader
+
+from source.map_generation.map_generation import MapGen
+from source.map_generation_dataset import dataset
+from source.map_generation_dataset import manifest as dataset_manifest
+from source.map_generation_dataset import transport
+from source.util import data_type
+from source.util import parse
+
+
+# Endless batches on the device at the resolution of the model
+def batches(
+        dataloader: DataLoader,
+        device: str,
+        dim: int
+):
+    for sample_batched in itertools.cycle(dataloader):
+        yield transport.resize_batch({key: value.to(device) for key, value in sample_batched.items()
+                                      if isinstance(value, torch.Tensor)}, dim)
+
+
+# Updates of one critic cycle as the trainer performs them with the optimizer frequencies of MapGen: one generator
+# update and n_critic critic updates, each on its own batch. The trainer disables the gradients of the weights of the
+# other optimizer during an update.
+def frequency_cycle(
+        model: MapGen,
+        batch_iterator,
+        opt_g: torch.optim.Optimizer,
+        opt_d: torch.optim.Optimizer
+) -> tuple:
+    sample_batched = next(batch_iterator)
+    model.D.requires_grad_(False)
+    g_loss = model.generator_loss(sample_batched, model(sample_batched))
+    opt_g.zero_grad()
+    g_loss.backward()
+    opt_g.step()
+    model.D.requires_grad_(True)
+
+    model.G.requires_grad_(False)
+    for _ in range(model.n_critic):
+        sample_batched = next(batch_iterator)
+        d_losses = model.discriminator_loss(sample_batched, model(sample_batched))
+        opt_d.zero_grad()
+        d_losses[0].backward()
+        opt_d.step()
+    model.G.requires_grad_(True)
+    return g_loss, d_losses
+
+
+def manual_cycle(
+        model: MapGen,
+        batch_iterator,
+        opt_g: torch.optim.Optimizer,
+        opt_d: torch.optim.Optimizer
+) -> tuple:
+    return model.critic_cycle(next(batch_iterator), opt_g, opt_d, torch.Tensor.backward)
+
+
+# Runs the cycles after one warm-up cycle, returns the losses of each cycle and the time of all cycles
+def run_loop(
+        model: MapGen,
+        cycle,
+        dataloader: DataLoader,
+        cycles: int,
+        device: str
+) -> tuple:
+    model = model.to(device).train()
+    optimizers = model.configure_optimizers()
+    opt_g, opt_d = optimizers[0]['optimizer'], optimizers[1]['optimizer']
+    batch_iterator = batches(dataloader, device, model.dim)
+    cycle(model, batch_iterator, opt_g, opt_d)
+
+    losses = []
+    if device == 'cuda':
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(cycles):
+        g_loss, d_losses = cycle(model, batch_iterator, opt_g, opt_d)
+        losses.append((g_loss.detach(), d_losses[0].detach()))
+    if device == 'cuda':
+        torch.cuda.synchronize()
+    return [(g_loss.item(), d_loss.item()) for g_loss, d_loss in losses], time.perf_counter() - start
+
+
+def run(
+        input_dir: str,
+        input_data_type: data_type.Type,
+        batch_size: int,
+        cycles: int,
+        n_critic: int,
+        lr: float,
+        weight_L1: int,
+        gradient_penalty_coefficient: int,
+        log_frequency: int,
+        seed: int,
+        dim: int = 256
+):
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    dataSet = dataset.DS(True, input_data_type, os.path.join(input_dir, 'sketch_map_generation', 'train'),
+                         os.path.join(input_dir, 'target_map_generation', 'train'),
+                         dataset_manifest.Manifest(input_dir))
+    if len(dataSet) <= 0:
+        raise Exception("No samples in train split of {}".format(input_dir))
+    torch.manual_seed(seed)
+    model = MapGen(input_data_type, n_critic, weight_L1, gradient_penalty_coefficient, '', lr, batch_size, dim)
+
+    results = {}
+    for name, cycle in (('frequency', frequency_cycle), ('manual', manual_cycle)):
+        # same weights, batches and interpolation factors of the gradient penalty for both loops
+        torch.manual_seed(seed)
+        dataloader = DataLoader(dataSet, batch_size=batch_size, shuffle=True, drop_last=True,
+                                generator=torch.Generator().manual_seed(seed))
+        results[name] = run_loop(copy.deepcopy(model), cycle, dataloader, cycles, device)
+
+    print("{:>6} {:>14} {:>14} {:>14} {:>14}".format('cycle', 'g_loss freq', 'd_loss freq', 'g_loss manual',
+                                                     'd_loss manual'))
+    for i in range(0, cycles, log_frequency):
+        print("{:6d} {:14.4f} {:14.4f} {:14.4f} {:14.4f}".format(i, *results['frequency'][0][i],
+                                                                 *results['manual'][0][i]))
+
+    updates = cycles * (n_critic + 1)
+    print("{:>10} {:>12} {:>12} {:>18}".format('loop', 'updates/s', 'batches/s', 'generator passes'))
+    for name, batches_per_cycle in (('frequency', n_critic + 1), ('manual', 1)):
+        duration = results[name][1]
+        print("{:>10} {:12.2f} {:12.2f} {:18d}".format(name, updates / duration, cycles * batches_per_cycle / duration,
+                                                        cycles * batches_per_cycle))
+
+
+def diff_args(args):
+    run(args.input_dir,
+        args.input_data_type,
+        args.batch_size,
+        args.cycles,
+        args.n_critic,
+        args.lr,
+        args.weight_L1,
+        args.gradient_penalty_coefficient,
+        args.log_frequency,
+        args.seed,
+        args.dim)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog="map_generation_critic_benchmark")
+    parser.add_argument("--input_dir", type=str, default="datasets/mixed_normal",
+                        help="Directory with sketch_map_generation and target_map_generation, the train split is used")
+    parser.add_argument("--input_data_type", type=parse.p_data_type, default="normal", dest="input_data_type",
+                        help="use \"normal\" or \"depth\" as type of the model")
+    parser.add_argument("--batch_size", type=int, default=4, help="size of batches")
+    parser.add_argument("--cycles", type=int, default=20, help="# of measured critic cycles of each loop")
+    parser.add_argument("--n_critic", type=int, default=5, help="# of n_critic")
+    parser.add_argument("--lr", type=float, default=2e-5, help="initial learning rate")
+    parser.add_argument("--weight_L1", type=int, default=500, help="L1 weight")
+    parser.add_argument("--gradient_penalty_coefficient", type=int, default=10, help="gradient penalty coefficient")
+    parser.add_argument("--log_frequency", type=int, default=1, help="frequency the losses of the cycles are printed")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the weights and the order of the batches")
+    parser.add_argument("--dim", type=int, default=256,
+                        help="Resolution of the model, batches of other resolutions are resized on the device")
+    args = parser.parse_args(args)
+    diff_args(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,194 @@
+# Scaling of data parallel MapGen training on cpus over gloo
+# For each # of ranks, the trainer trains MapGen as train.py does on cpus: DDPStrategy over gloo with one process per
+# rank started by the trainer, the datasets sharded between the ranks by the samplers and the cores of the host split
+# between the ranks. The batches are random sketches and targets kept in memory, so no data loader workers are used.
+# Each # of ranks is trained in its own run of this module, whose rank 0 writes the trained samples per second to a
+# file. Reports the trained samples per second of all ranks and the scaling efficiency compared to one rank.
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import torch
+from pytorch_lightning.callbacks import Callback
+from pytorch_lightning.strategies import DDPStrategy
+from pytorch_lightning.trainer import Trainer
+from torch.utils.data import DataLoader
+from torch.utils.data import Dataset
+
+from source.map_generation.map_generation import MapGen
+from source.map_generation_dataset import sampler
+from source.util import cpu_utils
+from source.util import data_type
+from source.util import parse
+
+
+# Random sketches and targets in [-1, 1], generated once with a fixed seed
+class RandomDataset(Dataset):
+    def __init__(
+            self,
+            channel: int,
+            dim: int,
+            size: int
+    ):
+        generator = torch.Generator().manual_seed(0)
+        sketch = torch.where(torch.rand((size, 1, dim, dim), generator=generator) > 0.9, 1., -1.)
+        self.inputs = sketch.expand(-1, channel, -1, -1).contiguous()
+        self.targets = torch.rand((size, channel, dim, dim), generator=generator) * 2 - 1
+
+    def __len__(self) -> int:
+        return len(self.inputs)
+
+    def __getitem__(self, index):
+        return {'input': self.inputs[index], 'target': self.targets[index]}
+
+
+# Measures the training steps after the first warmup_steps steps of the epoch
+class StepTimer(Callback):
+    def __init__(
+            self,
+            warmup_steps: int
+    ):
+        self.warmup_steps = warmup_steps
+        self.start = None
+        self.end = None
+        self.steps = 0
+
+    def on_train_batch_start(self, trainer, pl_module, batch, batch_idx):
+        if batch_idx == self.warmup_steps:
+            self.start = time.perf_counter()
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx):
+        if batch_idx >= self.warmup_steps:
+            self.end = time.perf_counter()
+            self.steps += 1
+
+
+# Trains world_size ranks for one critic cycle of warmup and cycles measured critic cycles of the default loop (one
+# update per batch with the optimizer frequencies of MapGen). Runs in every rank, rank 0 writes the samples per second
+# of all ranks to result_path.
+def train_ranks(
+        world_size: int,
+        input_data_type: data_type.Type,
+        dim: int,
+        batch_size: int,
+        cycles: int,
+        n_critic: int,
+        intra_op_threads: int,
+        precision: str,
+        channels_last: bool,
+        result_path: str
+):
+    train_cores, _ = cpu_utils.split_cores(intra_op_threads, world_size, int(os.environ.get('LOCAL_RANK', 0)))
+    cpu_utils.pin_process(train_cores)
+
+    # same weights on all ranks, different batches
+    torch.manual_seed(0)
+    model = MapGen(input_data_type, n_critic, 500, 10, '', 2e-5, batch_size, dim)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+        model.channels_last = True
+    steps = (cycles + 1) * (n_critic + 1)
+    dataset = RandomDataset(model.channel, dim, steps * batch_size * world_size)
+    dataloader = DataLoader(dataset, batch_size=batch_size, sampler=sampler.create_sampler(dataset, True, 0))
+
+    timer = StepTimer(n_critic + 1)
+    trainer = Trainer(accelerator='cpu',
+                      devices=world_size,
+                      max_epochs=1,
+                      callbacks=[timer],
+                      logger=False,
+                      enable_checkpointing=False,
+                      enable_progress_bar=False,
+                      enable_model_summary=False,
+                      precision='bf16' if precision == 'bfloat16' else 32,
+                      strategy=DDPStrategy(process_group_backend='gloo') if world_size > 1 else None)
+    trainer.fit(model, dataloader)
+    if trainer.global_rank == 0:
+        with open(result_path, 'w') as file:
+            file.write(str(world_size * timer.steps * batch_size / (timer.end - timer.start)))
+
+
+def run(
+        input_data_type: data_type.Type,
+        ranks: list,
+        dim: int,
+        batch_size: int,
+        cycles: int,
+        n_critic: int,
+        intra_op_threads: int,
+        precision: str,
+        channels_last: bool,
+        result_path: str = ''
+):
+    if len(result_path) > 0:
+        train_ranks(ranks[0], input_data_type, dim, batch_size, cycles, n_critic, intra_op_threads, precision,
+                    channels_last, result_path)
+        return
+
+    print("{} cores, {} {}, channels last {}".format(len(cpu_utils.available_cores()), dim, precision, channels_last))
+    print("{:>6} {:>12} {:>16} {:>12}".format('ranks', 'samples/s', 'samples/s/rank', 'efficiency'))
+    samples_per_second_1 = None
+    with tempfile.TemporaryDirectory() as result_dir:
+        for world_size in ranks:
+            # the trainer starts the other ranks by running the command of rank 0 again
+            rank_result_path = os.path.join(result_dir, 'ranks{}'.format(world_size))
+            subprocess.run([sys.executable, '-m', 'source.map_generation.ddp_benchmark',
+                            '--input_data_type', input_data_type.name,
+                            '--ranks', str(world_size),
+                            '--dim', str(dim),
+                            '--batch_size', str(batch_size),
+                            '--cycles', str(cycles),
+                            '--n_critic', str(n_critic),
+                            '--intra_op_threads', str(intra_op_threads),
+                            '--precision', precision,
+                            '--channels_last', str(channels_last),
+                            '--result_path', rank_result_path], check=True)
+            with open(rank_result_path) as file:
+                samples_per_second = float(file.read())
+            if samples_per_second_1 is None:
+                samples_per_second_1 = samples_per_second / world_size
+            print("{:6d} {:12.3f} {:16.3f} {:12.2f}".format(world_size, samples_per_second,
+                                                            samples_per_second / world_size,
+                                                            samples_per_second / (world_size * samples_per_second_1)))
+
+
+def diff_args(args):
+    run(args.input_data_type,
+        args.ranks,
+        args.dim,
+        args.batch_size,
+        args.cycles,
+        args.n_critic,
+        args.intra_op_threads,
+        args.precision,
+        args.channels_last,
+        args.result_path)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog="map_generation_ddp_benchmark")
+    parser.add_argument("--input_data_type", type=parse.p_data_type, default="normal", dest="input_data_type",
+                        help="use \"normal\" or \"depth\" as type of the model")
+    parser.add_argument("--ranks", type=int, nargs='+', default=[1, 2, 4, 8], help="# of local processes to compare")
+    parser.add_argument("--dim", type=int, default=256, help="Resolution of the sketches")
+    parser.add_argument("--batch_size", type=int, default=4, help="size of batches of each rank")
+    parser.add_argument("--cycles", type=int, default=2, help="# of measured critic cycles")
+    parser.add_argument("--n_critic", type=int, default=5, help="# of n_critic")
+    parser.add_argument("--intra_op_threads", type=int, default=0,
+                        help="# of threads used within an operation by each rank, all but one core of the rank if 0")
+    parser.add_argument("--precision", type=str, default="bfloat16", choices=['float32', 'bfloat16'],
+                        help="Train with float32 or bfloat16 autocast")
+    parser.add_argument("--channels_last", type=parse.p_bool, default="True", dest="channels_last",
+                        help="Train with channels last tensors; use \"True\" or \"False\" as parameter")
+    parser.add_argument("--result_path", type=str, default="",
+                        help="File rank 0 writes the samples per second of a single # of ranks to, only the first # "
+                             "of ranks is trained if given; used for the run of each # of ranks")
+    args = parser.parse_args(args)
+    diff_args(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -4,15 +4,19 @@ import torch.nn as nn
 
 
 class Discriminator(nn.Module):
-    def __init__(self, channel: int):
+    # The layer norms are over the feature maps of inputs of resolution dim x dim. The 4x4 kernel of conv5 needs feature
+    # maps of at least 2x2, so dim is at least 32.
+    def __init__(self, channel: int, dim: int = 256):
         super(Discriminator, self).__init__()
+        if dim < 32 or dim % 16 != 0:
+            raise Exception("Resolution {} is no multiple of 16 of at least 32!".format(dim))
         self.conv1 = nn.Conv2d(2 * channel, 64, kernel_size=4, stride=2, padding=1)
         self.conv2 = nn.Conv2d(64, 128, kernel_size=4, stride=2, padding=1)
-        self.conv2_ln = nn.LayerNorm([128, 64, 64])
+        self.conv2_ln = nn.LayerNorm([128, dim // 4, dim // 4])
         self.conv3 = nn.Conv2d(128, 256, kernel_size=4, stride=2, padding=1)
-        self.conv3_ln = nn.LayerNorm([256, 32, 32])
+        self.conv3_ln = nn.LayerNorm([256, dim // 8, dim // 8])
         self.conv4 = nn.Conv2d(256, 512, kernel_size=4, stride=2, padding=1)
-        self.conv4_ln = nn.LayerNorm([512, 16, 16])
+        self.conv4_ln = nn.LayerNorm([512, dim // 16, dim // 16])
         self.conv5 = nn.Conv2d(512, 1, kernel_size=4, stride=1, padding=1)
         self.lrelu = nn.LeakyReLU(0.2, inplace=True)
 
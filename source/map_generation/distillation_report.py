@@ -0,0 +1,129 @@
+# Speed and quality of distilled student generators compared to their teachers
+# For normal and depth, teacher and student (checkpoints or slim artifacts, see predictor.load_torch_generator) are
+# evaluated on a sample of the test split of their dataset at the resolution of the models. Reports the # of
+# parameters, the latency of one sketch on the cpu, the L1 error to the targets and to the maps of the teacher and for
+# normal maps the mean angular error (see quantize.evaluate).
+import argparse
+import sys
+
+import torch
+
+from source.map_generation import onnx_generator
+from source.map_generation import quantize
+from source.map_generation.predictor import load_torch_generator
+from source.map_generation_dataset import manifest as dataset_manifest
+from source.util import data_type
+
+
+def parameters(
+        model: torch.nn.Module
+) -> int:
+    return sum(parameter.numel() for parameter in model.parameters())
+
+
+# Results of teacher and student of one map type
+def compare(
+        teacher_path: str,
+        student_path: str,
+        input_dir: str,
+        input_data_type: data_type.Type,
+        evaluation_size: int,
+        batch_size: int,
+        repetitions: int
+) -> dict:
+    channel = 3 if input_data_type == data_type.Type.normal else 1
+    teacher = load_torch_generator(teacher_path, channel, 'cpu')
+    student = load_torch_generator(student_path, channel, 'cpu')
+    if student.dim != teacher.dim:
+        raise Exception("Student has resolution {}, but teacher {}!".format(student.dim, teacher.dim))
+    dataloader = quantize.sample_loader(input_dir, 'test', input_data_type, dataset_manifest.Manifest(input_dir),
+                                        evaluation_size, batch_size, teacher.dim)
+    sketch = torch.where(torch.rand((1, 1, teacher.dim, teacher.dim)) > 0.9, 1., -1.).expand(-1, channel, -1, -1)
+    results = {}
+    for name, model in (('teacher', teacher), ('student', student)):
+        results[name] = quantize.evaluate(model, teacher, dataloader, input_data_type)
+        results[name]['parameters'] = parameters(model)
+        with torch.inference_mode():
+            results[name]['latency'] = onnx_generator.time_model(model, sketch, repetitions)
+    return results
+
+
+def report(
+        results: dict
+):
+    print("{:>6} {:>8} {:>12} {:>11} {:>8} {:>10} {:>10} {:>12}".format('type', 'model', 'parameters M', 'latency ms',
+                                                                         'speedup', 'L1', 'L1 teacher',
+                                                                         'angular deg'))
+    for input_data_type, type_results in results.items():
+        for name, result in type_results.items():
+            angular = "{:12.3f}".format(result['angular']) if 'angular' in result else "{:>12}".format('-')
+            print("{:>6} {:>8} {:12.2f} {:11.2f} {:8.2f} {:10.5f} {:10.5f} {}".format(
+                input_data_type.name, name, result['parameters'] / 1e6, result['latency'] * 1000,
+                type_results['teacher']['latency'] / result['latency'], result['l1'], result['l1_reference'], angular))
+
+
+def run(
+        normal_teacher_path: str,
+        normal_student_path: str,
+        normal_input_dir: str,
+        depth_teacher_path: str,
+        depth_student_path: str,
+        depth_input_dir: str,
+        evaluation_size: int,
+        batch_size: int,
+        repetitions: int,
+        intra_op_threads: int
+):
+    if intra_op_threads > 0:
+        torch.set_num_threads(intra_op_threads)
+    results = {}
+    for input_data_type, teacher_path, student_path, input_dir in (
+            (data_type.Type.normal, normal_teacher_path, normal_student_path, normal_input_dir),
+            (data_type.Type.depth, depth_teacher_path, depth_student_path, depth_input_dir)):
+        # types without student are skipped
+        if len(student_path) > 0:
+            results[input_data_type] = compare(teacher_path, student_path, input_dir, input_data_type,
+                                               evaluation_size, batch_size, repetitions)
+    report(results)
+
+
+def diff_args(args):
+    run(args.normal_teacher_path,
+        args.normal_student_path,
+        args.normal_input_dir,
+        args.depth_teacher_path,
+        args.depth_student_path,
+        args.depth_input_dir,
+        args.evaluation_size,
+        args.batch_size,
+        args.repetitions,
+        args.intra_op_threads)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog="map_generation_distillation_report")
+    parser.add_argument("--normal_teacher_path", type=str, default="datasets/mapgen_test_models/normal.ckpt",
+                        help="Checkpoint or slim model of the normal teacher")
+    parser.add_argument("--normal_student_path", type=str, default="",
+                        help="Checkpoint or slim model of the normal student, normal is skipped if not given")
+    parser.add_argument("--normal_input_dir", type=str, default="datasets/mixed_normal",
+                        help="Directory with sketch_map_generation and target_map_generation of normal maps, the "
+                             "test split is used")
+    parser.add_argument("--depth_teacher_path", type=str, default="datasets/mapgen_test_models/depth.ckpt",
+                        help="Checkpoint or slim model of the depth teacher")
+    parser.add_argument("--depth_student_path", type=str, default="",
+                        help="Checkpoint or slim model of the depth student, depth is skipped if not given")
+    parser.add_argument("--depth_input_dir", type=str, default="datasets/mixed_depth",
+                        help="Directory with sketch_map_generation and target_map_generation of depth maps, the "
+                             "test split is used")
+    parser.add_argument("--evaluation_size", type=int, default=256, help="# of sketches used for the comparison")
+    parser.add_argument("--batch_size", type=int, default=8, help="size of batches")
+    parser.add_argument("--repetitions", type=int, default=10, help="# of runs to measure the latency")
+    parser.add_argument("--intra_op_threads", type=int, default=0,
+                        help="# of threads used within an operation, chosen by pytorch if 0")
+    args = parser.parse_args(args)
+    diff_args(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -11,14 +11,15 @@ class Encoder(nn.Module):
             kernel_size: int = 4,
             stride: int = 2,
             padding: int = 1,
-            batch_norm: bool = True):
+            batch_norm: bool = True,
+            device=None):
         super().__init__()
         self.lrelu = nn.LeakyReLU(0.2, inplace=True)
-        self.conv = nn.Conv2d(in_channels, out_channels, kernel_size, stride, padding)
+        self.conv = nn.Conv2d(in_channels, out_channels, kernel_size, stride, padding, device=device)
 
         self.bn = None
         if batch_norm:
-            self.bn = nn.BatchNorm2d(out_channels)
+            self.bn = nn.BatchNorm2d(out_channels, device=device)
 
     def forward(self, x):
         fx = self.conv(self.lrelu(x))
@@ -37,11 +38,12 @@ class Decoder(nn.Module):
             kernel_size: int = 4,
             stride: int = 2,
             padding: int = 1,
-            dropout: bool = False):
+            dropout: bool = False,
+            device=None):
         super().__init__()
         self.relu = nn.ReLU(inplace=True)
-        self.deconv = nn.ConvTranspose2d(in_channels, out_channels, kernel_size, stride, padding)
-        self.bn = nn.BatchNorm2d(out_channels)
+        self.deconv = nn.ConvTranspose2d(in_channels, out_channels, kernel_size, stride, padding, device=device)
+        self.bn = nn.BatchNorm2d(out_channels, device=device)
 
         self.dropout = None
         if dropout:
@@ -56,31 +58,118 @@ class Decoder(nn.Module):
         return fx
 
 
+# Encoder of the compact student generator, a depthwise convolution halving the resolution of each channel followed
+# by a pointwise convolution mixing the channels, instead of one dense 4x4 convolution
+class SeparableEncoder(nn.Module):
+    def __init__(
+            self,
+            in_channels: int,
+            out_channels: int,
+            batch_norm: bool = True,
+            device=None):
+        super().__init__()
+        self.lrelu = nn.LeakyReLU(0.2, inplace=True)
+        self.depthwise = nn.Conv2d(in_channels, in_channels, kernel_size=4, stride=2, padding=1, groups=in_channels,
+                                   device=device)
+        self.conv = nn.Conv2d(in_channels, out_channels, kernel_size=1, device=device)
+
+        self.bn = None
+        if batch_norm:
+            self.bn = nn.BatchNorm2d(out_channels, device=device)
+
+    def forward(self, x):
+        fx = self.conv(self.depthwise(self.lrelu(x)))
+
+        if self.bn is not None:
+            fx = self.bn(fx)
+
+        return fx
+
+
+# Decoder of the compact student generator, a pointwise convolution mixing the channels at the lower resolution
+# followed by a depthwise transposed convolution doubling the resolution of each channel, so the expensive transposed
+# convolution only runs on the fewer output channels. Without dropout, since the student learns the deterministic
+# output of the teacher.
+class SeparableDecoder(nn.Module):
+    def __init__(
+            self,
+            in_channels: int,
+            out_channels: int,
+            device=None):
+        super().__init__()
+        self.relu = nn.ReLU(inplace=True)
+        self.pointwise = nn.Conv2d(in_channels, out_channels, kernel_size=1, device=device)
+        self.deconv = nn.ConvTranspose2d(out_channels, out_channels, kernel_size=4, stride=2, padding=1,
+                                         groups=out_channels, device=device)
+        self.bn = nn.BatchNorm2d(out_channels, device=device)
+
+    def forward(self, x):
+        return self.bn(self.deconv(self.pointwise(self.relu(x))))
+
+
+# Widths of the encoder levels, doubled per level up to 8 times the width of the outermost level
+def level_widths(
+        levels: int,
+        width: int = 64
+) -> list:
+    return [min(width * 2 ** level, 8 * width) for level in range(levels)]
+
+
+# Levels of the U-Net for sketches of resolution dim x dim, each level halves the resolution down to 1 x 1
+def resolution_levels(
+        dim: int
+) -> int:
+    levels = dim.bit_length() - 1
+    # the discriminator needs at least 32 x 32 (see Discriminator)
+    if dim != 2 ** levels or levels < 5:
+        raise Exception("Resolution {} is no power of two of at least 32!".format(dim))
+    return levels
+
+
+# U-Net generator. The compact student generator (see map_generation.MapGenDistill) has separable encoders and
+# decoders and a smaller width of the outermost level.
 class Generator(nn.Module):
     def __init__(
             self,
-            channel: int
+            channel: int,
+            dim: int = 256,
+            device=None,
+            width: int = 64,
+            separable: bool = False
     ):
         super().__init__()
-        # Encoder
-        self.e_conv1 = nn.Conv2d(channel, 64, kernel_size=4, stride=2, padding=1)
-        self.e_conv2 = Encoder(64, 128)
-        self.e_conv3 = Encoder(128, 256)
-        self.e_conv4 = Encoder(256, 512)
-        self.e_conv5 = Encoder(512, 512)
-        self.e_conv6 = Encoder(512, 512)
-        self.e_conv7 = Encoder(512, 512)
-        self.e_conv8 = Encoder(512, 512, batch_norm=False)
-
-        # Decoder
-        self.d_deconv1 = Decoder(512, 512, dropout=True)
-        self.d_deconv2 = Decoder(1024, 512, dropout=True)
-        self.d_deconv3 = Decoder(1024, 512, dropout=True)
-        self.d_deconv4 = Decoder(1024, 512)
-        self.d_deconv5 = Decoder(1024, 256)
-        self.d_deconv6 = Decoder(512, 128)
-        self.d_deconv7 = Decoder(256, 64)
-        self.d_deconv8 = nn.ConvTranspose2d(128, channel, kernel_size=4, stride=2, padding=1)
+        self.dim = dim
+        self.width = width
+        self.separable = separable
+        self.levels = resolution_levels(dim)
+        widths = level_widths(self.levels, width)
+        # Encoder, e.g. for 256 x 256: e_conv1 (channel -> 64), e_conv2 (64 -> 128), e_conv3 (128 -> 256),
+        # e_conv4 (256 -> 512), e_conv5 to e_conv8 (512 -> 512), the innermost without batch norm
+        self.e_conv1 = nn.Conv2d(channel, widths[0], kernel_size=4, stride=2, padding=1, device=device)
+        for level in range(2, self.levels + 1):
+            if separable:
+                encoder = SeparableEncoder(widths[level - 2], widths[level - 1], batch_norm=level < self.levels,
+                                           device=device)
+            else:
+                encoder = Encoder(widths[level - 2], widths[level - 1], batch_norm=level < self.levels, device=device)
+            setattr(self, 'e_conv{}'.format(level), encoder)
+
+        # Decoder, e.g. for 256 x 256: d_deconv1 (512 -> 512), d_deconv2 to d_deconv4 (1024 -> 512),
+        # d_deconv5 (1024 -> 256), d_deconv6 (512 -> 128), d_deconv7 (256 -> 64), d_deconv8 (128 -> channel). The
+        # three innermost decoders use dropout. Decoders after the innermost get the skip connection of the encoder as
+        # well.
+        if separable:
+            self.d_deconv1 = SeparableDecoder(widths[-1], widths[-2], device=device)
+        else:
+            self.d_deconv1 = Decoder(widths[-1], widths[-2], dropout=True, device=device)
+        for level in range(2, self.levels):
+            if separable:
+                decoder = SeparableDecoder(2 * widths[-level], widths[-level - 1], device=device)
+            else:
+                decoder = Decoder(2 * widths[-level], widths[-level - 1], dropout=level <= 3, device=device)
+            setattr(self, 'd_deconv{}'.format(level), decoder)
+        setattr(self, 'd_deconv{}'.format(self.levels), nn.ConvTranspose2d(2 * widths[0], channel, kernel_size=4,
+                                                                           stride=2, padding=1, device=device))
 
     def forward(self, x):
         # up: decoder
@@ -89,33 +178,49 @@ class Generator(nn.Module):
         # innermost: downconv, downrelu, downnorm, uprelu, upconv, upnorm
         # everything inbetween: downrelu, downconv, downnorm, uprelu, upconv, upnorm
         # Encoder
-        # outermost
-        e1 = self.e_conv1(x)
-        e2 = self.e_conv2(e1)
-        e3 = self.e_conv3(e2)
-        e4 = self.e_conv4(e3)
-        e5 = self.e_conv5(e4)
-        e6 = self.e_conv6(e5)
-        e7 = self.e_conv7(e6)
-        # innermost
-        e8 = self.e_conv8(e7)
+        encoded = [x]
+        for level in range(1, self.levels + 1):
+            encoded.append(getattr(self, 'e_conv{}'.format(level))(encoded[-1]))
 
         # Decoder
         # innermost
-        d1 = self.d_deconv1(e8)
-        d1 = torch.cat([d1, e7], 1)
-        d2 = self.d_deconv2(d1)
-        d2 = torch.cat([d2, e6], 1)
-        d3 = self.d_deconv3(d2)
-        d3 = torch.cat([d3, e5], 1)
-        d4 = self.d_deconv4(d3)
-        d4 = torch.cat([d4, e4], 1)
-        d5 = self.d_deconv5(d4)
-        d5 = torch.cat([d5, e3], 1)
-        d6 = self.d_deconv6(d5)
-        d6 = torch.cat([d6, e2], 1)
-        d7 = self.d_deconv7(d6)
-        d7 = torch.cat([d7, e1], 1)
+        decoded = self.d_deconv1(encoded[self.levels])
+        decoded = torch.cat([decoded, encoded[self.levels - 1]], 1)
+        for level in range(2, self.levels):
+            decoded = getattr(self, 'd_deconv{}'.format(level))(decoded)
+            decoded = torch.cat([decoded, encoded[self.levels - level]], 1)
         # outermost
-        d8 = self.d_deconv8(d7)
-        return torch.tanh(d8)
+        decoded = getattr(self, 'd_deconv{}'.format(self.levels))(decoded)
+        return torch.tanh(decoded)
+
+
+# Resolution of a generator with the given weights, derived from its # of encoder levels
+def state_resolution(
+        state_dict: dict
+) -> int:
+    levels = max(int(key.split('.')[0][len('e_conv'):]) for key in state_dict.keys() if key.startswith('e_conv'))
+    return 2 ** levels
+
+
+# Width of the outermost level of a generator with the given weights and if its encoders and decoders are separable
+def state_architecture(
+        state_dict: dict
+) -> tuple:
+    return state_dict['e_conv1.weight'].shape[0], 'e_conv2.depthwise.weight' in state_dict
+
+
+# Generator of a MapGen checkpoint in eval mode, the discriminator and optimizer states are ignored
+def load_generator(
+        checkpoint_path: str,
+        channel: int,
+        device: str = 'cpu'
+) -> Generator:
+    checkpoint = torch.load(checkpoint_path, map_location='cpu')
+    state_dict = checkpoint['state_dict'] if 'state_dict' in checkpoint else checkpoint
+    generator_state = {key[len('G.'):]: value for key, value in state_dict.items() if key.startswith('G.')}
+    if len(generator_state) <= 0:
+        raise Exception("Checkpoint {} does not contain a generator!".format(checkpoint_path))
+    width, separable = state_architecture(generator_state)
+    generator = Generator(channel, state_resolution(generator_state), width=width, separable=separable)
+    generator.load_state_dict(generator_state)
+    return generator.to(device).eval()
@@ -25,7 +25,23 @@ def run(train_b: bool,
         generated_model_path: str,
         devices: int,
         use_shapenet: bool,
-        shapenet_train_size: int):
+        shapenet_train_size: int,
+        shard_dir: str = '',
+        manifest_path: str = '',
+        cache_size: int = 0,
+        compact_transport: bool = False,
+        seed: int = 0,
+        manual_optimization: bool = False,
+        intra_op_threads: int = 0,
+        channels_last: bool = True,
+        precision: str = 'bfloat16',
+        num_nodes: int = 1,
+        profile_start: int = 0,
+        profile_steps: int = 0,
+        dim: int = 256,
+        teacher_path: str = '',
+        student_width: int = 32,
+        weight_features: float = 1.):
     if len(output_dir) <= 0:
         raise Exception("Checkpoint Path is not given!")
     dir_utils.create_general_folder(output_dir)
@@ -34,9 +50,12 @@ def run(train_b: bool,
         train(input_dir, output_dir, logs_dir, checkpoint_dir,
               input_data_type, epochs, lr, batch_size, n_critic, weight_L1,
               gradient_penalty_coefficient, log_frequency, use_generated_model, generated_model_path, devices,
-              use_shapenet, shapenet_train_size)
+              use_shapenet, shapenet_train_size, shard_dir, manifest_path, cache_size,
+              compact_transport, seed, manual_optimization, intra_op_threads, channels_last, precision,
+              num_nodes, profile_start, profile_steps, dim, teacher_path, student_width, weight_features)
     else:
-        test(input_dir, output_dir, logs_dir, input_data_type, generated_model_path, 1, use_shapenet)
+        test(input_dir, output_dir, logs_dir, input_data_type, generated_model_path, 1, use_shapenet, shard_dir,
+             manifest_path)
 
 
 def diff_args(args):
@@ -57,7 +76,23 @@ def diff_args(args):
         args.generated_model_path,
         args.devices,
         args.use_shapenet,
-        args.shapenet_train_size)
+        args.shapenet_train_size,
+        args.shard_dir,
+        args.manifest_path,
+        args.cache_size,
+        args.compact_transport,
+        args.seed,
+        args.manual_optimization,
+        args.intra_op_threads,
+        args.channels_last,
+        args.precision,
+        args.num_nodes,
+        args.profile_start,
+        args.profile_steps,
+        args.dim,
+        args.teacher_path,
+        args.student_width,
+        args.weight_features)
 
 
 def main(args):
@@ -74,26 +109,73 @@ def main(args):
                         help="Directory where the checkpoints are stored")
     parser.add_argument("--input_data_type", type=parse.p_data_type, default="normal", dest="input_data_type",
                         help="use \"normal\" or \"depth\" in order to train\\generate depth or normal images")
+    parser.add_argument("--dim", type=int, default=256,
+                        help="Resolution of the sketches and maps the model is trained at, a power of two, e.g. 64, "
+                             "128, 256 or 512; batches of other resolutions are resized on the device")
     parser.add_argument("--epochs", type=int, default=10, help="# of epoch")
     parser.add_argument("--lr", type=float, default=2e-5, help="initial learning rate")
     parser.add_argument("--batch_size", type=int, default=4, help="size of batches")
     parser.add_argument("--n_critic", type=int, default=5, help="# of n_critic")
     parser.add_argument("--weight_L1", type=int, default=500, help="L1 weight")
     parser.add_argument("--gradient_penalty_coefficient", type=int, default=10, help="gradient penalty coefficient")
-    parser.add_argument("--log_frequency", type=int, default=100, help="log frequency for training")
+    parser.add_argument("--log_frequency", type=int, default=100,
+                        help="log frequency for training, losses and phase times are averaged over these steps")
+    parser.add_argument("--profile_start", type=int, default=10, help="# of training steps before the profiled steps")
+    parser.add_argument("--profile_steps", type=int, default=0,
+                        help="# of training steps recorded by the torch profiler as chrome trace in the traces dir of "
+                             "the logs, no profiling if 0")
     parser.add_argument("--use_generated_model", type=parse.p_bool, default="False", dest="use_generated_model",
                         help="If models are trained from scratch or already trained models are used; use \"True\" or "
                              "\"False\" as parameter")
     parser.add_argument("--generated_model_path", type=str, default="test.ckpt",
                         help="If test is used determine if comparison images should be generated")
     parser.add_argument("--devices", type=int, default=4,
-                        help="Define the number of cpu or gpu devices used")
+                        help="Define the number of cpu or gpu devices used; on cpus, each device is a training process "
+                             "and several processes are trained with DDP over gloo")
+    parser.add_argument("--num_nodes", type=int, default=1,
+                        help="# of nodes of distributed training, each node needs MASTER_ADDR, MASTER_PORT and "
+                             "NODE_RANK in its environment")
     parser.add_argument("--use_shapenet", type=parse.p_bool, default="False", dest="use_shapenet",
                         help="If Shapenet dataset is used")
     parser.add_argument("--shapenet_train_size", type=int, default=400,
                         help="usage of # images per class in shapenet dataset in training epoch. "
                              "Needs to be a common multiple of batch_sizes and devices"
                              "# validation is calculated based on this number")
+    parser.add_argument("--shard_dir", type=str, default="",
+                        help="Directory with the shards of each split created by dataset_shards, which are used "
+                             "instead of the sketches and targets in input_dir if given")
+    parser.add_argument("--manifest_path", type=str, default="",
+                        help="File the index of the sketches and targets of input_dir is stored in, "
+                             "manifest.json in input_dir if not given")
+    parser.add_argument("--cache_size", type=int, default=0,
+                        help="MB of decoded samples per split kept in shared memory for all data loader workers, "
+                             "no cache if 0")
+    parser.add_argument("--compact_transport", type=parse.p_bool, default="False", dest="compact_transport",
+                        help="If data loader workers emit uint8 sketches and float16 targets, which are normalized "
+                             "on the device; use \"True\" or \"False\" as parameter")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the per epoch sampling plans of the ShapeNet dataset")
+    parser.add_argument("--manual_optimization", type=parse.p_bool, default="False", dest="manual_optimization",
+                        help="Train each batch with one generator pass for n_critic critic updates and one generator "
+                             "update instead of one update per batch; use \"True\" or \"False\" as parameter")
+    parser.add_argument("--intra_op_threads", type=int, default=0,
+                        help="# of threads used within an operation by each training process on cpus, all but one "
+                             "core of the process if 0; the left over cores are used by the data loader workers")
+    parser.add_argument("--channels_last", type=parse.p_bool, default="True", dest="channels_last",
+                        help="Train with channels last tensors on cpus, which mainly speeds up bfloat16; use \"True\" "
+                             "or \"False\" as parameter")
+    parser.add_argument("--precision", type=str, default="bfloat16", choices=['float32', 'bfloat16'],
+                        help="Train with float32 or mixed precision, which is bfloat16 autocast on cpus and float16 on "
+                             "gpus; bfloat16 is only faster on cpus with AMX or AVX512-BF16")
+    parser.add_argument("--teacher_path", type=str, default="",
+                        help="Checkpoint of a trained model of the same type and resolution, which is distilled into "
+                             "a compact student generator with separable convolutions instead of training the GAN, "
+                             "if given")
+    parser.add_argument("--student_width", type=int, default=32,
+                        help="# of channels of the outermost level of the student generator, 64 for the teacher")
+    parser.add_argument("--weight_features", type=float, default=1.,
+                        help="Weight of the L1 loss between the decoder features of student and teacher in the "
+                             "distillation, relative to the L1 losses of the maps")
     args = parser.parse_args(args)
     diff_args(args)
 
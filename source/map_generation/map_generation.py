@@ -1,4 +1,5 @@
 # neural network for map generation
+import functools
 import os
 import torch
 import pytorch_lightning as pl
@@ -8,7 +9,11 @@ import torchvision
 from pathlib import Path
 
 from source.map_generation.generator import Generator
+from source.map_generation.generator import level_widths
+from source.map_generation.generator import load_generator
 from source.map_generation.discriminator import Discriminator
+from source.map_generation import telemetry
+from source.map_generation_dataset import transport
 from source.util import OpenEXR_utils
 from source.util import data_type
 
@@ -22,13 +27,22 @@ class MapGen(pl.LightningModule):
             gradient_penalty_coefficient: int,
             output_dir: str,
             lr: float,
-            batch_size: int
+            batch_size: int,
+            dim: int = 256,
+            generator_path: str = ''
     ):
         super(MapGen, self).__init__()
         self.save_hyperparameters()
         self.data_type = data_type
-        self.G = Generator(self.channel)
-        self.D = Discriminator(self.channel)
+        # the generator of the checkpoint at generator_path (e.g. of a distilled student) with its resolution is used
+        # instead of a new one if given
+        if len(generator_path) > 0:
+            self.G = load_generator(generator_path, self.channel)
+        else:
+            self.G = Generator(self.channel, dim)
+        # resolution of the sketches and maps, which determines the depth of the generator
+        self.dim = self.G.dim
+        self.D = Discriminator(self.channel, self.dim)
         self.n_critic = n_critic
         self.weight_L1 = weight_L1
         self.output_dir = output_dir
@@ -36,6 +50,12 @@ class MapGen(pl.LightningModule):
         self.L1 = torch.nn.L1Loss()
         self.gradient_penalty_coefficient = gradient_penalty_coefficient
         self.batch_size = batch_size
+        # optional OpenEXR_utils.BackgroundWriter, so test steps do not wait for the exr files to be written
+        self.exr_writer = None
+        # batches are converted to channels last, set with the model for cpu training
+        self.channels_last = False
+        # losses and phase times of the training steps, replaced by the configured telemetry for training
+        self.telemetry = telemetry.Telemetry()
 
     @property
     def channel(self):
@@ -51,18 +71,31 @@ class MapGen(pl.LightningModule):
         return [{'optimizer': opt_g, 'frequency': 1},
                 {'optimizer': opt_d, 'frequency': self.n_critic}]
 
+    # Batches of the compact transport are normalized on the device instead of in the data loader workers
+    def on_after_batch_transfer(self, sample_batched, dataloader_idx):
+        sample_batched = transport.normalize_batch(sample_batched, self.data_type, self.channel)
+        sample_batched = transport.resize_batch(sample_batched, self.dim)
+        if self.channels_last:
+            for key in ('input', 'target'):
+                if key in sample_batched:
+                    sample_batched[key] = sample_batched[key].contiguous(memory_format=torch.channels_last)
+        return sample_batched
+
     def forward(self, sample_batched):
         x = sample_batched['input']
         return self.G(x)
 
-    def generator_step(self, sample_batched, fake_images):
-        print("Generator")
+    def generator_loss(self, sample_batched, fake_images):
         input_predicted = torch.cat((sample_batched['input'], fake_images), 1)
-        pred_false = self.D(input_predicted)
+        with self.telemetry.phase('discriminator_forward'):
+            pred_false = self.D(input_predicted)
         d_loss_fake = torch.mean(pred_false)
         pixelwise_loss = self.L1(fake_images, sample_batched['target'])
-        g_loss = -d_loss_fake + pixelwise_loss * self.weight_L1
-        self.log('g_loss', float(g_loss.item()), on_epoch=False, prog_bar=True)
+        return -d_loss_fake + pixelwise_loss * self.weight_L1
+
+    def generator_step(self, sample_batched, fake_images):
+        g_loss = self.generator_loss(sample_batched, fake_images)
+        self.telemetry.add_loss('g_loss', g_loss)
         return g_loss
 
     def gradient_penalty(self, real_images, fake_images):
@@ -77,31 +110,66 @@ class MapGen(pl.LightningModule):
             create_graph=True,
             retain_graph=True,
         )[0]
-        gradients = gradients.view(real_images.size(0), -1)
+        gradients = gradients.reshape(real_images.size(0), -1)
         grad_norm = gradients.norm(2, 1)
         return torch.mean(torch.square(grad_norm - 1))
 
-    def discriminator_step(self, sample_batched, fake_images):
-        print("Discriminator")
+    def discriminator_loss(self, sample_batched, fake_images):
         input_predicted = torch.cat((sample_batched['input'], fake_images), 1)
-        pred_false = self.D(input_predicted.detach())
-        d_loss_fake = torch.mean(pred_false)
-        # train discriminator on real images
         input_target = torch.cat((sample_batched['input'], sample_batched['target']), 1)
-        pred_true = self.D(input_target)
+        with self.telemetry.phase('discriminator_forward'):
+            pred_false = self.D(input_predicted.detach())
+            # train discriminator on real images
+            pred_true = self.D(input_target)
+        d_loss_fake = torch.mean(pred_false)
         d_loss_real = torch.mean(pred_true)
-        gradient_penalty = self.gradient_penalty(input_target, input_predicted)
+        with self.telemetry.phase('gradient_penalty'):
+            gradient_penalty = self.gradient_penalty(input_target, input_predicted)
 
         # loss as defined by Wasserstein paper
         d_loss = -d_loss_real + d_loss_fake + self.gradient_penalty_coefficient * gradient_penalty
-        self.log('d_loss', float(d_loss.item()), on_epoch=False, prog_bar=True)
-        self.log('d_loss_real', float(d_loss_real.item()), on_epoch=False, prog_bar=True)
-        self.log('d_loss_fake', float(d_loss_fake.item()), on_epoch=False, prog_bar=True)
+        return d_loss, d_loss_real, d_loss_fake
 
+    def add_discriminator_losses(self, d_loss, d_loss_real, d_loss_fake):
+        self.telemetry.add_loss('d_loss', d_loss)
+        self.telemetry.add_loss('d_loss_real', d_loss_real)
+        self.telemetry.add_loss('d_loss_fake', d_loss_fake)
+
+    def discriminator_step(self, sample_batched, fake_images):
+        d_loss, d_loss_real, d_loss_fake = self.discriminator_loss(sample_batched, fake_images)
+        self.add_discriminator_losses(d_loss, d_loss_real, d_loss_fake)
         return d_loss
 
+    # One critic cycle on a batch: the generator runs once, n_critic critic updates use its detached output and the
+    # generator update reuses the output, since the generator weights do not change during the critic updates.
+    # backward is the backward function of the trainer. Returns the generator loss and the losses of the last critic
+    # update.
+    def critic_cycle(self, sample_batched, opt_g, opt_d, backward):
+        with self.telemetry.phase('generator_forward'):
+            fake_images = self(sample_batched)
+        fake_images_detached = fake_images.detach()
+        for _ in range(self.n_critic):
+            d_losses = self.discriminator_loss(sample_batched, fake_images_detached)
+            opt_d.zero_grad()
+            with self.telemetry.phase('backward'):
+                backward(d_losses[0])
+            with self.telemetry.phase('optimizer'):
+                opt_d.step()
+
+        # no gradients of the discriminator weights are needed for the generator update
+        self.D.requires_grad_(False)
+        g_loss = self.generator_loss(sample_batched, fake_images)
+        opt_g.zero_grad()
+        with self.telemetry.phase('backward'):
+            backward(g_loss)
+        with self.telemetry.phase('optimizer'):
+            opt_g.step()
+        self.D.requires_grad_(True)
+        return g_loss, d_losses
+
     def training_step(self, sample_batched, batch_idx, optimizer_idx):
-        fake_images = self(sample_batched)
+        with self.telemetry.phase('generator_forward'):
+            fake_images = self(sample_batched)
         if optimizer_idx == 0:
             loss = self.generator_step(sample_batched, fake_images)
 
@@ -109,10 +177,45 @@ class MapGen(pl.LightningModule):
             loss = self.discriminator_step(sample_batched, fake_images)
         return loss
 
+    # Telemetry of the training steps, the backward pass and the optimizer step of the automatic optimization are run by
+    # the trainer
+    def on_train_start(self):
+        self.telemetry.use_cuda_events = self.device.type == 'cuda'
+        self.telemetry.start_profiler()
+
+    def on_train_end(self):
+        self.telemetry.stop_profiler()
+
+    def on_train_batch_start(self, batch, batch_idx):
+        self.telemetry.batch_start()
+
+    def on_train_batch_end(self, outputs, batch, batch_idx):
+        metrics = self.telemetry.batch_end()
+        if metrics is not None:
+            losses = {name: value for name, value in metrics.items() if not name.startswith('time_ms/')}
+            self.log_dict(losses, on_epoch=False, prog_bar=True)
+            self.log_dict({name: value for name, value in metrics.items() if name not in losses}, on_epoch=False)
+
+    def on_before_backward(self, loss):
+        if self.automatic_optimization:
+            self.telemetry.start('backward')
+
+    def on_after_backward(self):
+        if self.automatic_optimization:
+            self.telemetry.stop('backward')
+            self.telemetry.start('optimizer')
+
+    def optimizer_step(self, *args, **kwargs):
+        super().optimizer_step(*args, **kwargs)
+        self.telemetry.stop('optimizer')
+
     def validation_step(self, sample_batched, batch_idx):
         predicted_image = self(sample_batched)
         pixelwise_loss = self.L1(predicted_image, sample_batched['target'])
-        self.log('val_loss', pixelwise_loss.item(), batch_size=self.batch_size, sync_dist=True)
+        self.log('val_loss', pixelwise_loss, batch_size=self.batch_size, sync_dist=True)
+        # one image grid per validation epoch
+        if batch_idx > 0:
+            return
         target_norm = (sample_batched['target'] + 1) / 2
         predicted_list = predicted_image[:6]
         transformed_images = []
@@ -130,7 +233,8 @@ class MapGen(pl.LightningModule):
         logger.add_image(image_name_pred, grid, 0)
 
     def test_step(self, sample_batched, batch_idx):
-        predicted_image = self(sample_batched)
+        # maps predicted with bfloat16 autocast are written as float32
+        predicted_image = self(sample_batched).float()
         imagename = Path(sample_batched['input_path'][0]).stem.rsplit('_', 1)[0]
         predicted_image_norm = (predicted_image + 1.0) * 127.5
         if 'target' in sample_batched:
@@ -150,8 +254,129 @@ class MapGen(pl.LightningModule):
         if self.data_type == data_type.Type.normal:
             predicted_image = torch.permute(predicted_image, (0, 2, 3, 1))
             OpenEXR_utils.writeImage(predicted_image, self.data_type,
-                                     os.path.join(self.output_dir, imagename + '_normal.exr'))
+                                     os.path.join(self.output_dir, imagename + '_normal.exr'), writer=self.exr_writer)
         else:
             predicted_image = (predicted_image + 1) / 2
             OpenEXR_utils.writeImage(predicted_image, self.data_type,
-                                     os.path.join(self.output_dir, imagename + '_depth.exr'))
+                                     os.path.join(self.output_dir, imagename + '_depth.exr'), writer=self.exr_writer)
+
+
+# MapGen with manual optimization, each batch is one critic cycle (see MapGen.critic_cycle) instead of one update with
+# the optimizer frequencies of MapGen. The generator runs once per batch instead of once per update, therefore each
+# batch performs n_critic + 1 updates and global_step counts the updates of both optimizers.
+class MapGenManual(MapGen):
+    def __init__(
+            self,
+            data_type: data_type.Type,
+            n_critic: int,
+            weight_L1: int,
+            gradient_penalty_coefficient: int,
+            output_dir: str,
+            lr: float,
+            batch_size: int,
+            dim: int = 256
+    ):
+        super().__init__(data_type, n_critic, weight_L1, gradient_penalty_coefficient, output_dir, lr, batch_size, dim)
+        self.automatic_optimization = False
+
+    def configure_optimizers(self):
+        opt_g = torch.optim.RMSprop(self.G.parameters(), lr=(self.lr or self.learning_rate))
+        opt_d = torch.optim.RMSprop(self.D.parameters(), lr=(self.lr or self.learning_rate))
+        return opt_g, opt_d
+
+    def training_step(self, sample_batched, batch_idx):
+        opt_g, opt_d = self.optimizers()
+        g_loss, d_losses = self.critic_cycle(sample_batched, opt_g, opt_d, self.manual_backward)
+        self.telemetry.add_loss('g_loss', g_loss)
+        self.add_discriminator_losses(*d_losses)
+
+
+# MapGen distilling a frozen teacher generator into a compact student generator with separable encoders and decoders
+# and the given width of the outermost level (see Generator). There is no critic, the student learns the L1 loss to the
+# maps of the teacher and to the targets and matches the outputs of the decoders of the teacher, to which its decoder
+# outputs are projected by 1x1 convolutions. The teacher is not stored in the checkpoints, so they are as small as the
+# student and load like MapGen checkpoints in the pipeline (see generator.load_generator).
+class MapGenDistill(MapGen):
+    def __init__(
+            self,
+            data_type: data_type.Type,
+            teacher_path: str,
+            weight_features: float,
+            output_dir: str,
+            lr: float,
+            batch_size: int,
+            dim: int = 256,
+            width: int = 32
+    ):
+        super().__init__(data_type, 0, 1, 0, output_dir, lr, batch_size, dim)
+        self.teacher_path = teacher_path
+        self.weight_features = weight_features
+        self.teacher = load_generator(teacher_path, self.channel)
+        if self.teacher.dim != dim:
+            raise Exception("Teacher {} has resolution {} instead of {}!".format(teacher_path, self.teacher.dim, dim))
+        self.teacher.requires_grad_(False)
+        self.G = Generator(self.channel, dim, width=width, separable=True)
+        del self.D
+
+        # outputs of the decoders of the last forward pass of teacher and student, except the outermost
+        self.features = {}
+        student_widths = level_widths(self.G.levels, width)
+        teacher_widths = level_widths(self.teacher.levels, self.teacher.width)
+        self.adapters = torch.nn.ModuleList()
+        for level in range(1, self.G.levels):
+            self.adapters.append(torch.nn.Conv2d(student_widths[-level - 1], teacher_widths[-level - 1], kernel_size=1))
+            for name, generator in (('teacher', self.teacher), ('student', self.G)):
+                getattr(generator, 'd_deconv{}'.format(level)).register_forward_hook(
+                    functools.partial(self.store_features, name, level))
+
+    def store_features(self, name, level, module, inputs, output):
+        self.features[(name, level)] = output
+
+    # The teacher stays in eval mode, so it keeps its batch norm statistics and does not use dropout
+    def train(self, mode=True):
+        super().train(mode)
+        self.teacher.eval()
+        return self
+
+    def configure_optimizers(self):
+        return torch.optim.RMSprop(list(self.G.parameters()) + list(self.adapters.parameters()),
+                                   lr=(self.lr or self.learning_rate))
+
+    def feature_loss(self):
+        losses = [self.L1(adapter(self.features[('student', level)]), self.features[('teacher', level)])
+                  for level, adapter in enumerate(self.adapters, 1)]
+        return torch.stack(losses).mean()
+
+    def training_step(self, sample_batched, batch_idx):
+        with self.telemetry.phase('teacher_forward'), torch.no_grad():
+            teacher_images = self.teacher(sample_batched['input'])
+        with self.telemetry.phase('generator_forward'):
+            fake_images = self(sample_batched)
+        l1_teacher = self.L1(fake_images, teacher_images)
+        l1_target = self.L1(fake_images, sample_batched['target'])
+        feature_loss = self.feature_loss()
+        self.telemetry.add_loss('l1_teacher', l1_teacher)
+        self.telemetry.add_loss('l1_target', l1_target)
+        self.telemetry.add_loss('feature_loss', feature_loss)
+        return l1_teacher + l1_target + self.weight_features * feature_loss
+
+    def on_save_checkpoint(self, checkpoint):
+        checkpoint['state_dict'] = {key: value for key, value in checkpoint['state_dict'].items()
+                                    if not key.startswith('teacher.')}
+
+    # The teacher is loaded from teacher_path instead
+    def on_load_checkpoint(self, checkpoint):
+        checkpoint['state_dict'].update({'teacher.' + key: value for key, value in self.teacher.state_dict().items()})
+
+
+# MapGen with the generator of a MapGen or MapGenDistill checkpoint for the test, without teacher and optimizer states.
+# The architecture of the generator is derived from its weights (see generator.load_generator), so the checkpoints of
+# distilled students are tested like the checkpoints of MapGen.
+class MapGenTest(MapGen):
+    def __init__(
+            self,
+            data_type: data_type.Type,
+            checkpoint_path: str,
+            output_dir: str
+    ):
+        super().__init__(data_type, 0, 1, 0, output_dir, 0., 1, generator_path=checkpoint_path)
@@ -0,0 +1,186 @@
+# Export of the map generation generator to ONNX and inference with onnxruntime
+# BatchNorm layers are folded into the preceding (transposed) convolutions and dropout is removed before the export, so
+# the exported graph only consists of convolutions, activations and concatenations.
+import argparse
+import copy
+import sys
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from source.map_generation.generator import Generator
+from source.map_generation.generator import load_generator
+from source.util import data_type
+from source.util import parse
+
+input_name = 'sketch'
+output_name = 'map'
+
+
+# Fold batch norm with running statistics into the weights and bias of the convolution before it. Transposed
+# convolutions store their output channels of each group in the second dimension of the weights.
+def fold_batch_norm(
+        conv: nn.Conv2d | nn.ConvTranspose2d,
+        bn: nn.BatchNorm2d
+):
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    bias = conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+    if isinstance(conv, nn.ConvTranspose2d):
+        weight = conv.weight.reshape(conv.groups, -1, conv.out_channels // conv.groups, *conv.kernel_size)
+        conv.weight.copy_((weight * scale.reshape(conv.groups, 1, -1, 1, 1)).reshape(conv.weight.shape))
+    else:
+        conv.weight.copy_(conv.weight * scale.reshape(-1, 1, 1, 1))
+    conv.bias = nn.Parameter((bias - bn.running_mean) * scale + bn.bias)
+
+
+# Copy of the generator for inference with all batch norms folded and without dropout
+def fold_generator(
+        generator: Generator
+) -> Generator:
+    generator = copy.deepcopy(generator).eval()
+    with torch.no_grad():
+        for module in generator.modules():
+            if hasattr(module, 'conv') and getattr(module, 'bn', None) is not None:
+                fold_batch_norm(module.conv, module.bn)
+                module.bn = None
+            elif hasattr(module, 'deconv'):
+                fold_batch_norm(module.deconv, module.bn)
+                module.bn = nn.Identity()
+                module.dropout = None
+    return generator
+
+
+def export(
+        checkpoint_path: str,
+        output_path: str,
+        channel: int,
+        dim: int = 0,
+        opset: int = 13
+):
+    generator = fold_generator(load_generator(checkpoint_path, channel))
+    dim = dim or generator.dim
+    sketch = torch.zeros((1, channel, dim, dim))
+    torch.onnx.export(generator, sketch, output_path, input_names=[input_name], output_names=[output_name],
+                      dynamic_axes={input_name: {0: 'batch'}, output_name: {0: 'batch'}}, opset_version=opset,
+                      do_constant_folding=True)
+
+
+# Runs an exported generator with onnxruntime on the cpu. Called like the generator with a normalized sketch tensor.
+class OnnxGenerator:
+    def __init__(
+            self,
+            model_path: str,
+            intra_op_threads: int = 0,
+            inter_op_threads: int = 0
+    ):
+        # optional dependency, only needed for this backend
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # 0 lets onnxruntime choose the # of threads
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        # resolution the generator was exported with
+        self.dim = self.session.get_inputs()[0].shape[2]
+
+    def __call__(
+            self,
+            sketch: torch.Tensor
+    ) -> torch.Tensor:
+        sketch = np.ascontiguousarray(sketch.cpu().numpy(), dtype=np.float32)
+        return torch.from_numpy(self.session.run([output_name], {input_name: sketch})[0])
+
+
+def time_model(
+        model,
+        sketch: torch.Tensor,
+        repetitions: int
+) -> float:
+    model(sketch)
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        model(sketch)
+    return (time.perf_counter() - start) / repetitions
+
+
+# Compare output and latency of the pytorch generator and the exported model for a random sketch
+def check(
+        checkpoint_path: str,
+        onnx_path: str,
+        channel: int,
+        dim: int = 0,
+        batch_size: int = 1,
+        repetitions: int = 10,
+        intra_op_threads: int = 0,
+        inter_op_threads: int = 0
+):
+    generator = load_generator(checkpoint_path, channel)
+    exported_generator = OnnxGenerator(onnx_path, intra_op_threads, inter_op_threads)
+    dim = dim or exported_generator.dim
+    if intra_op_threads > 0:
+        torch.set_num_threads(intra_op_threads)
+    sketch = torch.where(torch.rand((batch_size, 1, dim, dim)) > 0.9, 1., -1.).expand(-1, channel, -1, -1)
+    with torch.inference_mode():
+        difference = torch.max(torch.abs(generator(sketch) - exported_generator(sketch))).item()
+        time_torch = time_model(generator, sketch, repetitions)
+        time_onnx = time_model(exported_generator, sketch, repetitions)
+    print("Max. absolute difference: {:.2e}".format(difference))
+    print("{:>12} {:>12}".format('backend', 'latency ms'))
+    print("{:>12} {:>12.2f}".format('pytorch', time_torch * 1000))
+    print("{:>12} {:>12.2f}".format('onnxruntime', time_onnx * 1000))
+
+
+def run(
+        checkpoint_path: str,
+        output_path: str,
+        input_data_type: data_type.Type,
+        dim: int,
+        check_export: bool,
+        repetitions: int,
+        intra_op_threads: int,
+        inter_op_threads: int
+):
+    channel = 3 if input_data_type == data_type.Type.normal else 1
+    export(checkpoint_path, output_path, channel, dim)
+    if check_export:
+        check(checkpoint_path, output_path, channel, dim, 1, repetitions, intra_op_threads, inter_op_threads)
+
+
+def diff_args(args):
+    run(args.checkpoint_path,
+        args.output_path,
+        args.input_data_type,
+        args.dim,
+        args.check,
+        args.repetitions,
+        args.intra_op_threads,
+        args.inter_op_threads)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog="map_generation_onnx_export")
+    parser.add_argument("--checkpoint_path", type=str, default="datasets/mapgen_test_models/normal.ckpt",
+                        help="Checkpoint of the map generation model")
+    parser.add_argument("--output_path", type=str, default="datasets/mapgen_test_models/normal.onnx",
+                        help="Path the ONNX model is written to")
+    parser.add_argument("--input_data_type", type=parse.p_data_type, default="normal", dest="input_data_type",
+                        help="use \"normal\" or \"depth\" as type of the model")
+    parser.add_argument("--dim", type=int, default=0,
+                        help="Resolution of the sketches, the resolution of the model if 0")
+    parser.add_argument("--check", type=parse.p_bool, default="True", dest="check",
+                        help="Compare output and latency of the exported model with the pytorch model; use \"True\" "
+                             "or \"False\" as parameter")
+    parser.add_argument("--repetitions", type=int, default=10, help="# of runs to measure the latency")
+    parser.add_argument("--intra_op_threads", type=int, default=0,
+                        help="# of threads used within an operation, chosen by the runtime if 0")
+    parser.add_argument("--inter_op_threads", type=int, default=0,
+                        help="# of threads used for parallel operations, chosen by the runtime if 0")
+    args = parser.parse_args(args)
+    diff_args(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,102 @@
+# Direct inference of normal and depth maps without the pytorch lightning trainer
+# Both generators are loaded once from their checkpoints and sketches are passed as arrays, so no dataset, logger or
+# files are needed for a prediction. The torch backend loads checkpoints or slim artifacts (see slim_generator), the
+# latter memory-mapped. With the onnx backend, the models are exported ONNX files (see onnx_generator) run by
+# onnxruntime on the cpu and with the int8 backend quantized TorchScript models (see quantize) run on the cpu.
+import typing
+
+import numpy
+import numpy as np
+import torch
+
+from source.map_generation import onnx_generator
+from source.map_generation import quantize
+from source.map_generation import slim_generator
+from source.map_generation.generator import load_generator
+from source.map_generation_dataset import transport
+from source.util import data_type
+
+
+backends = ('torch', 'onnx', 'int8')
+
+
+# Generator of a slim artifact or a checkpoint
+def load_torch_generator(
+        model_path: str,
+        channel: int,
+        device: str
+):
+    if slim_generator.is_slim(model_path):
+        return slim_generator.load(model_path, channel, device)
+    return load_generator(model_path, channel, device)
+
+
+class MapPredictor:
+    def __init__(
+            self,
+            normal_model_path: str,
+            depth_model_path: str,
+            device: str = '',
+            batch_size: int = 16,
+            backend: str = 'torch',
+            intra_op_threads: int = 0,
+            inter_op_threads: int = 0
+    ):
+        if backend not in backends:
+            raise Exception("Backend {} is not one of {}".format(backend, backends))
+        self.batch_size = batch_size
+        if backend == 'onnx':
+            self.device = 'cpu'
+            self.generators = {
+                data_type.Type.normal: onnx_generator.OnnxGenerator(normal_model_path, intra_op_threads,
+                                                                    inter_op_threads),
+                data_type.Type.depth: onnx_generator.OnnxGenerator(depth_model_path, intra_op_threads,
+                                                                   inter_op_threads)}
+        elif backend == 'int8':
+            self.device = 'cpu'
+            if intra_op_threads > 0:
+                torch.set_num_threads(intra_op_threads)
+            self.generators = {data_type.Type.normal: quantize.load_quantized(normal_model_path),
+                               data_type.Type.depth: quantize.load_quantized(depth_model_path)}
+        else:
+            self.device = device if len(device) > 0 else ('cuda' if torch.cuda.is_available() else 'cpu')
+            if intra_op_threads > 0:
+                torch.set_num_threads(intra_op_threads)
+            self.generators = {data_type.Type.normal: load_torch_generator(normal_model_path, 3, self.device),
+                               data_type.Type.depth: load_torch_generator(depth_model_path, 1, self.device)}
+        # resolution of the sketches the generators expect
+        self.dim = self.generators[data_type.Type.normal].dim
+        if self.generators[data_type.Type.depth].dim != self.dim:
+            raise Exception("Normal model has resolution {}, but depth model {}!".format(
+                self.dim, self.generators[data_type.Type.depth].dim))
+
+    # Model output in [-1, 1] of shape (N, C, H, W) for uint8 sketches of shape (N, H, W)
+    def predict_type(
+            self,
+            sketches: numpy.ndarray,
+            map_type: data_type.Type
+    ) -> numpy.ndarray:
+        generator = self.generators[map_type]
+        channel = 3 if map_type == data_type.Type.normal else 1
+        outputs = []
+        with torch.inference_mode():
+            for start in range(0, len(sketches), self.batch_size):
+                batch = torch.from_numpy(np.ascontiguousarray(sketches[start:start + self.batch_size]))
+                batch = transport.normalize_input(batch.unsqueeze(1).to(self.device), channel)
+                outputs.append(generator(batch).float().cpu().numpy())
+        return np.concatenate(outputs)
+
+    # Normal maps in [-1, 1] of shape ([N,] H, W, 3) and depth maps in [0, 1] of shape ([N,] H, W) for cleaned uint8
+    # sketches (see sketch_utils.normalize_sketch) of shape ([N,] H, W). Same values as written by MapGen.test_step.
+    def predict(
+            self,
+            sketches: numpy.ndarray
+    ) -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
+        single = sketches.ndim == 2
+        if single:
+            sketches = sketches[np.newaxis]
+        normal_maps = np.ascontiguousarray(np.moveaxis(self.predict_type(sketches, data_type.Type.normal), 1, -1))
+        depth_maps = (self.predict_type(sketches, data_type.Type.depth)[:, 0] + 1) / 2
+        if single:
+            return normal_maps[0], depth_maps[0]
+        return normal_maps, depth_maps
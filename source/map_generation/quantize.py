@@ -0,0 +1,255 @@
+# INT8 quantization of the map generation generator for cpu inference
+# The generator with folded batch norms (see onnx_generator) is quantized statically with FX graph mode quantization.
+# Activation ranges are calibrated on a sample of the sketch dataset, optionally followed by quantization aware
+# fine-tuning. The quantized model is stored as TorchScript, so it can be loaded without the model definition.
+import argparse
+import functools
+import os
+import sys
+
+import numpy as np
+import torch
+from torch.ao.quantization import quantize_fx
+from torch.ao.quantization import get_default_qconfig, get_default_qat_qconfig, default_qconfig, default_qat_qconfig
+from torch.utils.data import DataLoader, Subset
+from torch.utils.data import default_collate
+
+from source.map_generation import onnx_generator
+from source.map_generation.generator import load_generator
+from source.map_generation_dataset import dataset
+from source.map_generation_dataset import manifest as dataset_manifest
+from source.map_generation_dataset import transport
+from source.util import data_type
+from source.util import parse
+
+
+# Quantization config, transposed convolutions only support per tensor quantization of the weights
+def quantization_config(
+        engine: str,
+        qat: bool
+) -> dict:
+    if qat:
+        return {'': get_default_qat_qconfig(engine),
+                'object_type': [(torch.nn.ConvTranspose2d, default_qat_qconfig)]}
+    return {'': get_default_qconfig(engine),
+            'object_type': [(torch.nn.ConvTranspose2d, default_qconfig)]}
+
+
+# Generator with observers (and fake quantization for qat) of a checkpoint
+def prepare(
+        checkpoint_path: str,
+        channel: int,
+        dim: int,
+        engine: str,
+        qat: bool
+) -> torch.fx.GraphModule:
+    torch.backends.quantized.engine = engine
+    generator = onnx_generator.fold_generator(load_generator(checkpoint_path, channel))
+    example = (torch.zeros((1, channel, dim, dim)),)
+    if qat:
+        return quantize_fx.prepare_qat_fx(generator.train(), quantization_config(engine, qat), example)
+    return quantize_fx.prepare_fx(generator, quantization_config(engine, qat), example)
+
+
+# Record activation ranges of the calibration sketches
+def calibrate(
+        prepared: torch.fx.GraphModule,
+        dataloader: DataLoader
+):
+    prepared.eval()
+    with torch.inference_mode():
+        for sample_batched in dataloader:
+            prepared(sample_batched['input'])
+
+
+# Quantization aware fine-tuning with the L1 loss of the map generation
+def fine_tune(
+        prepared: torch.fx.GraphModule,
+        dataloader: DataLoader,
+        epochs: int,
+        lr: float
+):
+    prepared.train()
+    optimizer = torch.optim.RMSprop(prepared.parameters(), lr=lr)
+    L1 = torch.nn.L1Loss()
+    for epoch in range(epochs):
+        epoch_loss = 0.
+        for sample_batched in dataloader:
+            optimizer.zero_grad()
+            loss = L1(prepared(sample_batched['input']), sample_batched['target'])
+            loss.backward()
+            optimizer.step()
+            epoch_loss += loss.item()
+        print("QAT epoch {}: L1 {:.5f}".format(epoch, epoch_loss / len(dataloader)))
+    prepared.eval()
+
+
+def convert(
+        prepared: torch.fx.GraphModule,
+        channel: int,
+        dim: int
+) -> torch.jit.ScriptModule:
+    quantized = quantize_fx.convert_fx(prepared.eval())
+    with torch.inference_mode():
+        return torch.jit.freeze(torch.jit.trace(quantized, torch.zeros((1, channel, dim, dim))))
+
+
+# Quantized model with the resolution it was traced with, which is stored next to the TorchScript model
+def load_quantized(
+        model_path: str
+) -> torch.jit.ScriptModule:
+    extra_files = {'dim': ''}
+    model = torch.jit.load(model_path, map_location='cpu', _extra_files=extra_files).eval()
+    model.dim = int(extra_files['dim'])
+    return model
+
+
+# Mean L1 error in model space [-1, 1] to the target and to the output of the reference model and for normal maps the
+# mean angle in degrees between predicted and target normals of all pixels with a target normal
+def evaluate(
+        model,
+        reference_model,
+        dataloader: DataLoader,
+        input_data_type: data_type.Type
+) -> dict:
+    l1, l1_reference, angles, n_pixels = 0., 0., 0., 0
+    with torch.inference_mode():
+        for sample_batched in dataloader:
+            predicted = model(sample_batched['input']).float()
+            target = sample_batched['target']
+            l1 += torch.abs(predicted - target).mean().item() * len(target)
+            l1_reference += torch.abs(predicted - reference_model(sample_batched['input'])).mean().item() * len(target)
+            if input_data_type == data_type.Type.normal:
+                mask = torch.linalg.norm(target, dim=1) > 1e-3
+                cosine = torch.nn.functional.cosine_similarity(predicted, target, dim=1)[mask]
+                angles += torch.rad2deg(torch.arccos(torch.clamp(cosine, -1., 1.))).sum().item()
+                n_pixels += int(mask.sum())
+    result = {'l1': l1 / len(dataloader.dataset), 'l1_reference': l1_reference / len(dataloader.dataset)}
+    if input_data_type == data_type.Type.normal:
+        result['angular'] = angles / max(n_pixels, 1)
+    return result
+
+
+# Batches resized to the resolution of the model, see transport.resize_batch
+def resized_collate(
+        dim: int,
+        samples: list
+) -> dict:
+    return transport.resize_batch(default_collate(samples), dim)
+
+
+def sample_loader(
+        input_dir: str,
+        split: str,
+        input_data_type: data_type.Type,
+        manifest: dataset_manifest.Manifest,
+        size: int,
+        batch_size: int,
+        dim: int,
+        shuffle: bool = False
+) -> DataLoader:
+    dataSet = dataset.DS(True, input_data_type, os.path.join(input_dir, 'sketch_map_generation', split),
+                         os.path.join(input_dir, 'target_map_generation', split), manifest)
+    if len(dataSet) <= 0:
+        raise Exception("No samples in {} split of {}".format(split, input_dir))
+    indices = np.random.default_rng(0).permutation(len(dataSet))[:size]
+    return DataLoader(Subset(dataSet, indices.tolist()), batch_size=batch_size, shuffle=shuffle,
+                      collate_fn=functools.partial(resized_collate, dim))
+
+
+def report(
+        results: dict,
+        input_data_type: data_type.Type
+):
+    print("{:>8} {:>10} {:>10} {:>12} {:>12}".format('model', 'L1', 'L1 fp32', 'angular deg', 'latency ms'))
+    for name, result in results.items():
+        angular = "{:12.3f}".format(result['angular']) if input_data_type == data_type.Type.normal else \
+            "{:>12}".format('-')
+        print("{:>8} {:10.5f} {:10.5f} {} {:12.2f}".format(name, result['l1'], result['l1_reference'], angular,
+                                                        result['latency'] * 1000))
+
+
+def run(
+        checkpoint_path: str,
+        input_dir: str,
+        output_path: str,
+        input_data_type: data_type.Type,
+        calibration_size: int,
+        evaluation_size: int,
+        qat_epochs: int,
+        lr: float,
+        batch_size: int,
+        engine: str,
+        repetitions: int
+):
+    channel = 3 if input_data_type == data_type.Type.normal else 1
+    generator = load_generator(checkpoint_path, channel)
+    # the model is quantized at the resolution it was trained at
+    dim = generator.dim
+    manifest = dataset_manifest.Manifest(input_dir)
+    calibration_loader = sample_loader(input_dir, 'train', input_data_type, manifest, calibration_size, batch_size,
+                                       dim, qat_epochs > 0)
+
+    prepared = prepare(checkpoint_path, channel, dim, engine, qat_epochs > 0)
+    if qat_epochs > 0:
+        # calibrate the observers before fine-tuning, so training starts from the calibrated ranges
+        calibrate(prepared, calibration_loader)
+        fine_tune(prepared, calibration_loader, qat_epochs, lr)
+    else:
+        calibrate(prepared, calibration_loader)
+    quantized = convert(prepared, channel, dim)
+    torch.jit.save(quantized, output_path, _extra_files={'dim': str(dim)})
+    print("INT8 model written to {}".format(output_path))
+
+    evaluation_loader = sample_loader(input_dir, 'test', input_data_type, manifest, evaluation_size, batch_size,
+                                      dim)
+    sketch = torch.zeros((1, channel, dim, dim))
+    results = {}
+    for name, model in (('fp32', generator), ('int8', load_quantized(output_path))):
+        results[name] = evaluate(model, generator, evaluation_loader, input_data_type)
+        with torch.inference_mode():
+            results[name]['latency'] = onnx_generator.time_model(model, sketch, repetitions)
+    report(results, input_data_type)
+
+
+def diff_args(args):
+    run(args.checkpoint_path,
+        args.input_dir,
+        args.output_path,
+        args.input_data_type,
+        args.calibration_size,
+        args.evaluation_size,
+        args.qat_epochs,
+        args.lr,
+        args.batch_size,
+        args.engine,
+        args.repetitions)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog="map_generation_quantization")
+    parser.add_argument("--checkpoint_path", type=str, default="datasets/mapgen_test_models/normal.ckpt",
+                        help="Checkpoint of the map generation model")
+    parser.add_argument("--input_dir", type=str, default="datasets/mixed_normal",
+                        help="Directory with sketch_map_generation and target_map_generation, the train split is "
+                             "used for calibration and the test split for the comparison with the fp32 model")
+    parser.add_argument("--output_path", type=str, default="datasets/mapgen_test_models/normal_int8.pt",
+                        help="Path the quantized TorchScript model is written to")
+    parser.add_argument("--input_data_type", type=parse.p_data_type, default="normal", dest="input_data_type",
+                        help="use \"normal\" or \"depth\" as type of the model")
+    parser.add_argument("--calibration_size", type=int, default=256, help="# of sketches used for calibration")
+    parser.add_argument("--evaluation_size", type=int, default=256, help="# of sketches used for the comparison")
+    parser.add_argument("--qat_epochs", type=int, default=0,
+                        help="# of epochs of quantization aware fine-tuning on the calibration sketches, only "
+                             "calibration if 0")
+    parser.add_argument("--lr", type=float, default=1e-6, help="learning rate of the quantization aware fine-tuning")
+    parser.add_argument("--batch_size", type=int, default=8, help="size of batches")
+    parser.add_argument("--engine", type=str, default="fbgemm", choices=torch.backends.quantized.supported_engines,
+                        help="Quantized engine, \"fbgemm\" for x86 and \"qnnpack\" for arm cpus")
+    parser.add_argument("--repetitions", type=int, default=10, help="# of runs to measure the latency")
+    args = parser.parse_args(args)
+    diff_args(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,215 @@
+# Slim inference artifact of the map generation generator
+# MapGen checkpoints also contain the discriminator, both optimizer states and the hyperparameters, which are unpickled
+# and copied on every load. The slim artifact only contains the generator weights (optionally as float16) behind a small
+# JSON header with channel count, resolution, architecture and data type. The loader memory-maps the file and uses the
+# mapped float32 weights without copying them, so processes loading the same artifact share its pages through the page
+# cache.
+# Float16 halves the file size, but the weights are converted to float32 in memory.
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from source.map_generation.generator import Generator
+from source.map_generation.generator import load_generator
+from source.util import data_type
+from source.util import parse
+
+magic = b'MAPGENG1'
+# offsets of the header length, the data and all tensors are aligned, so the mapped weights can be used directly
+alignment = 64
+
+
+def aligned(
+        offset: int
+) -> int:
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def export(
+        checkpoint_path: str,
+        output_path: str,
+        input_data_type: data_type.Type,
+        half: bool = False
+):
+    channel = 3 if input_data_type == data_type.Type.normal else 1
+    generator = load_generator(checkpoint_path, channel)
+    tensors, arrays, offset = {}, [], 0
+    for name, tensor in generator.state_dict().items():
+        if half and tensor.is_floating_point():
+            tensor = tensor.half()
+        array = np.ascontiguousarray(tensor.numpy())
+        tensors[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        arrays.append((offset, array))
+        offset = aligned(offset + array.nbytes)
+    header = json.dumps({'channel': channel, 'dim': generator.dim, 'width': generator.width,
+                         'separable': generator.separable, 'data_type': input_data_type.name,
+                         'dtype': 'float16' if half else 'float32', 'tensors': tensors}).encode()
+    data_start = aligned(len(magic) + 8 + len(header))
+
+    # written to a temporary file first, so processes that have mapped an older artifact are not affected
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(magic)
+        file.write(len(header).to_bytes(8, 'little'))
+        file.write(header)
+        for array_offset, array in arrays:
+            file.seek(data_start + array_offset)
+            file.write(array.tobytes())
+        file.truncate(data_start + offset)
+    os.replace(tmp_path, output_path)
+
+
+def is_slim(
+        model_path: str
+) -> bool:
+    with open(model_path, 'rb') as file:
+        return file.read(len(magic)) == magic
+
+
+# Metadata of the artifact and the offset of the weights in the file
+def read_header(
+        model_path: str
+) -> tuple:
+    with open(model_path, 'rb') as file:
+        if file.read(len(magic)) != magic:
+            raise Exception("{} is no slim map generation model!".format(model_path))
+        header_size = int.from_bytes(file.read(8), 'little')
+        metadata = json.loads(file.read(header_size))
+    return metadata, aligned(len(magic) + 8 + header_size)
+
+
+# Generator in eval mode with the weights of a slim artifact. The generator is created on the meta device, so no
+# weights are allocated or initialized before the weights of the file are assigned. Float32 weights are used directly
+# from the mapped file. Float16 weights have to be converted to float32 anyway, so they are read tensor by tensor
+# instead of mapping the whole file in addition to the converted weights.
+def load(
+        model_path: str,
+        channel: int = None,
+        device: str = 'cpu'
+) -> Generator:
+    metadata, data_start = read_header(model_path)
+    if channel is not None and metadata['channel'] != channel:
+        raise Exception("{} has {} channels instead of {}!".format(model_path, metadata['channel'], channel))
+    generator = Generator(metadata['channel'], metadata['dim'], device='meta', width=metadata['width'],
+                          separable=metadata['separable'])
+    if set(metadata['tensors'].keys()) != set(generator.state_dict().keys()):
+        raise Exception("Weights of {} do not match the generator!".format(model_path))
+
+    # copy on write, since pytorch expects writable arrays
+    buffer = np.memmap(model_path, dtype=np.uint8, mode='c', offset=data_start) if metadata['dtype'] == 'float32' \
+        else None
+    for name, tensor_info in metadata['tensors'].items():
+        dtype = np.dtype(tensor_info['dtype'])
+        count = int(np.prod(tensor_info['shape']))
+        if buffer is not None:
+            array = buffer[tensor_info['offset']:tensor_info['offset'] + count * dtype.itemsize].view(dtype)
+        else:
+            array = np.fromfile(model_path, dtype, count, offset=data_start + tensor_info['offset'])
+        tensor = torch.from_numpy(array.reshape(tensor_info['shape']))
+        if tensor.is_floating_point():
+            tensor = tensor.float()
+        module_name, _, tensor_name = name.rpartition('.')
+        module = generator.get_submodule(module_name)
+        if tensor_name in module._parameters:
+            tensor = nn.Parameter(tensor, requires_grad=False)
+        setattr(module, tensor_name, tensor)
+    return generator.to(device).eval()
+
+
+# Resident memory of this process in MB (linux only). The peak resident memory is not used, since a spawned process
+# keeps the peak of the process it was forked from.
+def resident_memory() -> float:
+    with open('/proc/self/status') as file:
+        for line in file:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.
+
+
+# Load time and increase of the resident memory of a fresh process when loading a model and generating one map
+def measure_load(
+        model_path: str,
+        channel: int,
+        dim: int
+) -> tuple:
+    start_memory = resident_memory()
+    start = time.perf_counter()
+    generator = load(model_path, channel) if is_slim(model_path) else load_generator(model_path, channel)
+    load_time = time.perf_counter() - start
+    load_memory = resident_memory()
+    with torch.inference_mode():
+        generator(torch.zeros((1, channel, dim, dim)))
+    return load_time, load_memory - start_memory, resident_memory() - start_memory
+
+
+# Compare output, file size, load time and memory of the checkpoint and the slim artifact
+def check(
+        checkpoint_path: str,
+        slim_path: str,
+        channel: int
+):
+    dim = read_header(slim_path)[0]['dim']
+    sketch = torch.where(torch.rand((1, 1, dim, dim)) > 0.9, 1., -1.).expand(-1, channel, -1, -1)
+    with torch.inference_mode():
+        difference = torch.max(torch.abs(load_generator(checkpoint_path, channel)(sketch) -
+                                         load(slim_path, channel)(sketch))).item()
+    print("Max. absolute difference: {:.2e}".format(difference))
+
+    # each model is loaded by a new process, like the pipeline does
+    context = multiprocessing.get_context('spawn')
+    print("{:>12} {:>10} {:>10} {:>10} {:>12}".format('model', 'file MB', 'load ms', 'load MB', 'with map MB'))
+    for name, model_path in (('checkpoint', checkpoint_path), ('slim', slim_path)):
+        with context.Pool(1) as pool:
+            load_time, load_memory, map_memory = pool.apply(measure_load, (model_path, channel, dim))
+        print("{:>12} {:10.1f} {:10.1f} {:10.1f} {:12.1f}".format(name, os.path.getsize(model_path) / 2 ** 20,
+                                                                  load_time * 1000, load_memory, map_memory))
+
+
+def run(
+        checkpoint_path: str,
+        output_path: str,
+        input_data_type: data_type.Type,
+        half: bool,
+        check_export: bool
+):
+    export(checkpoint_path, output_path, input_data_type, half)
+    print("Slim model written to {}".format(output_path))
+    if check_export:
+        check(checkpoint_path, output_path, 3 if input_data_type == data_type.Type.normal else 1)
+
+
+def diff_args(args):
+    run(args.checkpoint_path,
+        args.output_path,
+        args.input_data_type,
+        args.half,
+        args.check)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog="map_generation_slim_export")
+    parser.add_argument("--checkpoint_path", type=str, default="datasets/mapgen_test_models/normal.ckpt",
+                        help="Checkpoint of the map generation model")
+    parser.add_argument("--output_path", type=str, default="datasets/mapgen_test_models/normal.mapgen",
+                        help="Path the slim model is written to")
+    parser.add_argument("--input_data_type", type=parse.p_data_type, default="normal", dest="input_data_type",
+                        help="use \"normal\" or \"depth\" as type of the model")
+    parser.add_argument("--half", type=parse.p_bool, default="False", dest="half",
+                        help="Store the weights as float16, which halves the file size; use \"True\" or \"False\" as "
+                             "parameter")
+    parser.add_argument("--check", type=parse.p_bool, default="True", dest="check",
+                        help="Compare output, load time and memory of the slim model with the checkpoint; use "
+                             "\"True\" or \"False\" as parameter")
+    args = parser.parse_args(args)
+    diff_args(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,151 @@
+# Low overhead telemetry of the map generation training
+# Losses are accumulated on the device and only transferred every flush_frequency steps, so steps do not wait for the
+# device. The wall time of the phases of a step (data wait, teacher forward of the distillation, generator forward,
+# discriminator forward, gradient penalty, backward, optimizer) is measured with the host clock on cpus and with cuda
+# events on gpus, which are read at the flush. Phases are also named ranges of the torch profiler, which optionally
+# records a window of steps as chrome trace.
+import contextlib
+import os
+import time
+
+import torch
+import torch.distributed as dist
+
+# phases of a step, other names are rejected, so the logged time_ms/<phase> metrics stay the same
+phases = ('data', 'teacher_forward', 'generator_forward', 'discriminator_forward', 'gradient_penalty', 'backward',
+          'optimizer')
+
+
+class Telemetry:
+    def __init__(
+            self,
+            flush_frequency: int = 50,
+            profile_start: int = 0,
+            profile_steps: int = 0,
+            trace_dir: str = ''
+    ):
+        self.flush_frequency = max(flush_frequency, 1)
+        self.use_cuda_events = False
+        self.steps = 0
+        self.loss_sums = {}
+        self.loss_counts = {}
+        self.phase_times = {}
+        # cuda events of the phases since the last flush
+        self.phase_events = []
+        self.phase_starts = {}
+        self.batch_end_time = None
+
+        self.profile_start = profile_start
+        self.profile_steps = profile_steps
+        self.trace_dir = trace_dir
+        self.profiler = None
+
+    def start(
+            self,
+            name: str
+    ):
+        if name not in phases:
+            raise Exception("Unknown phase {}, use one of {}!".format(name, phases))
+        if self.use_cuda_events:
+            event = torch.cuda.Event(enable_timing=True)
+            event.record()
+            self.phase_starts[name] = event
+        else:
+            self.phase_starts[name] = time.perf_counter()
+
+    def stop(
+            self,
+            name: str
+    ):
+        start = self.phase_starts.pop(name, None)
+        if start is None:
+            return
+        if self.use_cuda_events:
+            event = torch.cuda.Event(enable_timing=True)
+            event.record()
+            self.phase_events.append((name, start, event))
+        else:
+            self.phase_times[name] = self.phase_times.get(name, 0.) + (time.perf_counter() - start) * 1000
+
+    @contextlib.contextmanager
+    def phase(
+            self,
+            name: str
+    ):
+        with torch.profiler.record_function(name):
+            self.start(name)
+            try:
+                yield
+            finally:
+                self.stop(name)
+
+    def add_loss(
+            self,
+            name: str,
+            value: torch.Tensor
+    ):
+        value = value.detach().float()
+        self.loss_sums[name] = self.loss_sums[name] + value if name in self.loss_sums else value
+        self.loss_counts[name] = self.loss_counts.get(name, 0) + 1
+
+    # Time since the end of the last step, i.e. waiting for the data loader and the transfer of the batch
+    def batch_start(self):
+        if self.batch_end_time is not None:
+            self.phase_times['data'] = self.phase_times.get('data', 0.) + \
+                (time.perf_counter() - self.batch_end_time) * 1000
+
+    # Mean losses and mean milliseconds of each phase per step since the last flush every flush_frequency steps,
+    # otherwise None
+    def batch_end(self) -> dict | None:
+        self.steps += 1
+        if self.profiler is not None:
+            self.profiler.step()
+        metrics = self.flush() if self.steps % self.flush_frequency == 0 else None
+        self.batch_end_time = time.perf_counter()
+        return metrics
+
+    def flush(self) -> dict:
+        metrics = {}
+        if len(self.loss_sums) > 0:
+            # one transfer for all losses
+            names = list(self.loss_sums.keys())
+            values = torch.stack([self.loss_sums[name] / self.loss_counts[name] for name in names]).tolist()
+            metrics.update(zip(names, values))
+        if len(self.phase_events) > 0:
+            self.phase_events[-1][2].synchronize()
+            for name, start, end in self.phase_events:
+                self.phase_times[name] = self.phase_times.get(name, 0.) + start.elapsed_time(end)
+        steps = self.steps % self.flush_frequency or self.flush_frequency
+        for name, phase_time in self.phase_times.items():
+            metrics['time_ms/' + name] = phase_time / steps
+        self.loss_sums, self.loss_counts, self.phase_times, self.phase_events = {}, {}, {}, []
+        return metrics
+
+    # Profiles profile_steps steps after the first profile_start steps, if profile_steps is given
+    def start_profiler(self):
+        if self.profile_steps <= 0:
+            return
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if self.use_cuda_events:
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self.profiler = torch.profiler.profile(
+            activities=activities,
+            schedule=torch.profiler.schedule(wait=max(self.profile_start - 1, 0), warmup=min(self.profile_start, 1),
+                                             active=self.profile_steps, repeat=1),
+            on_trace_ready=self.export_trace)
+        self.profiler.start()
+
+    def stop_profiler(self):
+        if self.profiler is not None:
+            self.profiler.stop()
+            self.profiler = None
+
+    def export_trace(
+            self,
+            profiler: torch.profiler.profile
+    ):
+        os.makedirs(self.trace_dir, exist_ok=True)
+        rank = dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+        trace_path = os.path.join(self.trace_dir, 'trace_rank{}_step{}.json'.format(rank, self.steps))
+        profiler.export_chrome_trace(trace_path)
+        print("Profile of {} steps written to {}".format(self.profile_steps, trace_path))
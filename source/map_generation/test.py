@@ -8,8 +8,11 @@ from pytorch_lightning.trainer import Trainer
 
 from source.map_generation_dataset import dataset
 from source.map_generation_dataset import dataset_ShapeNet
+from source.map_generation_dataset import dataset_shards
+from source.map_generation_dataset import manifest as dataset_manifest
 from source.util import data_type
 from source.util import dir_utils
+from source.util import OpenEXR_utils
 
 
 def test(
@@ -19,9 +22,11 @@ def test(
         input_data_type: data_type.Type,
         generated_model_path: str,
         devices: int = 1,
-        use_shapenet: bool = False
+        use_shapenet: bool = False,
+        shard_dir: str = '',
+        manifest_path: str = ''
 ):
-    if len(input_dir) <= 0 or not os.path.exists(input_dir):
+    if len(shard_dir) <= 0 and (len(input_dir) <= 0 or not os.path.exists(input_dir)):
         raise Exception("Input directory: {} is not given or does not exist!".format(input_dir))
     if len(logs_dir) <= 0:
         raise Exception("Logs Path is not given!")
@@ -30,7 +35,7 @@ def test(
     dir_utils.create_general_folder(os.path.join(logs_dir, logs_dir_name))
     sketch_dir = os.path.join(input_dir, 'sketch_map_generation')
     target_dir = os.path.join(input_dir, 'target_map_generation')
-    if not os.path.exists(sketch_dir):
+    if len(shard_dir) <= 0 and not os.path.exists(sketch_dir):
         raise Exception("Sketch dir: {} does not exists!".format(sketch_dir))
     test_dir_sketch = os.path.join(sketch_dir, 'test')
     test_dir_target = os.path.join(target_dir, 'test')
@@ -39,17 +44,21 @@ def test(
 
     if not os.path.exists(generated_model_path):
         raise Exception("Generated model paths are not given or false!")
-    model = map_generation.MapGen.load_from_checkpoint(generated_model_path,
-                                                       output_dir=output_dir)
+    model = map_generation.MapGenTest(input_data_type, generated_model_path, output_dir)
 
-    if use_shapenet and os.path.exists(test_dir_target):
-        dataSet = dataset_ShapeNet.DS(False, input_data_type, test_dir_sketch, test_dir_target, full_ds=True)
+    manifest = dataset_manifest.Manifest(input_dir, manifest_path) if len(shard_dir) <= 0 else None
+    if len(shard_dir) > 0:
+        dataSet = dataset_shards.DS(input_data_type, os.path.join(shard_dir, 'test'))
+    elif use_shapenet and os.path.exists(test_dir_target):
+        dataSet = dataset_ShapeNet.DS(False, input_data_type, test_dir_sketch, test_dir_target, full_ds=True,
+                                      manifest=manifest)
     elif use_shapenet:
-        dataSet = dataset_ShapeNet.DS(False, input_data_type, test_dir_sketch, full_ds=True)
+        dataSet = dataset_ShapeNet.DS(False, input_data_type, test_dir_sketch, full_ds=True,
+                                      manifest=manifest)
     elif os.path.exists(test_dir_target):
-        dataSet = dataset.DS(False, input_data_type, test_dir_sketch, test_dir_target)
+        dataSet = dataset.DS(False, input_data_type, test_dir_sketch, test_dir_target, manifest)
     else:
-        dataSet = dataset.DS(False, input_data_type, test_dir_sketch)
+        dataSet = dataset.DS(False, input_data_type, test_dir_sketch, manifest=manifest)
 
     strategy = None
     accelerator = 'gpu' if torch.cuda.is_available() else 'cpu'
@@ -71,4 +80,7 @@ def test(
                       num_nodes=1)
     dataloader = DataLoader(dataSet, batch_size=1,
                             shuffle=False, num_workers=1)
-    trainer.test(model, dataloaders=dataloader)
+    with OpenEXR_utils.BackgroundWriter() as writer:
+        model.exr_writer = writer
+        trainer.test(model, dataloaders=dataloader)
+    model.exr_writer = None
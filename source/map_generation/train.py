@@ -1,15 +1,23 @@
 # Setup for training map generation
 # Training and Validation with subsequent Test step
+import functools
 import os.path
 import map_generation
 import torch
 from torch.utils.data import DataLoader
 from pytorch_lightning.loggers import TensorBoardLogger
 from pytorch_lightning.callbacks import ModelCheckpoint
+from pytorch_lightning.strategies import DDPStrategy
 from pytorch_lightning.trainer import Trainer
 
+from source.map_generation import telemetry
 from source.map_generation_dataset import dataset
 from source.map_generation_dataset import dataset_ShapeNet
+from source.map_generation_dataset import dataset_shards
+from source.map_generation_dataset import manifest as dataset_manifest
+from source.map_generation_dataset import sample_cache
+from source.map_generation_dataset import sampler
+from source.util import cpu_utils
 from source.util import data_type
 from source.util import dir_utils
 
@@ -31,37 +39,65 @@ def train(
         generated_model_path: str = '',
         devices: int = 1,
         use_shapenet: bool = False,
-        shapenet_train_size: int = 200
+        shapenet_train_size: int = 200,
+        shard_dir: str = '',
+        manifest_path: str = '',
+        cache_size: int = 0,
+        compact_transport: bool = False,
+        seed: int = 0,
+        manual_optimization: bool = False,
+        intra_op_threads: int = 0,
+        channels_last: bool = True,
+        precision: str = 'bfloat16',
+        num_nodes: int = 1,
+        profile_start: int = 0,
+        profile_steps: int = 0,
+        dim: int = 256,
+        teacher_path: str = '',
+        student_width: int = 32,
+        weight_features: float = 1.
 ):
-    sketch_dir = os.path.join(input_dir, 'sketch_map_generation')
-    target_dir = os.path.join(input_dir, 'target_map_generation')
-    if not os.path.exists(sketch_dir) or not os.path.exists(target_dir):
-        raise Exception("Sketch dir: {} or target dir: {} does not exists!".format(sketch_dir, target_dir))
-
     logs_dir_name = 'trainModel'
     if len(logs_dir) <= 0:
         raise Exception("Logs Path is not given!")
     # Use general folder instead of logs dir since pytorch already takes care of folder versioning.
     dir_utils.create_general_folder(os.path.join(logs_dir, logs_dir_name))
 
-    model = map_generation.MapGen(input_type=input_data_type,
-                                  n_critic=n_critic,
-                                  weight_L1=weight_L1,
-                                  gradient_penalty_coefficient=gradient_penalty_coefficient,
-                                  output_dir=output_dir,
-                                  lr=lr,
-                                  batch_size=batch_size)
+    if len(teacher_path) > 0:
+        if manual_optimization:
+            raise Exception("Manual optimization is not supported in distillation!")
+        # compact student generator distilled from the generator of the teacher checkpoint
+        model_class = map_generation.MapGenDistill
+        hyperparameters = dict(data_type=input_data_type,
+                               teacher_path=teacher_path,
+                               weight_features=weight_features,
+                               output_dir=output_dir,
+                               lr=lr,
+                               batch_size=batch_size,
+                               dim=dim,
+                               width=student_width)
+    else:
+        # With manual optimization, the generator output of a batch is reused for all updates of its critic cycle
+        model_class = map_generation.MapGenManual if manual_optimization else map_generation.MapGen
+        hyperparameters = dict(data_type=input_data_type,
+                               n_critic=n_critic,
+                               weight_L1=weight_L1,
+                               gradient_penalty_coefficient=gradient_penalty_coefficient,
+                               output_dir=output_dir,
+                               lr=lr,
+                               batch_size=batch_size,
+                               dim=dim)
 
     if use_generated_model:
         if not os.path.exists(generated_model_path):
             raise Exception("Generated model paths are not given or false!")
-        model.load_from_checkpoint(generated_model_path,
-                                   n_critic=n_critic,
-                                   weight_L1=weight_L1,
-                                   gradient_penalty_coefficient=gradient_penalty_coefficient,
-                                   output_dir=output_dir,
-                                   lr=lr,
-                                   batch_size=batch_size)
+        # training continues from the weights of the checkpoint with the given hyperparameters
+        model = model_class.load_from_checkpoint(generated_model_path, **hyperparameters)
+    else:
+        model = model_class(**hyperparameters)
+    # losses and phase times are logged every log_frequency steps, optionally profile_steps steps are profiled
+    model.telemetry = telemetry.Telemetry(log_frequency, profile_start, profile_steps,
+                                          os.path.join(logs_dir, logs_dir_name, 'traces'))
 
     checkpoint_callback = ModelCheckpoint(
         save_top_k=5,
@@ -73,6 +109,99 @@ def train(
     )
     logger = TensorBoardLogger(logs_dir, name=logs_dir_name)
 
+    dataSet_train, dataSet_val, dataSet_test = create_datasets(input_dir, input_data_type, use_shapenet,
+                                                               shapenet_train_size, shard_dir, manifest_path,
+                                                               cache_size, compact_transport)
+
+    strategy = None
+    accelerator = 'gpu' if torch.cuda.is_available() else 'cpu'
+    if accelerator == 'gpu' and (devices > 1 or (devices == -1 and torch.cuda.device_count() > 1)):
+        strategy = 'ddp'
+    elif accelerator == 'cpu' and (devices > 1 or num_nodes > 1):
+        # devices processes per node, which are started by the trainer
+        strategy = DDPStrategy(process_group_backend='gloo')
+    if strategy is not None and manual_optimization:
+        raise Exception("Manual optimization is not supported in distributed training!")
+    # Mixed precision with float16 on gpus and bfloat16 autocast on cpus, on cpus without native bfloat16 instructions
+    # (AMX or AVX512-BF16) float32 is faster
+    if precision == 'float32':
+        trainer_precision = 32
+    else:
+        trainer_precision = 16 if accelerator == 'gpu' else 'bf16'
+
+    # The cores of the host are split between the training processes. Each process keeps its intra-op threads (one on
+    # gpus) and its data loader workers get the cores left over. On cpus, threads and workers are pinned to their cores.
+    if accelerator == 'gpu':
+        processes = devices if devices > 0 else torch.cuda.device_count()
+    else:
+        processes = max(devices, 1)
+    train_cores, worker_cores = cpu_utils.split_cores(intra_op_threads if accelerator == 'cpu' else 1, processes,
+                                                      int(os.environ.get('LOCAL_RANK', 0)))
+    num_workers = len(worker_cores)
+    worker_init_fn = None
+    if accelerator == 'cpu':
+        cpu_utils.pin_process(train_cores)
+        worker_init_fn = functools.partial(cpu_utils.pin_worker, worker_cores) if num_workers > 0 else None
+        # channels last mainly speeds up the bfloat16 kernels of oneDNN, with float32 it is about as fast as contiguous
+        if channels_last:
+            model = model.to(memory_format=torch.channels_last)
+            model.channels_last = True
+
+    trainer = Trainer(accelerator=accelerator,
+                      devices=devices,
+                      max_epochs=epochs,
+                      callbacks=[checkpoint_callback],
+                      logger=logger,
+                      precision=trainer_precision,
+                      strategy=strategy,
+                      num_nodes=num_nodes,
+                      log_every_n_steps=log_frequency)
+
+    # Compact batches are small enough to be pinned for a faster transfer to the gpu
+    pin_memory = compact_transport and accelerator == 'gpu'
+    # The samplers shard the datasets between the ranks with a plan per epoch shared by all ranks, ShapeNet draws the
+    # same # of samples of each class per epoch. The validation plan stays the same in each epoch.
+    sampler_train = sampler.create_sampler(dataSet_train, True, seed)
+    sampler_val = sampler.create_sampler(dataSet_val, False, seed)
+    dataloader_train = DataLoader(dataSet_train, batch_size=batch_size, sampler=sampler_train,
+                                  num_workers=num_workers, pin_memory=pin_memory, worker_init_fn=worker_init_fn)
+    dataloader_vaild = DataLoader(dataSet_val, batch_size=batch_size, sampler=sampler_val,
+                                  num_workers=num_workers, pin_memory=pin_memory, worker_init_fn=worker_init_fn)
+    trainer.fit(model, dataloader_train, dataloader_vaild)
+    sample_cache.print_stats('train', dataSet_train)
+    sample_cache.print_stats('val', dataSet_val)
+
+    # every test sample is predicted, the last samples may be predicted twice to give all ranks the same # of samples
+    dataloader_test = DataLoader(dataSet_test, batch_size=1, sampler=sampler.create_sampler(dataSet_test, False, seed,
+                                                                                             False),
+                                 num_workers=num_workers, pin_memory=pin_memory, worker_init_fn=worker_init_fn)
+    trainer.test(model, dataloader_test)
+    sample_cache.print_stats('test', dataSet_test)
+
+
+# Datasets for train, validation and test either from the sketch_map_generation and target_map_generation dirs in
+# input_dir or from the shards of each split in shard_dir. All splits share one manifest of input_dir. If cache_size
+# is given, each split caches up to cache_size MB of decoded samples. With compact, the samples are emitted as uint8 and
+# float16 and normalized by the model.
+def create_datasets(
+        input_dir: str,
+        input_data_type: data_type.Type,
+        use_shapenet: bool,
+        shapenet_train_size: int,
+        shard_dir: str = '',
+        manifest_path: str = '',
+        cache_size: int = 0,
+        compact: bool = False
+) -> tuple:
+    if len(shard_dir) > 0:
+        return tuple(dataset_shards.DS(input_data_type, os.path.join(shard_dir, split), compact)
+                     for split in ('train', 'val', 'test'))
+
+    sketch_dir = os.path.join(input_dir, 'sketch_map_generation')
+    target_dir = os.path.join(input_dir, 'target_map_generation')
+    if not os.path.exists(sketch_dir) or not os.path.exists(target_dir):
+        raise Exception("Sketch dir: {} or target dir: {} does not exists!".format(sketch_dir, target_dir))
+
     sketch_train_dir = os.path.join(sketch_dir, 'train')
     if not os.path.exists(sketch_train_dir):
         raise Exception("Train dir in {} does not exist".format(sketch_dir))
@@ -92,6 +221,7 @@ def train(
     if not os.path.exists(target_test_dir):
         raise Exception("Test dir in {} does not exist".format(target_dir))
 
+    manifest = dataset_manifest.Manifest(input_dir, manifest_path)
     if use_shapenet:
         # Compute train, validation split based on ratio used by Kato et al. (Neural mesh renderer)
         split_train, split_val = 87.5, 12.5
@@ -99,39 +229,17 @@ def train(
         shapenet_val_size = int(split_train_val * 12.5 / 100)
         print("Validation size {0}".format(shapenet_val_size))
         dataSet_train = dataset_ShapeNet.DS(True, input_data_type, sketch_train_dir, target_train_dir,
-                                            size=shapenet_train_size, full_ds=False)
+                                            size=shapenet_train_size, full_ds=False, manifest=manifest,
+                                            cache_size=cache_size, compact=compact)
         dataSet_val = dataset_ShapeNet.DS(True, input_data_type, sketch_val_dir, target_val_dir, size=shapenet_val_size,
-                                          full_ds=False)
-        dataSet_test = dataset_ShapeNet.DS(True, input_data_type, sketch_test_dir, target_test_dir, full_ds=True)
+                                          full_ds=False, manifest=manifest, cache_size=cache_size, compact=compact)
+        dataSet_test = dataset_ShapeNet.DS(True, input_data_type, sketch_test_dir, target_test_dir, full_ds=True,
+                                           manifest=manifest, cache_size=cache_size, compact=compact)
     else:
-        dataSet_train = dataset.DS(True, input_data_type, sketch_train_dir, target_train_dir)
-        dataSet_val = dataset.DS(True, input_data_type, sketch_val_dir, target_val_dir)
-        dataSet_test = dataset.DS(True, input_data_type, sketch_test_dir, target_test_dir)
-
-    # While CPU training is technically possible, it would take unreasobaly long
-    strategy = None
-    accelerator = 'gpu' if torch.cuda.is_available() else 'cpu'
-    if accelerator == 'gpu' and (devices > 1 or (devices == -1 and torch.cuda.device_count() > 1)):
-        strategy = 'ddp'
-    elif accelerator == 'cpu':
-        raise Exception("Training with cpus not permitted!")
-
-    trainer = Trainer(accelerator=accelerator,
-                      devices=devices,
-                      max_epochs=epochs,
-                      callbacks=[checkpoint_callback],
-                      logger=logger,
-                      precision=16,
-                      strategy=strategy,
-                      log_every_n_steps=log_frequency)
-
-    # Change number for workers accoding to number of available CPUs
-    dataloader_train = DataLoader(dataSet_train, batch_size=batch_size,
-                                  shuffle=True, num_workers=48)
-    dataloader_vaild = DataLoader(dataSet_val, batch_size=batch_size,
-                                  shuffle=False, num_workers=48)
-    trainer.fit(model, dataloader_train, dataloader_vaild)
-
-    dataloader_test = DataLoader(dataSet_test, batch_size=1,
-                                 shuffle=False, num_workers=48)
-    trainer.test(model, dataloader_test)
+        dataSet_train = dataset.DS(True, input_data_type, sketch_train_dir, target_train_dir, manifest, cache_size,
+                                   compact)
+        dataSet_val = dataset.DS(True, input_data_type, sketch_val_dir, target_val_dir, manifest, cache_size,
+                                 compact)
+        dataSet_test = dataset.DS(True, input_data_type, sketch_test_dir, target_test_dir, manifest, cache_size,
+                                  compact)
+    return dataSet_train, dataSet_val, dataSet_test
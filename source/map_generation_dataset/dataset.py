@@ -1,12 +1,11 @@
 # Dataset for Thingy10k/ABC data
 import os
 import torch
-from torchvision import transforms
 from torch.utils.data import Dataset
-from PIL import Image
 
+from source.map_generation_dataset import manifest as dataset_manifest
+from source.map_generation_dataset import sample_cache
 from source.util import data_type
-from source.util import OpenEXR_utils
 
 
 class DS(Dataset):
@@ -15,14 +14,31 @@ class DS(Dataset):
             train: bool,
             input_data_type: data_type.Type,
             input_dir: str,
-            target_dir: str = ''
+            target_dir: str = '',
+            manifest: dataset_manifest.Manifest = None,
+            cache_size: int = 0,
+            compact: bool = False
     ):
         self.data_type = input_data_type
+        # emit uint8 sketches and float16 targets, which are normalized by the model (see transport)
+        self.compact = compact
         self.train = train
         self.input_dir = input_dir
-        self.input_image_paths = sorted(self.create_dataSet(input_dir))
         self._target_dir = target_dir
-        self._target_image_paths = sorted(self.create_dataSet(target_dir))
+        if manifest is not None:
+            pairs = manifest.pairs(input_dir, target_dir, input_data_type)
+            self.input_image_paths = [pair['input_path'] for pair in pairs]
+            self._target_image_paths = [pair['target_path'] for pair in pairs if 'target_path' in pair]
+        else:
+            self.input_image_paths = sorted(self.create_dataSet(input_dir))
+            self._target_image_paths = sorted(self.create_dataSet(target_dir))
+        # optional cache of cache_size MB shared by all workers
+        self.cache = None
+        if cache_size > 0 and len(self.input_image_paths) > 0:
+            self.cache = sample_cache.create_cache(cache_size, len(self.input_image_paths), input_data_type,
+                                                   self.input_image_paths[0],
+                                                   self._target_image_paths[0] if self._target_image_paths else None,
+                                                   compact)
 
     @property
     def target_dir(self) -> list:
@@ -55,10 +71,7 @@ class DS(Dataset):
     def __len__(self) -> int:
         # return only length of one of the dirs since we want to iterate over both dirs at the same time and this
         # function is only used for batch computations
-        length_input = len(
-            [entry for entry in os.listdir(self.input_dir) if os.path.isfile(os.path.join(self.input_dir, entry))]
-        )
-        return length_input
+        return len(self.input_image_paths)
 
     def create_dataSet(
             self,
@@ -75,22 +88,21 @@ class DS(Dataset):
             self,
             index: int
     ) -> dir:
-        # input is sketch, therefore png file
+        # input is sketch, therefore png file, target is either normal or depth file, therefore exr
         input_path = self.input_image_paths[index]
-        if self.data_type == data_type.Type.normal:
-            input_image = Image.open(input_path).convert('RGB')
-        else:
-            input_image = Image.open(input_path).convert('L')
-        transform = transforms.PILToTensor()
-        input_image_tensor = transform(input_image).float() / 127.5 - 1.
+        target_path = self._target_image_paths[index] if self._target_image_paths else None
+        input_image, target_image = sample_cache.load_sample(self.cache, index, self.data_type, input_path,
+                                                             target_path, self.compact)
+        input_image_tensor = torch.from_numpy(input_image)
+        if not self.compact:
+            input_image_tensor = input_image_tensor.float() / 127.5 - 1.
 
-        # target is either normal or depth file, therefore exr
-        if self._target_image_paths:
-            target_path = self._target_image_paths[index]
-            target_image = OpenEXR_utils.getImageEXR(target_path, self.data_type, 0)
+        if target_path is not None:
             target_image_tensor = torch.from_numpy(target_image)
-            if self.data_type.value == data_type.Type.depth.value:
-                target_image_tensor = target_image_tensor * 2 - 1
+            if not self.compact:
+                target_image_tensor = target_image_tensor.float()
+                if self.data_type.value == data_type.Type.depth.value:
+                    target_image_tensor = target_image_tensor * 2 - 1
             return {'input': input_image_tensor,
                     'target': target_image_tensor,
                     'input_path': input_path,
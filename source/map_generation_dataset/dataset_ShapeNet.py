@@ -1,14 +1,13 @@
 # Dataset for Shapenet data
+import bisect
 import os
 
 import torch
-import numpy as np
-from torchvision import transforms
 from torch.utils.data import Dataset
-from PIL import Image
 
+from source.map_generation_dataset import manifest as dataset_manifest
+from source.map_generation_dataset import sample_cache
 from source.util import data_type
-from source.util import OpenEXR_utils
 
 
 class DS(Dataset):
@@ -19,9 +18,14 @@ class DS(Dataset):
             input_dir: str,
             target_dir: str = '',
             size=0,
-            full_ds=False
+            full_ds=False,
+            manifest: dataset_manifest.Manifest = None,
+            cache_size: int = 0,
+            compact: bool = False
     ):
         self.data_type = input_data_type
+        # emit uint8 sketches and float16 targets, which are normalized by the model (see transport)
+        self.compact = compact
         self.train = train
         self.classes = ['03001627', '02691156', '02828884', '02933112', '02958343', '03211117',
                         '03636649', '03691459', '04090263',
@@ -30,7 +34,9 @@ class DS(Dataset):
         self.input_dir = input_dir
         self._target_dir = target_dir
         # use whole test set for evaluation
-        if full_ds:
+        if manifest is not None:
+            self.create_dataSet_manifest(manifest, full_ds)
+        elif full_ds:
             self.image_paths_input = sorted(self.create_dataSet_list(input_dir))
             self._image_paths_target = sorted(self.create_dataSet_list(target_dir))
         else:
@@ -38,6 +44,49 @@ class DS(Dataset):
             self._image_paths_target = self.create_dataSet_dir(target_dir)
         self.size = size
         self.full_ds = full_ds
+        if not full_ds:
+            # start of each class in the list of all files ordered by class, which is indexed by the sampler
+            self.class_sizes = [len(self.image_paths_input[c]) for c in self.classes]
+            self.class_starts = [sum(self.class_sizes[:i]) for i in range(len(self.classes))]
+        self.create_cache(cache_size)
+
+    # Optional cache of cache_size MB shared by all workers. Samples are identified by their index in the list of all
+    # files, which are ordered by class if not the full dataset is used.
+    def create_cache(
+            self,
+            cache_size: int
+    ):
+        self.cache = None
+        if self.full_ds:
+            input_paths, target_paths = self.image_paths_input, self._image_paths_target
+        else:
+            input_paths, target_paths = [], []
+            for c in self.classes:
+                input_paths += self.image_paths_input[c]
+                target_paths += self._image_paths_target[c]
+        if cache_size > 0 and len(input_paths) > 0:
+            target_path = target_paths[0] if len(self._target_dir) > 0 else None
+            self.cache = sample_cache.create_cache(cache_size, len(input_paths), self.data_type, input_paths[0],
+                                                   target_path, self.compact)
+
+    # Pair sketches and targets of all classes by stem instead of by position
+    def create_dataSet_manifest(
+            self,
+            manifest: dataset_manifest.Manifest,
+            full_ds: bool
+    ):
+        pairs = [pair for pair in manifest.pairs(self.input_dir, self._target_dir, self.data_type)
+                 if pair['class'] in self.classes]
+        if full_ds:
+            self.image_paths_input = [pair['input_path'] for pair in pairs]
+            self._image_paths_target = [pair['target_path'] for pair in pairs if 'target_path' in pair]
+        else:
+            self.image_paths_input = {c: [] for c in self.classes}
+            self._image_paths_target = {c: [] for c in self.classes}
+            for pair in pairs:
+                self.image_paths_input[pair['class']].append(pair['input_path'])
+                if 'target_path' in pair:
+                    self._image_paths_target[pair['class']].append(pair['target_path'])
 
     def create_dataSet_dir(
             self,
@@ -77,6 +126,7 @@ class DS(Dataset):
         else:
             self._target_dir = ''
 
+    # Without full dataset, length of an epoch. Samples are drawn by sampler.ClassBalancedSampler in this case.
     def __len__(self):
         if self.full_ds:
             length_input = len(self.image_paths_input)
@@ -90,27 +140,29 @@ class DS(Dataset):
     ) -> dir:
         if self.full_ds:
             input_path = self.image_paths_input[index]
-            target_path = self._image_paths_target[index]
+            target_path = self._image_paths_target[index] if len(self._target_dir) > 0 else None
         else:
-            current_class = np.random.choice(self.classes)
-            rand_idx = np.random.randint(0, len(self.image_paths_input[current_class]))
+            # index of the file in the list of all files ordered by class as given by the sampler
+            class_index = bisect.bisect_right(self.class_starts, index) - 1
+            current_class = self.classes[class_index]
+            file_index = index - self.class_starts[class_index]
             # input is sketch, therefore png file
-            input_path = self.image_paths_input[current_class][rand_idx]
-            target_path = self._image_paths_target[current_class][rand_idx]
+            input_path = self.image_paths_input[current_class][file_index]
+            target_path = self._image_paths_target[current_class][file_index] if len(self._target_dir) > 0 else None
 
-        if self.data_type == data_type.Type.normal:
-            input_image = Image.open(input_path).convert('RGB')
-        else:
-            input_image = Image.open(input_path).convert('L')
-        transform = transforms.PILToTensor()
-        input_image_tensor = transform(input_image).float() / 127.5 - 1.
+        input_image, target_image = sample_cache.load_sample(self.cache, index, self.data_type, input_path,
+                                                             target_path, self.compact)
+        input_image_tensor = torch.from_numpy(input_image)
+        if not self.compact:
+            input_image_tensor = input_image_tensor.float() / 127.5 - 1.
 
         # target is either normal or depth file, therefore exr
-        if len(self._target_dir) > 0:
-            target_image = OpenEXR_utils.getImageEXR(target_path, self.data_type, 0)
+        if target_path is not None:
             target_image_tensor = torch.from_numpy(target_image)
-            if self.data_type.value == data_type.Type.depth.value:
-                target_image_tensor = target_image_tensor * 2 - 1
+            if not self.compact:
+                target_image_tensor = target_image_tensor.float()
+                if self.data_type.value == data_type.Type.depth.value:
+                    target_image_tensor = target_image_tensor * 2 - 1
             return {'input': input_image_tensor,
                     'target': target_image_tensor,
                     'input_path': input_path,
@@ -0,0 +1,201 @@
+# Dataset packed into memory-mapped shards
+# Sketches are stored as uint8 (N, H, W) and targets as float16 (N, C, H, W) npy files, so a sample is a slice of a
+# memory-mapped array instead of one png and one exr file open. The converter uses the sketch_map_generation /
+# target_map_generation directory layout of the other datasets.
+import argparse
+import bisect
+import json
+import os
+import sys
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+from PIL import Image
+
+from source.map_generation_dataset import manifest as dataset_manifest
+from source.util import data_type
+from source.util import dir_utils
+from source.util import OpenEXR_utils
+from source.util import parse
+
+index_filename = 'index.json'
+
+
+class DS(Dataset):
+    def __init__(
+            self,
+            input_data_type: data_type.Type,
+            shard_dir: str,
+            compact: bool = False
+    ):
+        index_path = os.path.join(shard_dir, index_filename)
+        if not os.path.exists(index_path):
+            raise Exception("Shard index {} does not exist!".format(index_path))
+        with open(index_path, 'r') as f:
+            self.index = json.load(f)
+        if self.index['data_type'] != input_data_type.name:
+            raise Exception("Shards in {} contain {} targets, not {}".format(shard_dir, self.index['data_type'],
+                                                                            input_data_type.name))
+        self.data_type = input_data_type
+        # emit the stored uint8 sketches and float16 targets, which are normalized by the model (see transport)
+        self.compact = compact
+        self.shard_dir = shard_dir
+        self.input_image_paths = self.index['input_paths']
+        self._target_image_paths = self.index['target_paths']
+        self.shard_starts = []
+        start = 0
+        for shard in self.index['shards']:
+            self.shard_starts.append(start)
+            start += shard['count']
+        self.length = start
+        # shards are opened lazily, so every DataLoader worker maps them itself instead of receiving pickled copies
+        self._shards = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shards'] = {}
+        return state
+
+    def __len__(self) -> int:
+        return self.length
+
+    def get_shard(
+            self,
+            shard_index: int
+    ) -> tuple:
+        if shard_index not in self._shards:
+            shard = self.index['shards'][shard_index]
+            # copy-on-write mapping gives writable arrays for torch without copying the data
+            sketches = np.load(os.path.join(self.shard_dir, shard['sketches']), mmap_mode='c')
+            targets = None
+            if shard['targets'] is not None:
+                targets = np.load(os.path.join(self.shard_dir, shard['targets']), mmap_mode='c')
+            self._shards[shard_index] = (sketches, targets)
+        return self._shards[shard_index]
+
+    def __getitem__(
+            self,
+            index: int
+    ) -> dir:
+        shard_index = bisect.bisect_right(self.shard_starts, index) - 1
+        sketches, targets = self.get_shard(shard_index)
+        local_index = index - self.shard_starts[shard_index]
+
+        input_image_tensor = torch.from_numpy(sketches[local_index]).unsqueeze(0)
+        if not self.compact:
+            if self.data_type == data_type.Type.normal:
+                input_image_tensor = input_image_tensor.expand(3, -1, -1)
+            input_image_tensor = input_image_tensor.float() / 127.5 - 1.
+        input_path = self.input_image_paths[index]
+
+        if targets is not None:
+            target_image_tensor = torch.from_numpy(targets[local_index])
+            if not self.compact:
+                target_image_tensor = target_image_tensor.float()
+                if self.data_type.value == data_type.Type.depth.value:
+                    target_image_tensor = target_image_tensor * 2 - 1
+            return {'input': input_image_tensor,
+                    'target': target_image_tensor,
+                    'input_path': input_path,
+                    'target_path': self._target_image_paths[index]}
+        else:
+            return {'input': input_image_tensor,
+                    'input_path': input_path}
+
+
+# Pack sketches (and targets if given) of one split into shards of at most shard_size samples
+def convert_split(
+        input_data_type: data_type.Type,
+        sketch_dir: str,
+        target_dir: str,
+        output_dir: str,
+        shard_size: int,
+        manifest: dataset_manifest.Manifest
+):
+    dir_utils.create_general_folder(output_dir)
+    pairs = manifest.pairs(sketch_dir, target_dir, input_data_type)
+    input_paths = [pair['input_path'] for pair in pairs]
+    target_paths = [pair['target_path'] for pair in pairs if 'target_path' in pair]
+    if len(input_paths) <= 0:
+        raise Exception("No sketches found in {}".format(sketch_dir))
+
+    shape = np.asarray(Image.open(input_paths[0]).convert('L')).shape
+    channel = 3 if input_data_type == data_type.Type.normal else 1
+    shards = []
+    for shard_index, start in enumerate(range(0, len(input_paths), shard_size)):
+        end = min(start + shard_size, len(input_paths))
+        sketch_file = 'sketches_{:05d}.npy'.format(shard_index)
+        sketches = np.lib.format.open_memmap(os.path.join(output_dir, sketch_file), mode='w+', dtype=np.uint8,
+                                             shape=(end - start,) + shape)
+        for i, path in enumerate(input_paths[start:end]):
+            sketches[i] = np.asarray(Image.open(path).convert('L'))
+        sketches.flush()
+        del sketches
+
+        target_file = None
+        if len(target_paths) > 0:
+            target_file = 'targets_{:05d}.npy'.format(shard_index)
+            targets = np.lib.format.open_memmap(os.path.join(output_dir, target_file), mode='w+',
+                                                dtype=np.float16, shape=(end - start, channel) + shape)
+            for i, path in enumerate(target_paths[start:end]):
+                # exr files store half values, so reading them as float16 is lossless
+                OpenEXR_utils.getImageEXR(path, input_data_type, 0, np.float16, targets[i])
+            targets.flush()
+            del targets
+        shards.append({'sketches': sketch_file, 'targets': target_file, 'count': end - start})
+        print('\r' + 'Packed {} of {} samples'.format(end, len(input_paths)), end='')
+    print()
+
+    index = {'data_type': input_data_type.name,
+             'shape': list(shape),
+             'channel': channel,
+             'shards': shards,
+             'input_paths': input_paths,
+             'target_paths': target_paths}
+    with open(os.path.join(output_dir, index_filename), 'w') as f:
+        json.dump(index, f)
+
+
+def run(
+        input_dir: str,
+        output_dir: str,
+        input_data_type: data_type.Type,
+        shard_size: int
+):
+    sketch_dir = os.path.join(input_dir, 'sketch_map_generation')
+    target_dir = os.path.join(input_dir, 'target_map_generation')
+    if not os.path.exists(sketch_dir):
+        raise Exception("Sketch dir: {} does not exists!".format(sketch_dir))
+    manifest = dataset_manifest.Manifest(input_dir)
+    for split in ('train', 'val', 'test'):
+        sketch_split_dir = os.path.join(sketch_dir, split)
+        target_split_dir = os.path.join(target_dir, split)
+        if not os.path.exists(sketch_split_dir):
+            continue
+        if not os.path.exists(target_split_dir):
+            target_split_dir = ''
+        print("Converting {} split".format(split))
+        convert_split(input_data_type, sketch_split_dir, target_split_dir, os.path.join(output_dir, split),
+                      shard_size, manifest)
+
+
+def diff_args(args):
+    run(args.input_dir, args.output_dir, args.input_data_type, args.shard_size)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog="map_generation_dataset_shards")
+    parser.add_argument("--input_dir", type=str, default="datasets/mixed_normal",
+                        help="Directory containing sketch_map_generation and target_map_generation")
+    parser.add_argument("--output_dir", type=str, default="datasets/mixed_normal_shards",
+                        help="Directory where the shards of each split are stored")
+    parser.add_argument("--input_data_type", type=parse.p_data_type, default="normal", dest="input_data_type",
+                        help="use \"normal\" or \"depth\" as type of the targets")
+    parser.add_argument("--shard_size", type=int, default=4096, help="# of samples per shard")
+    args = parser.parse_args(args)
+    diff_args(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
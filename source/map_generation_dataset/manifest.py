@@ -0,0 +1,161 @@
+# Persisted index of the sketch_map_generation and target_map_generation dirs of a dataset
+# Every directory is stored with its modification time, its subdirectories and the name, size and modification time of
+# its files. On refresh only directories whose modification time changed are listed again, unchanged ones are only
+# stat'ed. Sketches and targets are paired by their relative path and stem instead of two sorted lists lining up.
+import json
+import os
+
+from source.util import data_type
+
+manifest_filename = 'manifest.json'
+manifest_version = 1
+sketch_dir_name = 'sketch_map_generation'
+target_dir_name = 'target_map_generation'
+# Suffixes added to the name of the mesh by the dataset generation, removed to pair sketch and target
+stem_suffixes = ('_sketch', '_normal', '_depth')
+
+
+class Manifest:
+    def __init__(
+            self,
+            input_dir: str,
+            manifest_path: str = ''
+    ):
+        self.input_dir = os.path.abspath(input_dir)
+        self.manifest_path = manifest_path if len(manifest_path) > 0 else os.path.join(input_dir, manifest_filename)
+        # relative dir -> [mtime, subdirs, [[name, size, mtime], ...]]
+        self.directories = {}
+        self.load()
+        if self.refresh():
+            self.save()
+
+    def load(self):
+        if not os.path.exists(self.manifest_path):
+            return
+        with open(self.manifest_path, 'r') as f:
+            manifest = json.load(f)
+        if manifest.get('version') == manifest_version and manifest.get('input_dir') == self.input_dir:
+            self.directories = manifest['directories']
+
+    def save(self):
+        manifest = {'version': manifest_version,
+                    'input_dir': self.input_dir,
+                    'directories': self.directories}
+        # write to a temporary file first, so processes loading the manifest at the same time never see half of it
+        tmp_path = '{}.{}.tmp'.format(self.manifest_path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(manifest, f, separators=(',', ':'))
+            os.replace(tmp_path, self.manifest_path)
+        except OSError as e:
+            print("Manifest {} could not be saved: {}".format(self.manifest_path, e))
+
+    # Update the stored directories and return if anything changed
+    def refresh(self) -> bool:
+        directories = {}
+        changed = False
+        stack = [name for name in (sketch_dir_name, target_dir_name)
+                 if os.path.isdir(os.path.join(self.input_dir, name))]
+        while len(stack) > 0:
+            rel_dir = stack.pop()
+            mtime = os.stat(os.path.join(self.input_dir, rel_dir)).st_mtime_ns
+            record = self.directories.get(rel_dir)
+            if record is None or record[0] != mtime:
+                record = self.scan(rel_dir, mtime)
+                changed = True
+            directories[rel_dir] = record
+            stack.extend(os.path.join(rel_dir, subdir) for subdir in record[1])
+        if directories.keys() != self.directories.keys():
+            changed = True
+        self.directories = directories
+        return changed
+
+    def scan(
+            self,
+            rel_dir: str,
+            mtime: int
+    ) -> list:
+        subdirs = []
+        files = []
+        with os.scandir(os.path.join(self.input_dir, rel_dir)) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    subdirs.append(entry.name)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    files.append([entry.name, stat.st_size, stat.st_mtime_ns])
+        return [mtime, sorted(subdirs), sorted(files)]
+
+    # Files below given_dir keyed by their relative dir and stem without suffix
+    def files(
+            self,
+            given_dir: str
+    ) -> dict:
+        rel_given = os.path.relpath(os.path.abspath(given_dir), self.input_dir)
+        if rel_given.startswith(os.pardir):
+            raise Exception("Directory {} is not part of the dataset in {}".format(given_dir, self.input_dir))
+        files = {}
+        for rel_dir, record in self.directories.items():
+            if rel_dir != rel_given and not rel_dir.startswith(rel_given + os.sep):
+                continue
+            sub_dir = os.path.relpath(rel_dir, rel_given)
+            sub_dir = '' if sub_dir == os.curdir else sub_dir
+            # first directory below a split is the class in ShapeNet
+            class_name = sub_dir.split(os.sep)[0]
+            for name, size, mtime in record[2]:
+                stem = strip_suffix(os.path.splitext(name)[0])
+                files.setdefault(os.path.join(sub_dir, stem), []).append(
+                    {'path': os.path.join(self.input_dir, rel_dir, name),
+                     'name': name,
+                     'stem': stem,
+                     'class': class_name,
+                     'size': size,
+                     'mtime': mtime})
+        return files
+
+    # Sketches of sketch_dir with their targets of target_dir (if given) sorted by sketch path. Sketches without target
+    # are left out if target_dir is given.
+    def pairs(
+            self,
+            sketch_dir: str,
+            target_dir: str = '',
+            input_data_type: data_type.Type = None
+    ) -> list:
+        sketches = self.files(sketch_dir)
+        targets = self.files(target_dir) if len(target_dir) > 0 and os.path.exists(target_dir) else None
+        suffix = '' if input_data_type is None else '_' + input_data_type.name
+        pairs = []
+        missing = 0
+        for key, sketch_files in sketches.items():
+            target = None
+            if targets is not None:
+                target_files = targets.get(key)
+                if target_files is None:
+                    missing += len(sketch_files)
+                    continue
+                # prefer target named after the data type if several targets share the stem
+                target = next((t for t in target_files if os.path.splitext(t['name'])[0].endswith(suffix)),
+                              target_files[0])
+            for sketch in sketch_files:
+                pair = {'stem': sketch['stem'],
+                        'class': sketch['class'],
+                        'input_path': sketch['path'],
+                        'input_size': sketch['size'],
+                        'input_mtime': sketch['mtime']}
+                if target is not None:
+                    pair['target_path'] = target['path']
+                    pair['target_size'] = target['size']
+                    pair['target_mtime'] = target['mtime']
+                pairs.append(pair)
+        if missing > 0:
+            print("{} sketches in {} have no target in {} and are not used".format(missing, sketch_dir, target_dir))
+        return sorted(pairs, key=lambda pair: pair['input_path'])
+
+
+def strip_suffix(
+        stem: str
+) -> str:
+    for suffix in stem_suffixes:
+        if stem.endswith(suffix):
+            return stem[:-len(suffix)]
+    return stem
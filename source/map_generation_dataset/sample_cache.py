@@ -0,0 +1,162 @@
+# Cache of decoded samples shared by all DataLoader workers
+# Sketches are kept as uint8 and targets as float16 in fixed size slots of shared memory tensors, which are created
+# before the workers start and are therefore visible to all of them. If all slots are used the least recently used
+# sample is evicted.
+import math
+import multiprocessing
+import typing
+
+import numpy
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+from PIL import Image
+
+from source.util import data_type
+from source.util import OpenEXR_utils
+
+# counters stored in shared memory
+hits, misses, evictions, ticks = range(4)
+
+
+class SampleCache:
+    def __init__(
+            self,
+            max_bytes: int,
+            n_keys: int,
+            input_shape: typing.Tuple[int, ...],
+            target_shape: typing.Tuple[int, ...] = None
+    ):
+        slot_bytes = math.prod(input_shape)
+        if target_shape is not None:
+            slot_bytes += math.prod(target_shape) * np.dtype(np.float16).itemsize
+        self.capacity = min(n_keys, max_bytes // slot_bytes)
+        if self.capacity <= 0:
+            raise Exception("Cache size of {} bytes is too small for a sample of {} bytes".format(max_bytes,
+                                                                                              slot_bytes))
+        self.inputs = torch.zeros((self.capacity,) + tuple(input_shape), dtype=torch.uint8).share_memory_()
+        self.targets = None
+        if target_shape is not None:
+            self.targets = torch.zeros((self.capacity,) + tuple(target_shape), dtype=torch.float16).share_memory_()
+        self.slot_keys = torch.full((self.capacity,), -1, dtype=torch.int64).share_memory_()
+        # last use of each slot, 0 for free slots, so that they are used first
+        self.slot_used = torch.zeros(self.capacity, dtype=torch.int64).share_memory_()
+        self.key_slots = torch.full((n_keys,), -1, dtype=torch.int64).share_memory_()
+        self.counters = torch.zeros(4, dtype=torch.int64).share_memory_()
+        self.lock = multiprocessing.Lock()
+
+    def get(
+            self,
+            key: int
+    ) -> typing.Tuple[numpy.ndarray, numpy.ndarray] | None:
+        counters = self.counters.numpy()
+        with self.lock:
+            slot = self.key_slots.numpy()[key]
+            if slot < 0:
+                counters[misses] += 1
+                return None
+            counters[hits] += 1
+            counters[ticks] += 1
+            self.slot_used.numpy()[slot] = counters[ticks]
+            input_image = self.inputs[slot].numpy().copy()
+            target_image = self.targets[slot].numpy().copy() if self.targets is not None else None
+        return input_image, target_image
+
+    def put(
+            self,
+            key: int,
+            input_image: numpy.ndarray,
+            target_image: numpy.ndarray = None
+    ):
+        counters = self.counters.numpy()
+        key_slots = self.key_slots.numpy()
+        slot_keys = self.slot_keys.numpy()
+        slot_used = self.slot_used.numpy()
+        with self.lock:
+            # another worker may have decoded the same sample in the meantime
+            if key_slots[key] >= 0:
+                return
+            slot = int(np.argmin(slot_used))
+            if slot_keys[slot] >= 0:
+                key_slots[slot_keys[slot]] = -1
+                counters[evictions] += 1
+            self.inputs.numpy()[slot] = input_image
+            if self.targets is not None:
+                self.targets.numpy()[slot] = target_image
+            counters[ticks] += 1
+            slot_used[slot] = counters[ticks]
+            slot_keys[slot] = key
+            key_slots[key] = slot
+
+    def stats(self) -> dict:
+        counters = self.counters.numpy()
+        requests = counters[hits] + counters[misses]
+        return {'hits': int(counters[hits]),
+                'misses': int(counters[misses]),
+                'evictions': int(counters[evictions]),
+                'hit_rate': float(counters[hits] / requests) if requests > 0 else 0.,
+                'entries': int((self.slot_keys.numpy() >= 0).sum()),
+                'capacity': self.capacity}
+
+
+# Sketch as uint8 array of shape (C, H, W), RGB for normal and grayscale for depth or if the sketch is transported
+# compact
+def load_sketch(
+        input_path: str,
+        input_data_type: data_type.Type,
+        compact: bool = False
+) -> numpy.ndarray:
+    mode = 'RGB' if input_data_type == data_type.Type.normal and not compact else 'L'
+    input_image = np.array(Image.open(input_path).convert(mode))
+    if input_image.ndim == 2:
+        return input_image[np.newaxis]
+    return np.moveaxis(input_image, -1, 0)
+
+
+# Decode sketch and target (if given) of a sample or take them from the cache. Targets are float16 if a cache or the
+# compact transport is used, which is lossless since exr files store half values.
+def load_sample(
+        cache: SampleCache | None,
+        key: int,
+        input_data_type: data_type.Type,
+        input_path: str,
+        target_path: str = None,
+        compact: bool = False
+) -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
+    if cache is not None:
+        sample = cache.get(key)
+        if sample is not None:
+            return sample
+    input_image = load_sketch(input_path, input_data_type, compact)
+    target_image = None
+    if target_path is not None:
+        dtype = np.float32 if cache is None and not compact else np.float16
+        target_image = OpenEXR_utils.getImageEXR(target_path, input_data_type, 0, dtype)
+    if cache is not None:
+        cache.put(key, input_image, target_image)
+    return input_image, target_image
+
+
+# Cache sized in MB for samples shaped like the one at input_path and target_path
+def create_cache(
+        cache_size: int,
+        n_keys: int,
+        input_data_type: data_type.Type,
+        input_path: str,
+        target_path: str = None,
+        compact: bool = False
+) -> SampleCache | None:
+    if cache_size <= 0 or n_keys <= 0:
+        return None
+    input_image, target_image = load_sample(None, 0, input_data_type, input_path, target_path, compact)
+    return SampleCache(cache_size * 2 ** 20, n_keys, input_image.shape,
+                       None if target_image is None else target_image.shape)
+
+
+def print_stats(
+        name: str,
+        dataset: Dataset
+):
+    cache = getattr(dataset, 'cache', None)
+    if cache is not None:
+        print("Sample cache {}: {}".format(name, cache.stats()))
@@ -0,0 +1,142 @@
+# Samplers sharding the datasets between the ranks of distributed training
+# The plan of an epoch is computed at once from a seed and the epoch, so all ranks compute the same plan and take
+# disjoint parts of it. The data loader workers receive their indices from these samplers, therefore no two workers or
+# ranks load the same sample of the plan. All ranks get the same # of samples and therefore batches, which keeps the
+# optimizer frequencies (generator and n_critic critic updates), chosen by the batch index, in sync between the ranks.
+# The ShapeNet dataset draws the same number of samples from each class every epoch, all other datasets are permuted.
+import numpy
+import numpy as np
+import torch.distributed as dist
+from torch.utils.data.distributed import DistributedSampler
+
+from source.map_generation_dataset import dataset_ShapeNet
+
+
+# Subclass of DistributedSampler, so that pytorch lightning uses it as is in distributed training instead of wrapping
+# it. Rank and # of replicas are determined when iterating, since the process group does not exist before training.
+class RankSampler(DistributedSampler):
+    def __init__(
+            self,
+            shuffle: bool = True,
+            seed: int = 0,
+            num_replicas: int = None,
+            rank: int = None
+    ):
+        # without shuffle the plan is the same in each epoch, e.g. for validation
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self._num_replicas = num_replicas
+        self._rank = rank
+
+    @property
+    def num_replicas(self) -> int:
+        if self._num_replicas is not None:
+            return self._num_replicas
+        return dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+
+    @property
+    def rank(self) -> int:
+        if self._rank is not None:
+            return self._rank
+        return dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+
+    def set_epoch(
+            self,
+            epoch: int
+    ):
+        self.epoch = epoch
+
+    def rng(
+            self,
+            epoch: int
+    ) -> np.random.Generator:
+        return np.random.default_rng((self.seed, epoch if self.shuffle else 0))
+
+
+class ClassBalancedSampler(RankSampler):
+    def __init__(
+            self,
+            class_starts: list,
+            class_sizes: list,
+            samples_per_class: int,
+            shuffle: bool = True,
+            seed: int = 0,
+            num_replicas: int = None,
+            rank: int = None
+    ):
+        super().__init__(shuffle, seed, num_replicas, rank)
+        # samples are identified by their index in the list of all files ordered by class
+        self.class_starts = [start for start, size in zip(class_starts, class_sizes) if size > 0]
+        self.class_sizes = [size for size in class_sizes if size > 0]
+        if len(self.class_sizes) <= 0:
+            raise Exception("No class contains any samples!")
+        self.samples_per_class = samples_per_class
+
+    # Indices of all ranks in one epoch. Files of a class are drawn from a permutation of the class, so that every
+    # file is drawn at most once per epoch unless the class has less files than samples_per_class.
+    def plan(
+            self,
+            epoch: int
+    ) -> numpy.ndarray:
+        rng = self.rng(epoch)
+        samples = np.arange(self.samples_per_class)
+        plan = np.empty((len(self.class_sizes), self.samples_per_class), dtype=np.int64)
+        for i, (start, size) in enumerate(zip(self.class_starts, self.class_sizes)):
+            plan[i] = start + rng.permutation(size)[samples % size]
+        plan = plan.ravel()
+        return plan[rng.permutation(len(plan))]
+
+    def __iter__(self):
+        num_replicas = self.num_replicas
+        plan = self.plan(self.epoch)
+        # drop the tail instead of padding with duplicates, so all ranks get the same # of samples
+        plan = plan[self.rank:len(plan) - len(plan) % num_replicas:num_replicas]
+        return iter(plan.tolist())
+
+    def __len__(self) -> int:
+        return len(self.class_sizes) * self.samples_per_class // self.num_replicas
+
+
+# Permutation of all samples of a dataset. Without drop_last, the plan is padded with its first samples instead of
+# dropping its tail, so every sample is used, e.g. for test.
+class ShardSampler(RankSampler):
+    def __init__(
+            self,
+            size: int,
+            shuffle: bool = True,
+            seed: int = 0,
+            drop_last: bool = True,
+            num_replicas: int = None,
+            rank: int = None
+    ):
+        super().__init__(shuffle, seed, num_replicas, rank)
+        self.size = size
+        self.drop_last = drop_last
+
+    def __iter__(self):
+        num_replicas = self.num_replicas
+        plan = self.rng(self.epoch).permutation(self.size) if self.shuffle else np.arange(self.size)
+        if self.drop_last:
+            plan = plan[:len(plan) - len(plan) % num_replicas]
+        elif len(plan) % num_replicas > 0:
+            plan = np.concatenate((plan, np.resize(plan, num_replicas - len(plan) % num_replicas)))
+        return iter(plan[self.rank::num_replicas].tolist())
+
+    def __len__(self) -> int:
+        if self.drop_last:
+            return self.size // self.num_replicas
+        return -(-self.size // self.num_replicas)
+
+
+# Class balanced sampler for the random per class sampling of ShapeNet (not full_ds), shard sampler for all other
+# datasets
+def create_sampler(
+        dataset,
+        shuffle: bool = True,
+        seed: int = 0,
+        drop_last: bool = True
+) -> RankSampler:
+    if not isinstance(dataset, dataset_ShapeNet.DS) or dataset.full_ds:
+        return ShardSampler(len(dataset), shuffle, seed, drop_last)
+    return ClassBalancedSampler(dataset.class_starts, dataset.class_sizes, dataset.size, shuffle, seed)
@@ -0,0 +1,60 @@
+# Compact transport of samples from the data loader workers to the model
+# Sketches are sent as uint8 with one channel and targets as float16 instead of float32 with the channels of the model,
+# which reduces the bytes to copy between the workers and to the device. Normalization and broadcasting of the sketch
+# to the channels of the model happen after the batch is transferred to the device.
+import torch
+
+from source.util import data_type
+
+
+def is_compact(
+        sample_batched: dict
+) -> bool:
+    return sample_batched['input'].dtype == torch.uint8
+
+
+def normalize_input(
+        input_tensor: torch.Tensor,
+        channel: int
+) -> torch.Tensor:
+    if input_tensor.size(1) != channel:
+        input_tensor = input_tensor.expand(-1, channel, -1, -1)
+    return input_tensor.float() / 127.5 - 1.
+
+
+def normalize_target(
+        target_tensor: torch.Tensor,
+        target_data_type: data_type.Type
+) -> torch.Tensor:
+    target_tensor = target_tensor.float()
+    if target_data_type.value == data_type.Type.depth.value:
+        target_tensor = target_tensor * 2 - 1
+    return target_tensor
+
+
+# Normalize batch of the compact transport as the datasets do in the default transport
+def normalize_batch(
+        sample_batched: dict,
+        target_data_type: data_type.Type,
+        channel: int
+) -> dict:
+    if not is_compact(sample_batched):
+        return sample_batched
+    sample_batched['input'] = normalize_input(sample_batched['input'], channel)
+    if 'target' in sample_batched:
+        sample_batched['target'] = normalize_target(sample_batched['target'], target_data_type)
+    return sample_batched
+
+
+# Resize batch on the device to the resolution of the model. Sketches are resized via minimum over the source pixels
+# of each target pixel, as sketch_utils.resize_binary does for the sketches of the pipeline, so thin lines are kept.
+# Targets are averaged over the source pixels.
+def resize_batch(
+        sample_batched: dict,
+        dim: int
+) -> dict:
+    if sample_batched['input'].shape[-2:] != (dim, dim):
+        sample_batched['input'] = -torch.nn.functional.adaptive_max_pool2d(-sample_batched['input'], dim)
+    if 'target' in sample_batched and sample_batched['target'].shape[-2:] != (dim, dim):
+        sample_batched['target'] = torch.nn.functional.adaptive_avg_pool2d(sample_batched['target'], dim)
+    return sample_batched
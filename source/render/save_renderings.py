@@ -16,7 +16,8 @@ def save_exr(
         img: numpy.ndarray | torch.Tensor,
         output_dirs: dir,
         output_name: str,
-        given_data_type: data_type = None
+        given_data_type: data_type = None,
+        writer: OpenEXR_utils.BackgroundWriter = None
 ):
     if given_data_type == data_type.Type.depth:
         filename = output_name + '_depth.exr'
@@ -31,7 +32,7 @@ def save_exr(
         filename = output_name + '.exr'
         output_dir = output_dirs['default']
     path = os.path.join(output_dir, filename)
-    OpenEXR_utils.writeImage(img, given_data_type, path)
+    OpenEXR_utils.writeImage(img, given_data_type, path, writer=writer)
 
 
 def save_png(
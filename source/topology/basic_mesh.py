@@ -1,30 +1,98 @@
 # Get basic mesh from given path based on Euler number
 import os
 import json
+import typing
+
+import numpy
+import trimesh
+
+json_filename = 'basic_meshes.json'
+
+
+# Index of the genus templates in a genus dir. The directory is walked once, the json matching genera to filenames is
+# only parsed again if its modification time changes and loaded template meshes are kept in memory. Share one
+# registry when determining the base meshes of multiple sketches.
+class BasicMeshRegistry:
+    def __init__(
+            self,
+            genus_dir: str
+    ):
+        if not os.path.exists(genus_dir):
+            raise Exception("Given genus dir path {} does not exits.".format(genus_dir))
+        self.genus_dir = genus_dir
+        self.json_path = self.find_json(genus_dir)
+        self._mtime = None
+        self._paths = {}
+        self._missing_paths = {}
+        self._meshes = {}
+        self.refresh()
+
+    @staticmethod
+    def find_json(
+            genus_dir: str
+    ) -> str:
+        for root, dirs, files in os.walk(genus_dir):
+            if json_filename in files:
+                return os.path.join(root, json_filename)
+        raise Exception("Json file {} matching genera to filenames does not exist in {}!".format(json_filename,
+                                                                                                 genus_dir))
+
+    def refresh(self):
+        mtime = os.stat(self.json_path).st_mtime_ns
+        if mtime == self._mtime:
+            return
+        with open(self.json_path, 'r') as f:
+            shapes = json.load(f)['shapes']
+        root = os.path.dirname(self.json_path)
+        self._paths = {}
+        self._missing_paths = {}
+        for genus, filename in shapes.items():
+            path = os.path.join(root, filename)
+            if os.path.exists(path):
+                self._paths[int(genus)] = path
+            else:
+                self._missing_paths[int(genus)] = path
+        self._meshes = {}
+        self._mtime = mtime
+
+    @property
+    def genera(self) -> list:
+        return sorted(self._paths)
+
+    def get_path(
+            self,
+            number_holes: int
+    ) -> str:
+        self.refresh()
+        try:
+            return self._paths[number_holes]
+        except KeyError:
+            if number_holes in self._missing_paths:
+                raise Exception("No base mesh exists in {} for given genus {}".format(
+                    self._missing_paths[number_holes], number_holes))
+            raise RuntimeError("No base mesh exists for given genus {}".format(number_holes))
+
+    # Vertices and faces of the template mesh for the given genus
+    def get_mesh(
+            self,
+            number_holes: int
+    ) -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
+        path = self.get_path(number_holes)
+        if number_holes not in self._meshes:
+            mesh = trimesh.load(path, force='mesh', process=False)
+            self._meshes[number_holes] = (numpy.asarray(mesh.vertices), numpy.asarray(mesh.faces))
+        return self._meshes[number_holes]
+
+    def load_meshes(self):
+        for genus in self.genera:
+            self.get_mesh(genus)
 
 
 def get_basic_mesh_path(
         number_holes: int,
-        path: str = ''
+        path: str = '',
+        registry: BasicMeshRegistry = None
 ) -> str:
-    if not os.path.exists(path):
-        raise Exception("Given genus dir path {} does not exits.".format(path))
-
-    for root, dirs, files in os.walk(path):
-        for file in files:
-            if file == 'basic_meshes.json':
-                f = open(os.path.join(root, file), 'r')
-                f_json = json.load(f)
-                shapes = f_json['shapes']
-                try:
-                    f_basic_mesh = shapes[str(number_holes)]
-                except Exception:
-                    raise RuntimeError("No base mesh exists for given genus {}".format(number_holes))
-                path = os.path.join(root, f_basic_mesh)
-                if not os.path.exists(path):
-                    raise Exception("No base mesh exists in {} for given genus {}".format(path, number_holes))
-                return path
-    raise Exception(
-        "No base mesh exists for given genus {} or json file basic_meshes.json matching genera to filenames does not "
-        "exist! ".format(
-            number_holes))
+    if registry is None:
+        registry = BasicMeshRegistry(path)
+    return registry.get_path(number_holes)
@@ -0,0 +1,77 @@
+# Benchmark of the flood fill backends on synthetic sketches of different resolutions
+import argparse
+import sys
+import time
+import typing
+
+import numpy
+import numpy as np
+
+from source.topology import floodfill
+
+
+# Create padded synthetic sketch: outline of a disk with a hole (genus 1) and one grey seed pixel inside the object
+def create_sketch(
+        dim: int
+) -> numpy.ndarray:
+    y, x = np.mgrid[0:dim, 0:dim]
+    dist = np.sqrt((x - dim / 2) ** 2 + (y - dim / 2) ** 2)
+    line_width = max(1, dim // 128)
+    outer = np.abs(dist - dim * 0.4) < line_width
+    inner = np.abs(dist - dim * 0.15) < line_width
+    image = np.full((dim, dim), 255, dtype=np.uint8)
+    image[outer | inner] = 0
+    image[dim // 2, int(dim * 0.775)] = 128
+    return np.pad(image, 1, mode='constant', constant_values=255)
+
+
+def time_fill(
+        image: numpy.ndarray,
+        fill_method: str,
+        repetitions: int
+) -> typing.Tuple[float, numpy.ndarray]:
+    durations = []
+    filled = None
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        filled = floodfill.fill_image(image, fill_method)
+        durations.append(time.perf_counter() - start)
+    return min(durations), filled
+
+
+def run(
+        dims: typing.Sequence[int],
+        repetitions: int,
+        max_dim_bfs: int
+):
+    print("{:>6} | {:>12} | {:>12} | {:>8} | {}".format('dim', 'label [s]', 'bfs [s]', 'speedup', 'identical'))
+    for dim in dims:
+        image = create_sketch(dim)
+        time_label, filled_label = time_fill(image, 'label', repetitions)
+        if dim <= max_dim_bfs:
+            time_bfs, filled_bfs = time_fill(image, 'bfs', 1)
+            identical = filled_bfs.tobytes() == filled_label.tobytes()
+            print("{:>6} | {:>12.4f} | {:>12.4f} | {:>8.1f} | {}".format(dim, time_label, time_bfs,
+                                                                         time_bfs / time_label, identical))
+        else:
+            print("{:>6} | {:>12.4f} | {:>12} | {:>8} | {}".format(dim, time_label, '-', '-', '-'))
+
+
+def diff_args(args):
+    run(args.dims, args.repetitions, args.max_dim_bfs)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog="topology_benchmark")
+    parser.add_argument("--dims", type=int, nargs='+', default=[256, 512, 1024, 2048, 4096],
+                        help="Resolutions of the synthetic sketches")
+    parser.add_argument("--repetitions", type=int, default=5,
+                        help="# of repetitions per resolution, the fastest run is reported")
+    parser.add_argument("--max_dim_bfs", type=int, default=1024,
+                        help="Largest resolution the original bfs fill is timed for, since it takes minutes above")
+    args = parser.parse_args(args)
+    diff_args(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
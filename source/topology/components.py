@@ -0,0 +1,87 @@
+# Split sketches with multiple objects into components with their own silhouette and genus
+# Objects may be drawn in different colors (classes). White is background, grey pixels (R = G = B) are seeds for the
+# floodfill and every other color is a line. The whole sketch is filled once and all objects are labelled in one pass.
+import os
+import typing
+
+import numpy
+import numpy as np
+from pathlib import Path
+from scipy import ndimage
+
+from source.topology import euler
+from source.topology import floodfill
+from source.util import OpenEXR_utils
+from source.util import data_type
+from source.util import sketch_utils
+
+seed_value = 128
+
+
+# Decode padded RGB sketch into a grayscale sketch for the floodfill and color ids of all pixels
+def decode_colors(
+        image: numpy.ndarray
+) -> typing.Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    packed = (image[..., 0].astype(np.uint32) << 16) | (image[..., 1].astype(np.uint32) << 8) | image[..., 2]
+    colors, color_ids = np.unique(packed, return_inverse=True)
+    color_ids = color_ids.reshape(packed.shape)
+    colors_rgb = np.stack(((colors >> 16) & 255, (colors >> 8) & 255, colors & 255), axis=1).astype(np.uint8)
+
+    white = np.all(colors_rgb == sketch_utils.background, axis=1)
+    grey = (colors_rgb[:, 0] == colors_rgb[:, 1]) & (colors_rgb[:, 1] == colors_rgb[:, 2]) & ~white & \
+           (colors_rgb[:, 0] != sketch_utils.bounds)
+    gray_values = np.full(len(colors), sketch_utils.bounds, dtype=np.uint8)
+    gray_values[white] = sketch_utils.background
+    gray_values[grey] = seed_value
+    return gray_values[color_ids], color_ids, colors_rgb
+
+
+# Split padded RGB sketch into its 8-connected filled objects. For every object the unpadded silhouette (0 object,
+# 1 background, same as floodfill.startFill), the bounding box, the color of most of its lines and its genus is
+# returned.
+def split_components(
+        image: numpy.ndarray,
+        fill_method: str = 'label'
+) -> list:
+    gray, color_ids, colors = decode_colors(image)
+    filled = sketch_utils.unpad(floodfill.fill_image(gray, fill_method), 1)
+    color_ids = sketch_utils.unpad(color_ids, 1)
+    lines = sketch_utils.unpad(gray, 1) == sketch_utils.bounds
+
+    objects = filled == floodfill.fill
+    component_labels, n_components = ndimage.label(objects, structure=floodfill.connectivity)
+    if n_components == 0:
+        return []
+
+    # color class of each component is the most common color of its lines
+    color_counts = np.bincount(component_labels[lines] * len(colors) + color_ids[lines],
+                               minlength=(n_components + 1) * len(colors)).reshape(n_components + 1, len(colors))
+    component_colors = colors[np.argmax(color_counts[1:], axis=1)]
+    has_lines = color_counts[1:].sum(axis=1) > 0
+
+    matches_Q1, matches_Q3, matches_QD = euler.compute_matches_Q_labelled(filled, component_labels, n_components)
+    genera = euler.compute_number_holes(matches_Q1, matches_Q3, matches_QD)
+
+    components = []
+    for i, component_slice in enumerate(ndimage.find_objects(component_labels)):
+        silhouette = np.where(component_labels == i + 1, floodfill.fill, floodfill.background).astype(filled.dtype)
+        components.append({'silhouette': silhouette,
+                           'bounding_box': component_slice,
+                           'color': tuple(int(c) for c in component_colors[i]) if has_lines[i] else None,
+                           'genus': int(genera[i])})
+    return components
+
+
+# Write silhouette of every component as exr, named after the sketch and the index of the component
+def save_components(
+        components: list,
+        image_path: str,
+        output_dir: str
+) -> list:
+    filename = Path(image_path)
+    exr_paths = []
+    for i, component in enumerate(components):
+        exr_path = os.path.join(output_dir, '{}_{}_filled.exr'.format(filename.stem, i))
+        OpenEXR_utils.writeImage(component['silhouette'], data_type.Type.silhouette, exr_path)
+        exr_paths.append(exr_path)
+    return exr_paths
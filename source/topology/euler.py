@@ -2,38 +2,83 @@
 import typing
 import numpy
 
+# Bit quads are encoded as 4 bit codes: top left * 8 + top right * 4 + bottom left * 2 + bottom right
+# Q1: exactly one pixel set, Q3: exactly three pixels set, QD: two diagonal pixels set
+quads_Q1 = numpy.zeros(16, dtype=bool)
+quads_Q1[[1, 2, 4, 8]] = True
+quads_Q3 = numpy.zeros(16, dtype=bool)
+quads_Q3[[7, 11, 13, 14]] = True
+quads_QD = numpy.zeros(16, dtype=bool)
+quads_QD[[6, 9]] = True
+
 
 def get_number_holes(
         image: numpy.ndarray
 ) -> int:
     matches_Q1, matches_Q3, matches_QD = compute_matches_Q(image)
+    return compute_number_holes(matches_Q1, matches_Q3, matches_QD)
+
+
+# Genera of a stack of filled silhouettes with shape (N, H, W)
+def get_number_holes_batch(
+        images: numpy.ndarray
+) -> numpy.ndarray:
+    matches_Q1, matches_Q3, matches_QD = compute_matches_Q_batch(images)
+    return compute_number_holes(matches_Q1, matches_Q3, matches_QD)
+
+
+def compute_number_holes(
+        matches_Q1: int | numpy.ndarray,
+        matches_Q3: int | numpy.ndarray,
+        matches_QD: int | numpy.ndarray
+) -> int | numpy.ndarray:
     # invert Q3 and Q1 since in this case black is object instead of white
     euler = matches_Q3 - matches_Q1 - 2 * matches_QD
     # C is always 1 since we assume only 1 object in the sketch
-    return 1 - int(euler / 4)
+    if numpy.isscalar(euler):
+        return 1 - int(euler / 4)
+    return 1 - (euler / 4).astype(int)
 
 
 def compute_matches_Q(
         image: numpy.ndarray
 ) -> typing.Tuple[int, int, int]:
-    shape_x, shape_y = image.shape
-    Q1, Q3, QD = 0, 0, 0
-    for x in range(shape_x - 1):
-        for y in range(shape_y - 1):
-            current_pixel = image[x][y]
-            neighbors = [(x + 1, y), (x, y + 1), (x + 1, y + 1)]
-            neighbor_sum = 0
-            for i in neighbors:
-                neighbor_sum += image[i[0], i[1]]
-            q_sum = neighbor_sum + current_pixel
-
-            if q_sum == 1:
-                Q1 += 1
-            elif q_sum == 3:
-                Q3 += 1
-            elif q_sum == 2:
-                if current_pixel == 1 and image[neighbors[2][0], neighbors[2][1]] == 1:
-                    QD += 1
-                if current_pixel == 0 and image[neighbors[2][0], neighbors[2][1]] == 0:
-                    QD += 1
-    return Q1, Q3, QD
+    matches_Q1, matches_Q3, matches_QD = compute_matches_Q_batch(image[numpy.newaxis])
+    return int(matches_Q1[0]), int(matches_Q3[0]), int(matches_QD[0])
+
+
+# Count bit quads of all 2x2 windows for a stack of binary images in one bincount
+def compute_matches_Q_batch(
+        images: numpy.ndarray
+) -> typing.Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    if images.ndim != 3:
+        raise Exception("Images need to be given as stack of shape (N, H, W), not {}".format(images.shape))
+    n_images = images.shape[0]
+    codes = quad_codes(images)
+    # offset codes per image, so all images can be counted at once
+    offsets = (numpy.arange(n_images, dtype=numpy.intp) * 16).reshape(-1, 1, 1)
+    counts = numpy.bincount((codes + offsets).ravel(), minlength=16 * n_images).reshape(n_images, 16)
+    return counts[:, quads_Q1].sum(1), counts[:, quads_Q3].sum(1), counts[:, quads_QD].sum(1)
+
+
+# Count bit quads separately for each 8-connected object (value 0) of one image given its component labels. Since all
+# object pixels within a 2x2 window are 8-connected, every window belongs to at most one component.
+def compute_matches_Q_labelled(
+        image: numpy.ndarray,
+        labels: numpy.ndarray,
+        n_labels: int
+) -> typing.Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    codes = quad_codes(image[numpy.newaxis])[0]
+    window_labels = numpy.maximum(numpy.maximum(labels[:-1, :-1], labels[:-1, 1:]),
+                                  numpy.maximum(labels[1:, :-1], labels[1:, 1:])).astype(numpy.intp)
+    counts = numpy.bincount((window_labels * 16 + codes).ravel(), minlength=16 * (n_labels + 1))
+    counts = counts.reshape(n_labels + 1, 16)[1:]
+    return counts[:, quads_Q1].sum(1), counts[:, quads_Q3].sum(1), counts[:, quads_QD].sum(1)
+
+
+# 4 bit codes of all 2x2 windows of a stack of binary images
+def quad_codes(
+        images: numpy.ndarray
+) -> numpy.ndarray:
+    binary = (images != 0).astype(numpy.uint8)
+    return (binary[:, :-1, :-1] << 3) | (binary[:, :-1, 1:] << 2) | (binary[:, 1:, :-1] << 1) | binary[:, 1:, 1:]
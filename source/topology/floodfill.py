@@ -6,6 +6,7 @@ import numpy
 from PIL import Image
 from collections import deque
 from pathlib import Path
+from scipy import ndimage
 
 from source.util import OpenEXR_utils
 from source.util import data_type
@@ -14,23 +15,38 @@ from source.util import sketch_utils
 background = 1
 bounds = 0
 fill = 0
+# Available fill backends: 'label' uses connected-component labelling on the whole array, 'bfs' is the original
+# per-pixel stack-based fill. Both create identical silhouettes.
+fill_methods = ('label', 'bfs')
+# 8-connectivity, same neighbourhood as used in flood_fill_BFS
+connectivity = numpy.ones((3, 3), dtype=bool)
 
 
 def startFill(
         image: numpy.ndarray,
         image_path: str,
         output_dir: str,
-        write_debug_png: bool = True
+        write_debug_png: bool = True,
+        fill_method: str = 'label',
+        writer: OpenEXR_utils.BackgroundWriter = None
 ) -> typing.Tuple[numpy.ndarray, str]:
-    image = image / 255
-    start_points = find_start_points(image)
-    for i in start_points:
-        flood_fill_BFS(image, i)
-
+    image = fill_image(image, fill_method)
     image = sketch_utils.unpad(image, 1)
+    exr_path = save_filled_image(image, image_path, output_dir, write_debug_png, writer)
+    return image, exr_path
+
+
+# Write unpadded filled image as exr and optionally as png for debugging
+def save_filled_image(
+        image: numpy.ndarray,
+        image_path: str,
+        output_dir: str,
+        write_debug_png: bool = True,
+        writer: OpenEXR_utils.BackgroundWriter = None
+) -> str:
     filename = Path(image_path)
     exr_path = os.path.join(output_dir, filename.stem + '_filled.exr')
-    OpenEXR_utils.writeImage(image, data_type.Type.silhouette, exr_path)
+    OpenEXR_utils.writeImage(image, data_type.Type.silhouette, exr_path, writer=writer)
 
     if write_debug_png:
         image_png = image * 255
@@ -38,7 +54,44 @@ def startFill(
         png_path = os.path.join(output_dir, filename.stem + '_filled.png')
         filled_image.save(png_path)
 
-    return image, exr_path
+    return exr_path
+
+
+# Fill padded sketch (values 0-255) and return the still padded result scaled to 0-1
+def fill_image(
+        image: numpy.ndarray,
+        fill_method: str = 'label'
+) -> numpy.ndarray:
+    image = image / 255
+    if fill_method == 'label':
+        flood_fill_label(image)
+    elif fill_method == 'bfs':
+        start_points = find_start_points(image)
+        for i in start_points:
+            flood_fill_BFS(image, i)
+    else:
+        raise Exception("Given fill method {} is none of {}".format(fill_method, fill_methods))
+    return image
+
+
+# Vectorized equivalent of running flood_fill_BFS from every seed given by find_start_points:
+# Every 8-connected background region, which touches a seed, is filled. Same as in the BFS the outermost pixel ring
+# is never filled and does not connect regions.
+def flood_fill_label(
+        image: numpy.ndarray
+):
+    seeds = numpy.zeros(image.shape, dtype=bool)
+    seeds[1:-1, 1:-1] = (image[1:-1, 1:-1] != background) & (image[1:-1, 1:-1] != bounds)
+    if not seeds.any():
+        return
+    regions = numpy.zeros(image.shape, dtype=bool)
+    regions[1:-1, 1:-1] = image[1:-1, 1:-1] == background
+    labels, n_labels = ndimage.label(regions, structure=connectivity)
+    touched = ndimage.binary_dilation(seeds, structure=connectivity) & regions
+    fill_labels = numpy.zeros(n_labels + 1, dtype=bool)
+    fill_labels[labels[touched]] = True
+    fill_labels[0] = False
+    image[fill_labels[labels] | seeds] = fill
 
 
 def flood_fill_BFS(
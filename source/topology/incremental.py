@@ -0,0 +1,173 @@
+# Incremental floodfill and genus determination for interactive sketching
+# Instead of filling the whole canvas after every stroke, only the background regions next to the stroke are labelled
+# again. The result is always identical to floodfill.fill_image and euler.get_number_holes on the whole canvas.
+import typing
+
+import numpy
+import numpy as np
+from scipy import ndimage
+
+from source.topology import euler
+from source.topology import floodfill
+from source.util import sketch_utils
+
+
+class TopologySession:
+    def __init__(
+            self,
+            image: numpy.ndarray,
+            border: int = 1
+    ):
+        # border around the changed pixels of a stroke, which is labelled again. 1 suffices for exact results,
+        # since regions further away are only labelled again if they are affected by the stroke.
+        self.border = max(1, border)
+        self.canvas = np.pad(np.asarray(image, dtype=np.uint8), 1, mode='constant',
+                             constant_values=sketch_utils.background)
+        self.labels = None
+        self.filled_labels = None
+        self.label_slices = None
+        self.filled = None
+        self.counts = None
+        self.recompute()
+
+    @classmethod
+    def empty(
+            cls,
+            dim: int,
+            border: int = 1
+    ) -> 'TopologySession':
+        return cls(np.full((dim, dim), sketch_utils.background, dtype=np.uint8), border)
+
+    @property
+    def filled_image(self) -> numpy.ndarray:
+        return sketch_utils.unpad(self.filled, 1)
+
+    @property
+    def genus(self) -> int:
+        return euler.compute_number_holes(*self.counts)
+
+    # Regions are background pixels except the outermost pixel ring, seeds are pixels neither line nor background
+    def regions_seeds(
+            self,
+            canvas: numpy.ndarray,
+            interior: typing.Tuple[slice, slice]
+    ) -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
+        regions = np.zeros(canvas.shape, dtype=bool)
+        seeds = np.zeros(canvas.shape, dtype=bool)
+        regions[interior] = canvas[interior] == sketch_utils.background
+        seeds[interior] = (canvas[interior] != sketch_utils.background) & (canvas[interior] != sketch_utils.bounds)
+        return regions, seeds
+
+    # Fill the whole canvas
+    def recompute(self):
+        regions, seeds = self.regions_seeds(self.canvas, (slice(1, -1), slice(1, -1)))
+        self.labels, n_labels = ndimage.label(regions, structure=floodfill.connectivity)
+        touched = ndimage.binary_dilation(seeds, structure=floodfill.connectivity) & regions
+        self.filled_labels = np.zeros(n_labels + 1, dtype=bool)
+        self.filled_labels[self.labels[touched]] = True
+        self.filled_labels[0] = False
+        self.label_slices = [None] + ndimage.find_objects(self.labels)
+        self.filled = self.fill_values(self.canvas, self.labels)
+        self.counts = np.array(euler.compute_matches_Q(self.filled_image))
+
+    def fill_values(
+            self,
+            canvas: numpy.ndarray,
+            labels: numpy.ndarray
+    ) -> numpy.ndarray:
+        unfilled = (canvas == sketch_utils.background) & ~self.filled_labels[labels]
+        return unfilled.astype(np.float64) * floodfill.background
+
+    # Draw stroke given as patch with its top left corner at (row, col) of the canvas. Only pixels, which are not
+    # background in the patch, are drawn (lines: 0, seeds: grey values). Returns the genus after the stroke.
+    def add_stroke(
+            self,
+            patch: numpy.ndarray,
+            row: int,
+            col: int
+    ) -> int:
+        shape_x, shape_y = self.canvas.shape
+        # canvas is padded by 1 and strokes are not drawn on the outermost pixel ring
+        r0, c0 = max(row + 1, 1), max(col + 1, 1)
+        r1, c1 = min(row + 1 + patch.shape[0], shape_x - 1), min(col + 1 + patch.shape[1], shape_y - 1)
+        if r0 >= r1 or c0 >= c1:
+            return self.genus
+        patch = patch[r0 - row - 1:r1 - row - 1, c0 - col - 1:c1 - col - 1]
+        window = (slice(r0, r1), slice(c0, c1))
+        drawn = patch != sketch_utils.background
+        changed = drawn & (self.canvas[window] != patch)
+        if not changed.any():
+            return self.genus
+        rows, cols = np.nonzero(changed)
+        added_seeds = changed & (patch != sketch_utils.bounds)
+        self.canvas[window][drawn] = patch[drawn]
+        self.labels[window][changed] = 0
+
+        # dirty rectangle of the changed pixels plus border
+        d_r0, d_r1 = max(r0 + rows.min() - self.border, 0), min(r0 + rows.max() + 1 + self.border, shape_x)
+        d_c0, d_c1 = max(c0 + cols.min() - self.border, 0), min(c0 + cols.max() + 1 + self.border, shape_y)
+        dirty = (slice(d_r0, d_r1), slice(d_c0, d_c1))
+
+        # Regions next to the stroke need to be labelled again, if they were filled (the stroke may cut them off
+        # their seed) or if they touch a new seed. Unfilled regions only cut by the stroke stay unfilled.
+        affected = np.unique(self.labels[dirty])
+        relabel = affected[self.filled_labels[affected]]
+        if added_seeds.any():
+            seeds_dirty = np.zeros((d_r1 - d_r0, d_c1 - d_c0), dtype=bool)
+            seed_rows, seed_cols = np.nonzero(added_seeds)
+            seeds_dirty[seed_rows + r0 - d_r0, seed_cols + c0 - d_c0] = True
+            near_seeds = ndimage.binary_dilation(seeds_dirty, structure=floodfill.connectivity)
+            relabel = np.union1d(relabel, np.unique(self.labels[dirty][near_seeds]))
+        relabel = relabel[relabel > 0]
+
+        # Labelled pixels of a region never leave its bounding box, since strokes only remove background pixels
+        u_r0, u_r1, u_c0, u_c1 = d_r0, d_r1, d_c0, d_c1
+        for label in relabel:
+            label_slice = self.label_slices[label]
+            if label_slice is not None:
+                u_r0, u_r1 = min(u_r0, label_slice[0].start), max(u_r1, label_slice[0].stop)
+                u_c0, u_c1 = min(u_c0, label_slice[1].start), max(u_c1, label_slice[1].stop)
+        # extend by 1 to include all seeds next to the relabelled regions
+        u_r0, u_r1, u_c0, u_c1 = max(u_r0 - 1, 0), min(u_r1 + 1, shape_x), max(u_c0 - 1, 0), min(u_c1 + 1, shape_y)
+        update = (slice(u_r0, u_r1), slice(u_c0, u_c1))
+        self.relabel(update, relabel)
+
+        # Euler number: replace quad counts of all 2x2 windows touching the updated area
+        e_r0, e_r1, e_c0, e_c1 = max(u_r0 - 1, 1), min(u_r1 + 1, shape_x - 1), max(u_c0 - 1, 1), \
+            min(u_c1 + 1, shape_y - 1)
+        euler_window = (slice(e_r0, e_r1), slice(e_c0, e_c1))
+        counts_old = np.array(euler.compute_matches_Q(self.filled[euler_window]))
+        self.filled[update] = self.fill_values(self.canvas[update], self.labels[update])
+        counts_new = np.array(euler.compute_matches_Q(self.filled[euler_window]))
+        self.counts += counts_new - counts_old
+        return self.genus
+
+    def relabel(
+            self,
+            update: typing.Tuple[slice, slice],
+            relabel: numpy.ndarray
+    ):
+        labels = self.labels[update]
+        canvas = self.canvas[update]
+        mask = np.isin(labels, relabel)
+        regions = mask & (canvas == sketch_utils.background)
+        labels[mask] = 0
+        for label in relabel:
+            self.label_slices[label] = None
+        if not regions.any():
+            return
+
+        _, seeds = self.regions_seeds(canvas, (slice(None), slice(None)))
+        local_labels, n_labels = ndimage.label(regions, structure=floodfill.connectivity)
+        touched = ndimage.binary_dilation(seeds, structure=floodfill.connectivity) & regions
+        local_filled = np.zeros(n_labels + 1, dtype=bool)
+        local_filled[local_labels[touched]] = True
+
+        offset = len(self.filled_labels) - 1
+        labels[regions] = local_labels[regions] + offset
+        self.filled_labels = np.concatenate((self.filled_labels, local_filled[1:]))
+        for local_slice in ndimage.find_objects(local_labels):
+            self.label_slices.append((slice(local_slice[0].start + update[0].start,
+                                            local_slice[0].stop + update[0].start),
+                                      slice(local_slice[1].start + update[1].start,
+                                            local_slice[1].stop + update[1].start)))
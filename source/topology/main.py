@@ -1,40 +1,223 @@
 import argparse
+import collections
+import concurrent.futures
+import glob
+import json
 import os
 import sys
+import time
 
 import floodfill
 import euler
 import basic_mesh
+import components
 
 import source.util.sketch_utils as sketch_utils
 from source.util import dir_utils
+from source.util import parse
+
+# Registry of the genus templates shared by all sketches processed in one worker process
+worker_registry = None
 
 
 def run(
         image_path: str,
         genus_dir: str,
-        output_dir: str
+        output_dir: str,
+        fill_method: str = 'label',
+        registry: basic_mesh.BasicMeshRegistry = None,
+        dim: int = 0
 ):
     if not os.path.exists(output_dir):
         dir_utils.create_general_folder(output_dir)
-    image = sketch_utils.load_image(image_path, True)
-    filled_image, _ = floodfill.startFill(image, image_path, output_dir, True)
+    image = sketch_utils.load_image(image_path, True, dim)
+    filled_image, _ = floodfill.startFill(image, image_path, output_dir, True, fill_method)
+    holes = euler.get_number_holes(filled_image)
+    basic_mesh_path = basic_mesh.get_basic_mesh_path(holes, genus_dir, registry)
+
+
+# Split sketch with multiple (colored) objects and determine base mesh for each object
+def run_components(
+        image_path: str,
+        genus_dir: str,
+        output_dir: str,
+        fill_method: str = 'label',
+        registry: basic_mesh.BasicMeshRegistry = None
+) -> list:
+    if not os.path.exists(output_dir):
+        dir_utils.create_general_folder(output_dir)
+    if registry is None:
+        registry = basic_mesh.BasicMeshRegistry(genus_dir)
+    image = sketch_utils.load_color_image(image_path, True)
+    sketch_components = components.split_components(image, fill_method)
+    exr_paths = components.save_components(sketch_components, image_path, output_dir)
+    results = []
+    for component, exr_path in zip(sketch_components, exr_paths):
+        results.append({'image_path': image_path,
+                        'color': component['color'],
+                        'bounding_box': [component['bounding_box'][0].start, component['bounding_box'][1].start,
+                                         component['bounding_box'][0].stop, component['bounding_box'][1].stop],
+                        'genus': component['genus'],
+                        'template_path': registry.get_path(component['genus']),
+                        'silhouette_path': exr_path})
+    return results
+
+
+# Determine topology of one sketch and return the result incl. the duration of each step in seconds
+def process_sketch(
+        image_path: str,
+        output_dir: str,
+        registry: basic_mesh.BasicMeshRegistry,
+        fill_method: str = 'label',
+        write_debug_png: bool = False,
+        dim: int = 0
+) -> dict:
+    timings = {}
+    start = time.perf_counter()
+    image = sketch_utils.load_image(image_path, True, dim)
+    timings['load'] = time.perf_counter() - start
+
+    step = time.perf_counter()
+    filled_image = sketch_utils.unpad(floodfill.fill_image(image, fill_method), 1)
+    timings['fill'] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    exr_path = floodfill.save_filled_image(filled_image, image_path, output_dir, write_debug_png)
+    timings['write'] = time.perf_counter() - step
+
+    step = time.perf_counter()
     holes = euler.get_number_holes(filled_image)
-    basic_mesh_path = basic_mesh.get_basic_mesh_path(holes, genus_dir)
+    timings['euler'] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    basic_mesh_path = registry.get_path(holes)
+    timings['basic_mesh'] = time.perf_counter() - step
+    timings['total'] = time.perf_counter() - start
+
+    return {'image_path': image_path,
+            'genus': holes,
+            'template_path': basic_mesh_path,
+            'silhouette_path': exr_path,
+            'timings': timings}
+
+
+def init_worker(
+        genus_dir: str
+):
+    global worker_registry
+    worker_registry = basic_mesh.BasicMeshRegistry(genus_dir)
+
+
+# Errors are reported per sketch, so a single broken sketch does not abort the whole batch
+def process_sketch_worker(
+        image_path: str,
+        output_dir: str,
+        fill_method: str,
+        write_debug_png: bool,
+        dim: int
+) -> dict:
+    try:
+        return process_sketch(image_path, output_dir, worker_registry, fill_method, write_debug_png, dim)
+    except Exception as e:
+        return {'image_path': image_path, 'error': str(e)}
+
+
+# Sketches (png or strokes) of a directory (non-recursive) or a glob pattern in sorted order
+def collect_image_paths(
+        image_input: str
+) -> list:
+    if os.path.isdir(image_input):
+        suffixes = ('.png',) + sketch_utils.stroke_suffixes
+        return sorted(path for path in glob.glob(os.path.join(image_input, '*'))
+                      if os.path.isfile(path) and os.path.splitext(path)[1].lower() in suffixes)
+    return sorted(path for path in glob.glob(image_input) if os.path.isfile(path))
+
+
+# Process sketches in a process pool with at most max_in_flight submitted sketches and stream one json line per
+# sketch in the order of the sorted input paths
+def run_batch(
+        image_input: str,
+        genus_dir: str,
+        output_dir: str,
+        output_file: str = '',
+        fill_method: str = 'label',
+        write_debug_png: bool = False,
+        workers: int = 0,
+        max_in_flight: int = 0,
+        dim: int = 0
+):
+    image_paths = collect_image_paths(image_input)
+    if len(image_paths) <= 0:
+        raise Exception("No sketches found for {}".format(image_input))
+    if not os.path.exists(output_dir):
+        dir_utils.create_general_folder(output_dir)
+    workers = workers if workers > 0 else os.cpu_count()
+    max_in_flight = max_in_flight if max_in_flight > 0 else 4 * workers
+
+    output = open(output_file, 'w') if len(output_file) > 0 else sys.stdout
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                                    initargs=(genus_dir,)) as executor:
+            in_flight = collections.deque()
+            remaining = iter(image_paths)
+            for image_path in remaining:
+                in_flight.append(executor.submit(process_sketch_worker, image_path, output_dir, fill_method,
+                                                 write_debug_png, dim))
+                if len(in_flight) >= max_in_flight:
+                    break
+            while len(in_flight) > 0:
+                result = in_flight.popleft().result()
+                next_path = next(remaining, None)
+                if next_path is not None:
+                    in_flight.append(executor.submit(process_sketch_worker, next_path, output_dir, fill_method,
+                                                     write_debug_png, dim))
+                output.write(json.dumps(result) + '\n')
+                output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
 
 
 def diff_ars(args):
-    run(args.image_path, args.genus_dir, args.output_dir)
+    if os.path.isfile(args.image_path) and args.split_components:
+        for result in run_components(args.image_path, args.genus_dir, args.output_dir, args.fill_method):
+            print(json.dumps(result))
+    elif os.path.isfile(args.image_path):
+        run(args.image_path, args.genus_dir, args.output_dir, args.fill_method, dim=args.dim)
+    else:
+        run_batch(args.image_path, args.genus_dir, args.output_dir, args.output_file, args.fill_method,
+                  args.write_debug_png, args.workers, args.max_in_flight, args.dim)
 
 
 def main(args):
     parser = argparse.ArgumentParser(prog="topology_determination")
     parser.add_argument("--image_path", type=str, default="datasets/test.png",
-                        help="Use image path to the image the tology should be determined from.")
+                        help="Use image path to the image the tology should be determined from. If a directory or "
+                             "glob pattern (e.g. \"sketches/*.png\") is given, all matching sketches are processed.")
     parser.add_argument("--genus_dir", type=str, default="datasets/topology_meshes",
                         help="Path to the directory where the genus templates are stored.")
     parser.add_argument("--output_dir", type=str, default="filled",
                         help="Path to the directory where the resulting exr and possible png sould be stored.")
+    parser.add_argument("--fill_method", type=str, default="label", choices=floodfill.fill_methods,
+                        help="Flood fill backend; \"label\" uses connected-component labelling, \"bfs\" the "
+                             "per-pixel fill. Both create identical silhouettes.")
+    parser.add_argument("--dim", type=int, default=0,
+                        help="Resolution sketches given as strokes (.json or .npz) are rasterized to, canvas size of "
+                             "the strokes if not given")
+    parser.add_argument("--split_components", type=parse.p_bool, default="False", dest="split_components",
+                        help="Split sketch of a single image into its objects, which may be drawn in different "
+                             "colors, and determine the base mesh of each object; use \"True\" or \"False\" as "
+                             "parameter")
+    # Only used for directories or glob patterns
+    parser.add_argument("--output_file", type=str, default="",
+                        help="File the json lines with the results per sketch are written to, stdout if not given.")
+    parser.add_argument("--write_debug_png", type=parse.p_bool, default="False", dest="write_debug_png",
+                        help="Save png of filled image in addition to exr; use \"True\" or \"False\" as parameter")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="# of worker processes, all cpus if not given")
+    parser.add_argument("--max_in_flight", type=int, default=0,
+                        help="Maximum # of sketches submitted to the workers at once, 4 times the workers if not "
+                             "given")
     args = parser.parse_args(args)
     diff_ars(args)
 
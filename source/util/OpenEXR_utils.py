@@ -1,4 +1,8 @@
 # Utils to work with OpenEXR files
+import concurrent.futures
+import threading
+import typing
+
 import OpenEXR
 import Imath
 import numpy
@@ -21,33 +25,108 @@ def exr2numpy(
     return channel
 
 
+def get_channel_names(
+        given_data_type: data_type.Type
+) -> list:
+    if given_data_type == data_type.Type.normal:
+        return ['R', 'G', 'B']
+    else:
+        return ['Y']
+
+
+# Read all channels of the given data type with one open of the file. Channels are stacked along axis and written
+# directly into out if given. With dtype float16 the half values are read without conversion.
 def getImageEXR(
         path: str,
         given_data_type: data_type.Type,
-        axis: int
+        axis: int,
+        dtype: numpy.dtype = np.float32,
+        out: numpy.ndarray = None
 ) -> numpy.ndarray:
-    if given_data_type == data_type.Type.normal:
-        channel_names = ['R', 'G', 'B']
+    channel_names = get_channel_names(given_data_type)
+    file = OpenEXR.InputFile(path)
+    dw = file.header()['dataWindow']
+    size = (dw.max.y - dw.min.y + 1, dw.max.x - dw.min.x + 1)
+    if np.dtype(dtype) == np.float16:
+        pixel_type, buffer_dtype = Imath.PixelType(Imath.PixelType.HALF), np.float16
     else:
-        channel_names = ['Y']
-    channels = []
-    for channel_name in channel_names:
-        channel = exr2numpy(path, channel_name)
-        channels.append(channel)
-    image = np.stack(channels, axis=axis)
-    array_sum = np.sum(image)
+        pixel_type, buffer_dtype = Imath.PixelType(Imath.PixelType.FLOAT), np.float32
+    channel_strs = file.channels(channel_names, pixel_type)
+    file.close()
+
+    if out is None:
+        shape = list(size)
+        shape.insert(axis % 3, len(channel_names))
+        out = np.empty(shape, dtype=dtype)
+    channels = np.moveaxis(out, axis, 0)
+    for i, channel_str in enumerate(channel_strs):
+        channels[i] = np.frombuffer(channel_str, dtype=buffer_dtype).reshape(size)
+
+    array_sum = np.sum(out, dtype=np.float32)
     if np.isnan(array_sum):
         raise Exception("{} contains nan!".format(path))
     if np.isinf(array_sum):
         raise Exception("{} contains inf!".format(path))
-    return image
+    return out
+
+
+# Read multiple exr files of the same size into one array of shape (N, ...)
+def read_many(
+        paths: typing.Sequence[str],
+        given_data_type: data_type.Type,
+        axis: int,
+        dtype: numpy.dtype = np.float32,
+        out: numpy.ndarray = None
+) -> numpy.ndarray:
+    if len(paths) <= 0:
+        raise Exception("No exr files given to read.")
+    if out is None:
+        first = getImageEXR(paths[0], given_data_type, axis, dtype)
+        out = np.empty((len(paths),) + first.shape, dtype=dtype)
+        out[0] = first
+        paths = paths[1:]
+        images = out[1:]
+    else:
+        images = out
+    for path, image in zip(paths, images):
+        getImageEXR(path, given_data_type, axis, dtype, image)
+    return out
+
+
+# Compression modes of written exr files, the default of OpenEXR (ZIP) is used if none is given
+compression_modes = {
+    'NONE': 'NO_COMPRESSION',
+    'RLE': 'RLE_COMPRESSION',
+    'ZIPS': 'ZIPS_COMPRESSION',
+    'ZIP': 'ZIP_COMPRESSION',
+    'PIZ': 'PIZ_COMPRESSION',
+    'PXR24': 'PXR24_COMPRESSION',
+    'B44': 'B44_COMPRESSION',
+    'B44A': 'B44A_COMPRESSION',
+    'DWAA': 'DWAA_COMPRESSION',
+    'DWAB': 'DWAB_COMPRESSION'
+}
 
 
 def writeImage(
         image: np.ndarray | torch.Tensor,
         given_data_type: data_type.Type,
-        path: str
+        path: str,
+        compression: str = None,
+        writer: 'BackgroundWriter' = None
 ):
+    if writer is not None:
+        writer.submit(image, given_data_type, path, compression)
+        return
+    planes = pack_channels(image, given_data_type)
+    write_planes(planes, given_data_type, path, compression)
+
+
+# Convert image to contiguous float16 planes of shape (C, H, W) in a single pass
+def pack_channels(
+        image: np.ndarray | torch.Tensor,
+        given_data_type: data_type.Type
+) -> numpy.ndarray:
     if torch.is_tensor(image):
         img = image.detach().cpu().numpy().squeeze()
     elif type(image).__module__ == np.__name__:
@@ -55,21 +134,96 @@ def writeImage(
     else:
         raise Exception("Image to write is neither torch tensor nor numpy array.")
 
-    size = img.shape
-    header = OpenEXR.Header(size[0], size[1])
-
     if given_data_type == data_type.Type.normal:
-        half_chan = Imath.Channel(Imath.PixelType(Imath.PixelType.HALF))
-        header['channels'] = dict([(c, half_chan) for c in "RGB"])
-        out = OpenEXR.OutputFile(path, header)
-        R = (img[:, :, 0]).astype(np.float16).tostring()
-        G = (img[:, :, 1]).astype(np.float16).tostring()
-        B = (img[:, :, 2]).astype(np.float16).tostring()
-        out.writePixels({'R': R, 'G': G, 'B': B})
-    else:
-        half_chan = Imath.Channel(Imath.PixelType(Imath.PixelType.HALF))
-        header['channels'] = dict([(c, half_chan) for c in "Y"])
-        out = OpenEXR.OutputFile(path, header)
-        R = (img[:, :]).astype(np.float16).tostring()
-        out.writePixels({'Y': R})
+        planes = np.empty((3,) + img.shape[:2], dtype=np.float16)
+        np.copyto(planes, np.moveaxis(img[:, :, :3], 2, 0), casting='unsafe')
+        return planes
+    return np.ascontiguousarray(img.reshape(img.shape[:2]), dtype=np.float16)[np.newaxis]
+
+
+def write_planes(
+        planes: numpy.ndarray,
+        given_data_type: data_type.Type,
+        path: str,
+        compression: str = None
+):
+    channel_names = get_channel_names(given_data_type)
+    shape_y, shape_x = planes.shape[1:]
+    header = OpenEXR.Header(shape_x, shape_y)
+    if compression is not None:
+        header['compression'] = get_compression(compression)
+    half_chan = Imath.Channel(Imath.PixelType(Imath.PixelType.HALF))
+    header['channels'] = dict([(c, half_chan) for c in channel_names])
+    out = OpenEXR.OutputFile(path, header)
+    try:
+        out.writePixels({c: planes[i].tobytes() for i, c in enumerate(channel_names)})
+    finally:
         out.close()
+
+
+def get_compression(
+        compression: str
+) -> Imath.Compression:
+    name = compression_modes.get(compression.upper())
+    if name is None or not hasattr(Imath.Compression, name):
+        raise Exception("Compression {} is not supported, use one of {}".format(compression,
+                                                                               list(compression_modes)))
+    return Imath.Compression(getattr(Imath.Compression, name))
+
+
+# Writes exr files in background threads, so the caller does not wait for compression and disk. The image is packed
+# into float16 planes on submit, afterwards the caller may reuse it. At most max_pending writes are queued, further
+# submits block until a write finished. Errors of writes are raised on flush or close.
+class BackgroundWriter:
+    def __init__(
+            self,
+            workers: int = 2,
+            max_pending: int = 16,
+            compression: str = None
+    ):
+        self.compression = compression
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers,
+                                                               thread_name_prefix='exr_writer')
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._futures = []
+        self._lock = threading.Lock()
+
+    def submit(
+            self,
+            image: np.ndarray | torch.Tensor,
+            given_data_type: data_type.Type,
+            path: str,
+            compression: str = None
+    ):
+        planes = pack_channels(image, given_data_type)
+        compression = compression if compression is not None else self.compression
+        self._pending.acquire()
+        try:
+            future = self._executor.submit(write_planes, planes, given_data_type, path, compression)
+        except Exception:
+            self._pending.release()
+            raise
+        future.add_done_callback(lambda _: self._pending.release())
+        with self._lock:
+            self._futures.append(future)
+
+    # Wait until all submitted images are written
+    def flush(self):
+        with self._lock:
+            futures, self._futures = self._futures, []
+        errors = [future.exception() for future in futures]
+        errors = [error for error in errors if error is not None]
+        if len(errors) > 0:
+            raise Exception("{} exr file(s) could not be written".format(len(errors))) from errors[0]
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,57 @@
+# Utils for distributing the cpu cores of a host between the training processes and their data loader workers
+import os
+
+import torch
+
+# Cores of the host before pinning, inherited by processes started afterwards, e.g. the other ranks of distributed
+# training, which would otherwise only see the cores of the process that started them
+host_cores_variable = 'MAPGEN_HOST_CORES'
+
+
+def available_cores() -> list:
+    if host_cores_variable in os.environ:
+        return [int(core) for core in os.environ[host_cores_variable].split(',')]
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+# Cores for the intra-op threads of the training process with the local rank and cores left over for its data loader
+# workers. The cores are split evenly between the processes of the host. Without a given # of intra-op threads, all
+# but one core of a process are used by its intra-op threads.
+def split_cores(
+        intra_op_threads: int,
+        processes: int = 1,
+        local_rank: int = 0
+) -> tuple:
+    cores = available_cores()
+    cores_per_process = max(len(cores) // processes, 1)
+    process_cores = cores[local_rank * cores_per_process:(local_rank + 1) * cores_per_process] or cores
+    threads = intra_op_threads if intra_op_threads > 0 else max(len(process_cores) - 1, 1)
+    return process_cores[:threads], process_cores[threads:]
+
+
+def set_affinity(
+        cores: list
+):
+    if hasattr(os, 'sched_setaffinity') and len(cores) > 0:
+        os.sched_setaffinity(0, cores)
+
+
+# Pins the intra-op threads of this process to its cores, threads created afterwards inherit the affinity
+def pin_process(
+        cores: list
+):
+    os.environ.setdefault(host_cores_variable, ','.join(str(core) for core in available_cores()))
+    torch.set_num_threads(len(cores))
+    set_affinity(cores)
+
+
+# worker_init_fn of data loaders to move the workers from the cores of the intra-op threads to the left over cores,
+# used with functools.partial
+def pin_worker(
+        cores: list,
+        worker_id: int
+):
+    torch.set_num_threads(1)
+    set_affinity(cores)
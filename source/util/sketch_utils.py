@@ -1,5 +1,7 @@
 # Preprocess operations for sketches
+import json
 import os
+import typing
 
 import numpy
 import numpy as np
@@ -8,19 +10,134 @@ from pathlib import Path
 
 background = 255
 bounds = 0
+# Minimal stroke radius in pixels, so rasterized lines are 4-connected and the 8-connected floodfill can not leak
+# through diagonal lines
+min_stroke_radius = 0.75
+stroke_suffixes = ('.json', '.npz')
 
 
+# Load sketch as grayscale image. Sketches given as strokes (.json or .npz) are rasterized directly at resolution dim
+# (native canvas size if 0) without any image en- and decoding.
 def load_image(
         image_path: str,
-        pad_image: bool
+        pad_image: bool,
+        dim: int = 0
 ) -> numpy.ndarray:
     if not os.path.exists(image_path):
         raise Exception("File not found {}.".format(image_path))
+    if is_stroke_file(image_path):
+        return rasterize_strokes(load_strokes(image_path), dim, pad_image)
     image = Image.open(image_path).convert('L')
-    image_arr = np.asarray(image).copy()
     if pad_image:
-        image_arr = np.pad(image_arr, 1, mode='constant', constant_values=255)
-    return image_arr
+        # padding already creates a new writable array
+        return np.pad(np.asarray(image), 1, mode='constant', constant_values=255)
+    return np.array(image)
+
+
+def is_stroke_file(
+        path: str
+) -> bool:
+    return Path(path).suffix.lower() in stroke_suffixes
+
+
+# Load strokes as polylines in pixel coordinates (x to the right, y downwards) of a canvas with given size.
+# Json: {"width": 256, "height": 256, "strokes": [{"points": [[x, y], ...], "width": 2.0, "value": 0}, ...]}
+# Npz: "size" (height, width), "points" (P, 2) of all strokes concatenated, "offsets" (S + 1) start of each stroke in
+# points, "widths" (S) and "values" (S).
+# Value 0 is a line and grey values (1 - 254) are seeds for the floodfill, a stroke with one point is a dot.
+def load_strokes(
+        path: str
+) -> dict:
+    if not os.path.exists(path):
+        raise Exception("File not found {}.".format(path))
+    suffix = Path(path).suffix.lower()
+    if suffix == '.json':
+        with open(path, 'r') as f:
+            f_json = json.load(f)
+        strokes = f_json['strokes']
+        points = [np.asarray(stroke['points'], dtype=np.float32).reshape(-1, 2) for stroke in strokes]
+        offsets = np.zeros(len(strokes) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(p) for p in points])
+        return {'size': (int(f_json['height']), int(f_json['width'])),
+                'points': np.concatenate(points) if len(points) > 0 else np.zeros((0, 2), dtype=np.float32),
+                'offsets': offsets,
+                'widths': np.asarray([stroke.get('width', 1.0) for stroke in strokes], dtype=np.float32),
+                'values': np.asarray([stroke.get('value', bounds) for stroke in strokes], dtype=np.uint8)}
+    elif suffix == '.npz':
+        with np.load(path) as f_npz:
+            return {'size': tuple(int(i) for i in f_npz['size']),
+                    'points': f_npz['points'].astype(np.float32).reshape(-1, 2),
+                    'offsets': f_npz['offsets'].astype(np.int64),
+                    'widths': f_npz['widths'].astype(np.float32),
+                    'values': f_npz['values'].astype(np.uint8)}
+    raise Exception("Strokes need to be given as {} file, not {}".format(stroke_suffixes, path))
+
+
+# Rasterize strokes into a grayscale sketch with resolution dim x dim (native canvas size if 0). Strokes are drawn in
+# the given order and every pixel, whose center is within half the stroke width of a segment, is set.
+def rasterize_strokes(
+        strokes: dict,
+        dim: int = 0,
+        pad_image: bool = True
+) -> numpy.ndarray:
+    height, width = strokes['size']
+    shape_x, shape_y = (dim, dim) if dim > 0 else (height, width)
+    scale = np.array([shape_y / width, shape_x / height], dtype=np.float32)
+    pad_width = 1 if pad_image else 0
+    image = np.full((shape_x + 2 * pad_width, shape_y + 2 * pad_width), background, dtype=np.uint8)
+    canvas = image[pad_width:pad_width + shape_x, pad_width:pad_width + shape_y]
+
+    offsets = strokes['offsets']
+    for i in range(len(offsets) - 1):
+        points = strokes['points'][offsets[i]:offsets[i + 1]] * scale
+        if len(points) == 0:
+            continue
+        if len(points) == 1:
+            points = np.concatenate((points, points))
+        radius = max(float(strokes['widths'][i]) * float(scale.mean()) / 2, min_stroke_radius)
+        for start, end in zip(points[:-1], points[1:]):
+            draw_segment(canvas, start, end, radius, strokes['values'][i])
+    return image
+
+
+def draw_segment(
+        canvas: numpy.ndarray,
+        start: numpy.ndarray,
+        end: numpy.ndarray,
+        radius: float,
+        value: int
+):
+    shape_x, shape_y = canvas.shape
+    x0 = max(int(np.floor(min(start[0], end[0]) - radius)), 0)
+    x1 = min(int(np.ceil(max(start[0], end[0]) + radius)) + 1, shape_y)
+    y0 = max(int(np.floor(min(start[1], end[1]) - radius)), 0)
+    y1 = min(int(np.ceil(max(start[1], end[1]) + radius)) + 1, shape_x)
+    if x0 >= x1 or y0 >= y1:
+        return
+    # distance of pixel centers to the segment
+    px = np.arange(x0, x1, dtype=np.float32)[np.newaxis, :] + 0.5 - start[0]
+    py = np.arange(y0, y1, dtype=np.float32)[:, np.newaxis] + 0.5 - start[1]
+    direction = end - start
+    length_sqr = float(direction @ direction)
+    if length_sqr > 0:
+        t = np.clip((px * direction[0] + py * direction[1]) / length_sqr, 0, 1)
+    else:
+        t = 0
+    dist_sqr = (px - t * direction[0]) ** 2 + (py - t * direction[1]) ** 2
+    canvas[y0:y1, x0:x1][dist_sqr <= radius ** 2] = value
+
+
+# Load sketch with colors (e.g. multiple objects drawn in different colors) as RGB
+def load_color_image(
+        image_path: str,
+        pad_image: bool
+) -> numpy.ndarray:
+    if not os.path.exists(image_path):
+        raise Exception("File not found {}.".format(image_path))
+    image = Image.open(image_path).convert('RGB')
+    if pad_image:
+        return np.pad(np.asarray(image), ((1, 1), (1, 1), (0, 0)), mode='constant', constant_values=255)
+    return np.array(image)
 
 
 def unpad(
@@ -28,21 +145,97 @@ def unpad(
         pad_width: int
 ) -> numpy.ndarray:
     shape_x, shape_y = img.shape
-    n_shape_r, n_shape_l = 0 + pad_width, shape_x - pad_width
-    return img[n_shape_r:n_shape_l, n_shape_r:n_shape_l]
+    return img[pad_width:shape_x - pad_width, pad_width:shape_y - pad_width]
+
+
+# Bounding box around all line pixels, which is extended to a square around its center
+def ink_bounding_box(
+        image: numpy.ndarray
+) -> typing.Tuple[slice, slice]:
+    ink = image <= bounds
+    rows = np.flatnonzero(ink.any(axis=1))
+    cols = np.flatnonzero(ink.any(axis=0))
+    if len(rows) == 0:
+        return slice(0, image.shape[0]), slice(0, image.shape[1])
+    r_min, r_max, c_min, c_max = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+    size = min(max(r_max - r_min, c_max - c_min), image.shape[0], image.shape[1])
+    r_min = min(max(0, (r_min + r_max - size) // 2), image.shape[0] - size)
+    c_min = min(max(0, (c_min + c_max - size) // 2), image.shape[1] - size)
+    return slice(r_min, r_min + size), slice(c_min, c_min + size)
+
+
+# Resize binary sketch via minimum over the source pixels of each target pixel, so thin lines are kept when
+# downsampling. When upsampling this is equal to nearest neighbour.
+def resize_binary(
+        image: numpy.ndarray,
+        dim: int
+) -> numpy.ndarray:
+    shape_x, shape_y = image.shape
+    rows = np.arange(dim) * shape_x // dim
+    cols = np.arange(dim) * shape_y // dim
+    return np.minimum.reduceat(np.minimum.reduceat(image, rows, axis=0), cols, axis=1)
+
+
+# Normalize sketch for map generation: convert to grayscale, binarize (everything that is not a line becomes
+# background, which also removes the grey seeds used for the floodfill), optionally crop to the lines, resize to the
+# given resolution and pad. The result is written directly into out if given.
+def normalize_sketch(
+        image: numpy.ndarray | str,
+        dim: int = 0,
+        crop: bool = False,
+        pad_width: int = 0,
+        out: numpy.ndarray = None
+) -> numpy.ndarray:
+    if isinstance(image, str) and is_stroke_file(image):
+        image = rasterize_strokes(load_strokes(image), 0 if crop else dim, False)
+    elif isinstance(image, str):
+        if not os.path.exists(image):
+            raise Exception("File not found {}.".format(image))
+        image = np.asarray(Image.open(image).convert('L'))
+    elif image.ndim == 3:
+        image = np.asarray(Image.fromarray(image).convert('L'))
+
+    if crop:
+        image = image[ink_bounding_box(image)]
+    binary = image > bounds
+    dim_x, dim_y = (dim, dim) if dim > 0 else image.shape
+    if out is None:
+        out = np.empty((dim_x + 2 * pad_width, dim_y + 2 * pad_width), dtype=np.uint8)
+    if pad_width > 0:
+        out[:pad_width] = background
+        out[-pad_width:] = background
+        out[:, :pad_width] = background
+        out[:, -pad_width:] = background
+    inner = out[pad_width:pad_width + dim_x, pad_width:pad_width + dim_y]
+    if dim > 0 and binary.shape != (dim, dim):
+        binary = resize_binary(binary, dim)
+    np.multiply(binary, background, out=inner, casting='unsafe')
+    return out
+
+
+# Normalize multiple sketches into one preallocated array of shape (N, dim + 2 * pad_width, dim + 2 * pad_width)
+def normalize_sketches(
+        images: typing.Sequence[numpy.ndarray | str],
+        dim: int,
+        crop: bool = False,
+        pad_width: int = 0
+) -> numpy.ndarray:
+    if dim <= 0:
+        raise Exception("Resolution needs to be given to normalize a batch of sketches.")
+    out = np.empty((len(images), dim + 2 * pad_width, dim + 2 * pad_width), dtype=np.uint8)
+    for i, image in enumerate(images):
+        normalize_sketch(image, dim, crop, pad_width, out[i])
+    return out
 
 
 def clean_userinput(
         image_path: str,
-        output_path: str
+        output_path: str,
+        dim: int = 0,
+        crop: bool = False
 ):
-    image = load_image(image_path, False)
+    image = normalize_sketch(image_path, dim, crop)
     filename = Path(image_path)
-    for i in range(len(image[0])):
-        for j in range(len(image[1])):
-            if image[i, j] > bounds and image[i, j] < background:
-                image[i, j] = background
-
-    cleaned_image_path = os.path.join(output_path, filename.name)
+    cleaned_image_path = os.path.join(output_path, filename.stem + '.png')
     cleaned_image = Image.fromarray(image)
     cleaned_image.save(cleaned_image_path)